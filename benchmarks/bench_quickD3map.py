@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+bench_quickD3map
+----------------------------------
+
+Benchmarks for the map pipeline on generated data.
+
+Every case is run at each scale (rows for PointMap, edges for LineMap) and
+timed stage by stage:
+
+    validate   constructing the map: column checks, verify_dfs_forLineMap
+    convert    convert_data: hashing the data and convert_to_geojson
+    render     build_map, with the conversion already done
+    write      create_map into a temporary file
+
+For every stage the wall time (best of --repeat runs) and the peak memory
+allocated by Python (tracemalloc, measured in a separate run so it does not
+slow the timings) are recorded, along with the size of the converted data
+and of the written page.
+
+The time of a bare `import quickD3map` is measured as well, in a fresh
+interpreter, best of at least IMPORT_RUNS runs. It must stay within
+IMPORT_BUDGET seconds, and within IMPORT_TOLERANCE times its baseline.
+
+Results are compared against the stored baselines and the script exits
+with status 1 when a stage got slower or more memory hungry than allowed,
+when an output size changed, or when the import got too slow.
+
+Usage:
+    python benchmarks/bench_quickD3map.py                      # compare
+    python benchmarks/bench_quickD3map.py --scales 1000 10000  # smaller run
+    python benchmarks/bench_quickD3map.py --save               # new baselines
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from quickD3map import PointMap, LineMap, DensityMap, ChoroplethMap
+
+
+SCALES = [1000, 10000, 100000, 1000000]
+STAGES = ['validate', 'convert', 'render', 'write']
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+TIME_TOLERANCE = 1.5      # allowed slowdown factor
+MEMORY_TOLERANCE = 1.25   # allowed peak memory growth factor
+MIN_SECONDS = 0.05        # slowdowns below this are treated as noise
+
+IMPORT_KEY = 'import'
+IMPORT_BUDGET = 0.1       # seconds for `import quickD3map`, which must not load pandas, jinja2 or Flask
+IMPORT_TOLERANCE = 2.     # allowed slowdown factor of the import; it is short, so noisier
+IMPORT_MIN_SECONDS = 0.01 # import slowdowns below this are treated as noise
+IMPORT_RUNS = 5
+
+
+## Synthetic Data
+#####################################################
+def points(rows, seed=0):
+    ''' Stations with coordinates, three numeric columns and a label '''
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({'latitude':  rng.uniform(-60, 70, rows),
+                         'longitude': rng.uniform(-180, 180, rows),
+                         'temp':      rng.normal(15, 10, rows),
+                         'elev':      rng.randint(0, 4000, rows),
+                         'wind':      rng.gamma(2., 3., rows),
+                         'name':      ['station{}'.format(i) for i in range(rows)]},
+                        columns=['latitude', 'longitude', 'temp', 'elev', 'wind', 'name'])
+
+def dense_edges(edges, seed=0):
+    ''' The fewest nodes whose complete graph holds `edges` pairs, and the
+        first `edges` of those pairs with a random weight '''
+    nodes = int(np.ceil((1 + np.sqrt(1 + 8. * edges)) / 2))
+    df = points(nodes, seed)
+    src, tgt = np.triu_indices(nodes, 1)
+    rng = np.random.RandomState(seed + 1)
+    distances = pd.DataFrame({0: df['name'].values[src[:edges]],
+                              1: df['name'].values[tgt[:edges]],
+                              2: rng.uniform(0, 1, edges)})
+    return df, distances
+
+
+## Cases
+#####################################################
+def point_map(rows):
+    df = points(rows)
+    return lambda: PointMap(df)
+
+def point_map_columns(rows):
+    df = points(rows)
+    return lambda: PointMap(df, columns=['temp', 'elev', 'wind', 'name'])
+
+def density_map(rows):
+    df = points(rows)
+    return lambda: DensityMap(df, column='temp', statistic='mean')
+
+def choropleth_map(rows):
+    df = points(rows)
+    return lambda: ChoroplethMap(df, column='temp', statistic='mean', map='world_map')
+
+def line_map(edges):
+    df, distances = dense_edges(edges)
+    return lambda: LineMap(df, 'name', distances)
+
+CASES = [('PointMap', point_map),
+         ('PointMap_columns', point_map_columns),
+         ('DensityMap', density_map),
+         ('ChoroplethMap', choropleth_map),
+         ('LineMap_dense', line_map)]
+
+
+## Runner
+#####################################################
+def run_stages(make, out_dir):
+    ''' Run every stage once, returning {stage: seconds} and the output sizes '''
+    path = os.path.join(out_dir, 'map.html')
+    seconds = {}
+    start = time.time()
+    m = make()
+    seconds['validate'] = time.time() - start
+    start = time.time()
+    m.convert_data()
+    seconds['convert'] = time.time() - start
+    start = time.time()
+    m.build_map()
+    seconds['render'] = time.time() - start
+    start = time.time()
+    m.create_map(path)
+    seconds['write'] = time.time() - start
+    data = sum(len(m.template_vars.get(var) or '') for var in m.conversion_vars
+               if isinstance(m.template_vars.get(var), str))
+    return seconds, {'data_bytes': data, 'page_bytes': os.path.getsize(path)}
+
+def peak_memory(make, out_dir):
+    ''' Peak bytes allocated during each stage, measured with tracemalloc '''
+    path = os.path.join(out_dir, 'map.html')
+    steps = [('validate', None), ('convert', lambda m: m.convert_data()),
+             ('render', lambda m: m.build_map()),
+             ('write', lambda m: m.create_map(path))]
+    peaks = {}
+    tracemalloc.start()
+    try:
+        m = None
+        for stage, step in steps:
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            if step is None:
+                m = make()
+            else:
+                step(m)
+            peaks[stage] = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+def import_seconds(runs=IMPORT_RUNS):
+    ''' Best wall time of `import quickD3map` in a fresh interpreter '''
+    code = ("import time; start = time.time(); import quickD3map; "
+            "print(time.time() - start)")
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    return min(float(subprocess.check_output([sys.executable, '-c', code], cwd=root))
+               for _ in range(runs))
+
+def run(scales, repeat, memory=True):
+    results = {IMPORT_KEY: {'seconds': {IMPORT_KEY: import_seconds(max(repeat, IMPORT_RUNS))}}}
+    print('{:<18}{:>9}  {:.3f}s'.format(IMPORT_KEY, '', results[IMPORT_KEY]['seconds'][IMPORT_KEY]))
+    out_dir = tempfile.mkdtemp()
+    try:
+        for name, case in CASES:
+            for scale in scales:
+                make = case(scale)
+                runs = [run_stages(make, out_dir) for _ in range(repeat if scale < 1000000 else 1)]
+                best = dict((stage, min(r[0][stage] for r in runs)) for stage in STAGES)
+                entry = {'seconds': best}
+                entry.update(runs[0][1])
+                if memory:
+                    entry['peak_bytes'] = peak_memory(make, out_dir)
+                results['{}/{}'.format(name, scale)] = entry
+                print(format_entry(name, scale, entry))
+                sys.stdout.flush()
+    finally:
+        shutil.rmtree(out_dir)
+    return results
+
+def format_entry(name, scale, entry):
+    times = '  '.join('{}={:.3f}s'.format(stage, entry['seconds'][stage]) for stage in STAGES)
+    peak = entry.get('peak_bytes')
+    memory = '  peak={:.1f}MB'.format(max(peak.values()) / 2. ** 20) if peak else ''
+    return '{:<18}{:>9}  {}{}  page={:.2f}MB'.format(name, scale, times, memory,
+                                                     entry['page_bytes'] / 2. ** 20)
+
+
+## Baselines
+#####################################################
+def compare(results, baselines, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    ''' Return a list of regression messages for results against baselines '''
+    problems = []
+    for key, entry in sorted(results.items()):
+        base = baselines.get(key)
+        if key == IMPORT_KEY:
+            problems += compare_import(entry['seconds'][key], base and base['seconds'][key])
+            continue
+        if base is None:
+            continue
+        for stage in STAGES:
+            now, then = entry['seconds'][stage], base['seconds'][stage]
+            if now > then * time_tolerance and now - then > MIN_SECONDS:
+                problems.append('{} {}: {:.3f}s, baseline {:.3f}s'.format(key, stage, now, then))
+            if 'peak_bytes' in entry and 'peak_bytes' in base:
+                now, then = entry['peak_bytes'][stage], base['peak_bytes'][stage]
+                if now > then * memory_tolerance and now - then > 1 << 20:
+                    problems.append('{} {} memory: {:.1f}MB, baseline {:.1f}MB'
+                                    .format(key, stage, now / 2. ** 20, then / 2. ** 20))
+        for size in ['data_bytes', 'page_bytes']:
+            if entry[size] != base[size]:
+                problems.append('{} {}: {}, baseline {}'.format(key, size, entry[size], base[size]))
+    return problems
+
+def compare_import(now, then=None):
+    ''' Regression messages for the import time against the budget and its baseline '''
+    problems = []
+    if now > IMPORT_BUDGET:
+        problems.append('{}: {:.3f}s, budget {:.3f}s'.format(IMPORT_KEY, now, IMPORT_BUDGET))
+    if then is not None and now > then * IMPORT_TOLERANCE and now - then > IMPORT_MIN_SECONDS:
+        problems.append('{}: {:.3f}s, baseline {:.3f}s'.format(IMPORT_KEY, now, then))
+    return problems
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES)
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs per case, best is kept')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs')
+    parser.add_argument('--baselines', default=BASELINES)
+    parser.add_argument('--save', action='store_true', help='store the results as the new baselines')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    results = run(args.scales, args.repeat, memory=not args.no_memory)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.save:
+        baselines = {}
+        if os.path.exists(args.baselines):
+            with open(args.baselines) as f:
+                baselines = json.load(f)
+        baselines.update(results)
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=1, sort_keys=True)
+        print('saved {} results to {}'.format(len(results), args.baselines))
+        return 0
+    if not os.path.exists(args.baselines):
+        print('no baselines at {}, run with --save first'.format(args.baselines))
+        return 0
+    with open(args.baselines) as f:
+        problems = compare(results, json.load(f))
+    for problem in problems:
+        print('REGRESSION', problem)
+    print('{} regressions'.format(len(problems)))
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
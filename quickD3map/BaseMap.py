@@ -3,21 +3,40 @@
 
 from __future__ import (absolute_import, division, print_function )
 
-import codecs
-import pandas as pd
+import io
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+from contextlib import contextmanager
 
+import pandas as pd
 
-from jinja2 import Environment, PackageLoader
-from flask  import Flask, render_template_string
 
-from .utilities import  latitude,longitude, map_templates
+from . import __version__
+from .assets import get_environment, static_asset_vars, load_basemap, write_assets
+from .utilities import  latitude,longitude, map_templates, zoom_templates, static_assets, renderers, canvas_templates
+from .clustering import ZOOM_SCALES
+from .topology import choose_level, data_bounds, LOD_LEVELS, CLIP_MARGIN
+from .chunked import ChunkedSource, SPOOL_MARKER, copy_spool
+from .encoders import CHUNKSIZE, notnull_mask
 from .check_data import  check_column, check_center, check_projection
 
+WRITE_BLOCKSIZE = 1 << 16  # characters buffered before each write in write_map
+BUILD_STAGES = ['convert', 'basemap', 'render', 'write', 'write_assets']
+CONVERSION_VERSION = 1     # bump when the output of any convert_to_geojson changes
+
+logger = logging.getLogger('quickD3map')
+
 
 class BaseMap(object): 
     ''' Check DataFrame Accuracy And Setup Maps '''
     def __init__(self, df, width=960, height=500, map="world_map", 
-                 center=None, projection="mercator", title= None):       
+                 center=None, projection="mercator", title= None, cache_dir=None,
+                 lod=None, max_zoom=None, clip=False, clip_margin=CLIP_MARGIN,
+                 chunksize=CHUNKSIZE, renderer="svg", hook=None):       
         '''
         The BaseMap class is here to handle all of the generic aspects of
         setting up a Latitude and Longitude based map. These aspects are:
@@ -28,8 +47,11 @@ class BaseMap(object):
     
          Parameters
         ----------
-        df: pandas dataframe, required.
-            dataframe with latitude and longitude columns.
+        df: pandas dataframe, CSV path or iterator of dataframes, required.
+            dataframe with latitude and longitude columns. A CSV path or an
+            iterator of chunks (e.g. pd.read_csv(..., chunksize=...)) is
+            read chunk by chunk and never loaded whole; self.df is then None
+            and self.chunks holds the ChunkedSource.
         width: int, default 960
             Width of the map.
         height: int, default 500
@@ -40,48 +62,347 @@ class BaseMap(object):
            a projection that is one of the projecions recognized by d3.js
         center: tuple or list of two. default=None
            a projection that is one of the projecions recognized by d3.js
+        cache_dir: str, default None
+           directory where data conversions are saved under a hash of the
+           data and conversion options, so later runs can reuse them.
+           Simplified basemaps are cached here as well.
+        lod: None, "auto" or int, default None
+           basemap level of detail. None embeds the bundled TopoJSON, "auto"
+           picks a simplified variant from width/height and max_zoom, and an
+           int selects one of topology.LOD_LEVELS (basemap width in pixels).
+        max_zoom: float, default None
+           how far the map will be zoomed in relative to its initial size,
+           used by lod="auto". Defaults to the full zoom range of the
+           zoomable world templates and 1 for the others.
+        clip: boolean, default False
+           embed only the basemap geometries intersecting the extent of the
+           data plus clip_margin degrees. Clipped basemaps are cached by
+           extent, rounded out to a 10 degree grid.
+        clip_margin: float, default 5
+           degrees added around the data extent when clipping.
+        chunksize: int, default 50000
+           rows per chunk when df is a CSV path.
+        renderer: str, default "svg"
+           "svg" draws one svg path per feature. "canvas" uses the canvas
+           variant of the template from utilities.canvas_templates, which
+           batch draws points and lines on a <canvas> and picks hovered
+           points with a quadtree; suited to hundreds of thousands of points.
+        hook: callable, default None
+           called with an event dict {'map', 'stage', 'seconds'} after every
+           timed stage, and with stage "build" and the full `stats` once a
+           page is built or written. Events are also logged to the
+           "quickD3map" logger at DEBUG level.
+
+        After build_map, write_map or create_map, `stats` holds the wall time
+        of each stage ('validate', 'assets', 'convert', 'basemap', 'render',
+        'write', ...), the row/point counts with the NA rows dropped, and the
+        page size split into libraries, basemap, data and template bytes.
     
         '''
+        self.hook = hook
+        self.stats = {'seconds': {}, 'counts': {}, 'bytes': {}}
+
         # Check Inputs For Bad or Inconsistent Data
-        assert isinstance(df, pd.core.frame.DataFrame)
-        self.df  = df
-        self.lat = check_column(self.df, latitude,  'latitude')
-        self.lon = check_column(self.df, longitude, 'longitude')
+        with self.stage('validate'):
+            if isinstance(df, pd.core.frame.DataFrame):
+                self.df, self.chunks = df, None
+                columns = df
+            else:
+                self.df, self.chunks = None, ChunkedSource(df, chunksize)
+                columns = self.chunks.head
+            self.lat = check_column(columns, latitude,  'latitude')
+            self.lon = check_column(columns, longitude, 'longitude')
         self.map = map
         self.center= check_center(center)
         self.projection = check_projection(projection)
         self.title=title
+        if not (lod is None or lod == "auto" or lod in LOD_LEVELS):
+            raise ValueError("lod must be None, 'auto' or one of {}".format(LOD_LEVELS))
+        if renderer not in renderers:
+            raise ValueError("Renderer must be one of the following:{}".format(renderers))
+        self.renderer = renderer
+        self.lod = lod
+        self.max_zoom = max_zoom
+        self.clip = clip
+        self.clip_margin = clip_margin
     
-        #Template Information Here
-        self.env = Environment(loader=PackageLoader('quickD3map', 'templates'))
-        self.template_vars = {'width': width, 'height': height, 'center': self.center,
-                              'projection':self.projection, "title":self.title}
-                              
-        #add all template combinations. Specify Template Subsets in map classes
-        self.map_templates = map_templates
-                                   
-        #JS Libraries and CSS Styling
-        self.template_vars['d3_projection'] =  self.env.get_template('d3.geo.projection.v0.min.js').render()
-        self.template_vars['topojson'] =  self.env.get_template('topojson.v1.min.js').render()
-        self.template_vars['d3js'] =  self.env.get_template('d3.v3.min.js').render()
-        self.template_vars['style'] =  self.env.get_template('style.css').render()
-        self.template_vars['colorbrewer_css'] =  self.env.get_template('colorbrewer.css').render()
-        self.template_vars['colorbrewer_js'] =  self.env.get_template('colorbrewer.js').render()
-       
+        #Template Information Here. The environment and assets are shared by all maps
+        with self.stage('assets'):
+            self.env = get_environment()
+            self.template_vars = {'width': width, 'height': height, 'center': self.center,
+                                  'projection':self.projection, "title":self.title}
+                                  
+            #add all template combinations. Specify Template Subsets in map classes
+            self.map_templates = map_templates
+                                       
+            #JS Libraries and CSS Styling
+            self.template_vars.update(static_asset_vars())
+        
+        #Conversion memoization: key of the data currently in template_vars
+        self.cache_dir = cache_dir
+        self._conversion_key = None
+        self.last_conversion = None
+
+    ## Instrumentation
+    ########################################################################################
+    @contextmanager
+    def stage(self, name):
+        '''Time a block as stage `name` in stats['seconds'] and report it to the hook.
+           A stage that raises is still timed, and its event carries the `error`.'''
+        start = time.time()
+        event = {'map': type(self).__name__, 'stage': name}
+        try:
+            yield
+        except Exception as e:
+            event['error'] = repr(e)
+            raise
+        finally:
+            event['seconds'] = self.stats['seconds'][name] = time.time() - start
+            self._emit(event)
+
+    def _emit(self, event):
+        logger.debug("%s %s %.4fs", event['map'], event['stage'], event['seconds'])
+        if self.hook is not None:
+            self.hook(event)
+
+    def _start_build(self):
+        for name in BUILD_STAGES:
+            self.stats['seconds'].pop(name, None)
+        self._build_start = time.time()
+
+    def _finish_build(self, page_bytes):
+        '''Record the byte breakdown of a finished page and send the "build" event'''
+        external = 'assets' in self.template_vars
+        libraries = 0 if external else sum(len(self.template_vars[var].encode('utf-8'))
+                                           for var in static_assets)
+        basemap = 0 if external else len(self.template_vars['map_data'].encode('utf-8'))
+        spool = self.template_vars.get('spool')
+        data = sum(len(self.template_vars[var].encode('utf-8')) for var in self.conversion_vars
+                   if isinstance(self.template_vars.get(var), str)
+                   and self.template_vars[var] != SPOOL_MARKER)
+        if spool:
+            data += os.path.getsize(spool['path'])
+        self.stats['bytes'] = {'page': page_bytes, 'libraries': libraries, 'basemap': basemap,
+                               'data': data, 'template': page_bytes - libraries - basemap - data}
+        self._emit({'map': type(self).__name__, 'stage': 'build',
+                    'seconds': time.time() - self._build_start, 'stats': self.stats})
+
+    def conversion_counts(self):
+        '''Rows in the input, points kept and rows dropped for a NA latitude/longitude'''
+        spool = self.template_vars.get('spool')
+        if spool:
+            rows, points = spool['rows'] + spool['dropped'], spool['rows']
+        else:
+            rows = len(self.df)
+            points = int(notnull_mask(self.df[self.lat].values, self.df[self.lon].values).sum())
+        return {'rows': rows, 'points': points, 'na_dropped': rows - points}
+
+    ## Basemap Level of Detail
+    ########################################################################################
+    def basemap_level(self):
+        '''Return the LOD level of the basemap, or None for the bundled file'''
+        if self.lod != "auto":
+            return self.lod
+        max_zoom = self.max_zoom
+        if max_zoom is None:
+            zoomable = self.map_templates[self.map]['template'] in zoom_templates
+            max_zoom = ZOOM_SCALES[-1] / ZOOM_SCALES[0] if zoomable else 1
+        return choose_level(self.template_vars['width'], self.template_vars['height'], max_zoom)
+
+    def basemap_bounds(self):
+        '''Return the (west, south, east, north) extent to clip the basemap to, or None'''
+        if not self.clip:
+            return None
+        if self.chunks is not None:
+            # per-chunk extremes recorded while spooling
+            self.convert_data()
+            spool = self.template_vars['spool']
+            return data_bounds(spool['lon'], spool['lat'], self.clip_margin)
+        return data_bounds(self.df[self.lon].values, self.df[self.lat].values, self.clip_margin)
+
+    def basemap(self):
+        '''Return the TopoJSON text embedded in the page'''
+        return load_basemap(self.map, self.basemap_level(), self.cache_dir, self.basemap_bounds())
+
+    ## Data Conversion Caching
+    ########################################################################################
+    # template vars written by convert_to_geojson. Set by each map class
+    conversion_vars = ['geojson']
+
+    def conversion_options(self):
+        '''Settings besides the data that change the output of convert_to_geojson'''
+        return {}
+
+    def conversion_frames(self):
+        '''DataFrames, restricted to the relevant columns, read by convert_to_geojson'''
+        return [self.df[[self.lat, self.lon]]]
+
+    def conversion_key(self):
+        '''Hash of the relevant data columns and the conversion options, tied to
+           the package and conversion format versions so upgrades never read
+           stale conversions from cache_dir. For an iterator source only the
+           options are hashed; the key then only serves this map object.'''
+        digest = hashlib.sha1(type(self).__name__.encode('utf-8'))
+        digest.update('{} {}'.format(__version__, CONVERSION_VERSION).encode('utf-8'))
+        if self.chunks is not None:
+            digest.update(repr(self.chunks.key()).encode('utf-8'))
+        for frame in ([] if self.chunks is not None else self.conversion_frames()):
+            digest.update(repr(list(frame.columns)).encode('utf-8'))
+            digest.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+        digest.update(repr(sorted(self.conversion_options().items())).encode('utf-8'))
+        return digest.hexdigest()
+
+    def convert_data(self):
+        '''Run convert_to_geojson only if the data or conversion options changed.
+        
+        Returns where the data template vars came from: "unchanged" when
+        the previous conversion still applies, "disk" when it was read from
+        cache_dir and "converted" when convert_to_geojson ran.
+        '''
+        key = self.conversion_key()
+        if key == self._conversion_key:
+            self.last_conversion = "unchanged"
+            return self.last_conversion
+        cached = self._read_conversion(key)
+        if cached is not None:
+            self.template_vars.update(cached)
+            self.last_conversion = "disk"
+        else:
+            self.convert_to_geojson()
+            self._write_conversion(key)
+            self.last_conversion = "converted"
+        self._conversion_key = key
+        return self.last_conversion
+
+    def _disk_cache(self):
+        '''Whether conversions go to cache_dir: not for one-shot iterators,
+           which cannot be told apart by a key'''
+        return self.cache_dir is not None and (self.chunks is None or self.chunks.key() is not None)
+
+    def _conversion_path(self, key):
+        return os.path.join(self.cache_dir, '{}.json'.format(key))
+
+    def _read_conversion(self, key):
+        if not self._disk_cache() or not os.path.exists(self._conversion_path(key)):
+            return None
+        with open(self._conversion_path(key), 'rb') as f:
+            cached = json.loads(f.read().decode('utf-8'))
+        spool = cached.get('spool')
+        if spool is not None and not os.path.exists(spool['path']):
+            return None
+        return cached
+
+    def _write_conversion(self, key):
+        if not self._disk_cache():
+            return
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        path = self._conversion_path(key)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(json.dumps(dict((var, self.template_vars.get(var))
+                                    for var in self.conversion_vars)).encode('utf-8'))
+        os.rename(tmp, path)
 
     ## Display Methods
     ########################################################################################   
     def build_map(self):
         '''Build HTML/JS/CSS from Templates given current map type'''
-        self.convert_to_geojson()
-        map =  self.env.get_template( self.map_templates[self.map]['json'] )
-        self.template_vars['map_data'] = map.render()
+        self._start_build()
+        html_templ = self.prepare_map()
+        if self.template_vars.get('spool'):
+            # spooled data is copied in while writing
+            self._write_page(html_templ, io.BytesIO(), keep_html=True)
+            return
         #generate html
-        html_templ = self.env.get_template(self.map_templates[self.map]['template'])
-        self.HTML = html_templ.render(self.template_vars)
-        
+        with self.stage('render'):
+            self.HTML = html_templ.render(self.template_vars)
+        self._finish_build(len(self.HTML.encode('utf-8')))
+
+    def prepare_map(self):
+        '''Fill the data and basemap template vars and return the page template'''
+        with self.stage('convert'):
+            self.convert_data()
+        self.stats['counts'] = self.conversion_counts()
+        with self.stage('basemap'):
+            self.template_vars['map_data'] = self.basemap()
+        return self.env.get_template(self.page_template())
+
+    def page_template(self):
+        '''Name of the page template for the map type and renderer'''
+        template = self.map_templates[self.map]['template']
+        if self.renderer == "canvas":
+            if template not in canvas_templates:
+                raise ValueError("Canvas rendering is only available for the world maps")
+            return canvas_templates[template]
+        return template
 
-    def create_map(self, path='map.html'):
+    def write_map(self, stream, compress=False, keep_html=False, encoding='utf-8'):
+        ''' Stream the rendered map into a writable binary stream.
+            The page is produced with the template's generate() and written
+            in blocks, so the full HTML never has to be held in memory.
+            Data spooled from chunked input is copied from its spool file
+            where the template printed SPOOL_MARKER.
+
+        Parameters:
+        -----------
+        stream: file-like, required
+            any object with a write method accepting bytes.
+        compress: boolean, default False
+            gzip the output on the fly.
+        keep_html: boolean, default False
+            also keep the rendered page as self.HTML.
+        encoding: str, default 'utf-8'
+            encoding of the written page.
+        '''
+        self._start_build()
+        self._write_page(self.prepare_map(), stream, compress, keep_html, encoding)
+
+    def _write_page(self, html_templ, stream, compress=False, keep_html=False, encoding='utf-8'):
+        '''Generate and write the page; the time spent in write calls is the
+           "write" stage and the remaining generation time the "render" stage'''
+        spool = self.template_vars.get('spool')
+        out = gzip.GzipFile(fileobj=stream, mode='wb') if compress else stream
+        html, block = [], []
+        size = [0]
+        written = [0, 0.]    # bytes, seconds
+        def flush():
+            data = ''.join(block).encode(encoding)
+            start = time.time()
+            out.write(data)
+            written[0] += len(data)
+            written[1] += time.time() - start
+            del block[:]
+            size[0] = 0
+        def emit(text):
+            if keep_html:
+                html.append(text)
+            block.append(text)
+            size[0] += len(text)
+            if size[0] >= WRITE_BLOCKSIZE:
+                flush()
+        start = time.time()
+        try:
+            for chunk in html_templ.generate(self.template_vars):
+                if spool and SPOOL_MARKER in chunk:
+                    before, after = chunk.split(SPOOL_MARKER, 1)
+                    emit(before)
+                    copy_spool(spool['path'], emit, WRITE_BLOCKSIZE)
+                    chunk = after
+                emit(chunk)
+            flush()
+        finally:
+            if compress:
+                out.close()
+        if keep_html:
+            self.HTML = ''.join(html)
+        self.stats['seconds']['render'] = time.time() - start - written[1]
+        self.stats['seconds']['write'] = written[1]
+        for name in ['render', 'write']:
+            self._emit({'map': type(self).__name__, 'stage': name, 'seconds': self.stats['seconds'][name]})
+        self._finish_build(written[0])
+
+    def create_map(self, path='map.html', compress=False, keep_html=False, asset_dir=None):
         ''' utility function used by all map classes 
             to write Map to file
 
@@ -89,19 +410,47 @@ class BaseMap(object):
         -----------
         path: string, default 'map.html'
             Path for HTML output for map
+        compress: boolean, default False
+            write gzipped HTML, e.g. to 'map.html.gz'
+        keep_html: boolean, default False
+            keep a copy of the page as self.HTML
+        asset_dir: string, default None
+            if given, the JS/CSS libraries and the basemap are written once
+            into this directory under content-hashed names and the page
+            links to them instead of inlining them.
         '''
-        self.build_map()
-        with codecs.open(path, 'w') as f:
-            f.write(self.HTML)
+        self._start_build()
+        if asset_dir is not None:
+            page_dir = os.path.dirname(os.path.abspath(path))
+            base_url = os.path.relpath(os.path.abspath(asset_dir), page_dir).replace(os.sep, '/')
+            with self.stage('write_assets'):
+                self.template_vars['assets'] = write_assets(asset_dir, self.map, base_url,
+                                                            self.basemap_level(), self.cache_dir,
+                                                            self.basemap_bounds())
+        # the page is written next to `path` and moved over it once complete,
+        # so a failing conversion or render never leaves a truncated file
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                self._write_page(self.prepare_map(), f, compress=compress, keep_html=keep_html)
+            os.replace(tmp, path)
+        finally:
+            self.template_vars.pop('assets', None)
+            if os.path.exists(tmp):
+                os.remove(tmp)
 
-    def display_map(self):
+    def display_map(self, viewport=False, **kwargs):
         ''' utility function used by all map classes 
-            to display map. Creates a Flask App.
+            to display map. Serves the prebuilt page from a MapServer.
             Down the line maybe an IPython Widget as well?
+
+        Parameters:
+        -----------
+        viewport: boolean, default False
+            serve points on demand for the visible area instead of
+            embedding them all (zoomable world maps only).
+        **kwargs:
+            passed to MapServer.run, e.g. host, port, threaded.
         '''
-        app = Flask(__name__)
-        self.build_map()
-        @app.route('/')
-        def index():
-            return render_template_string(self.HTML)
-        app.run()
\ No newline at end of file
+        from .server import MapServer
+        MapServer().mount('map', self, viewport=viewport).run(**kwargs)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function )
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from .BaseMap import BaseMap
+from .assets import load_asset
+from .encoders import is_numeric, notnull_mask, CHUNKSIZE
+from .regions import RegionTotals, region_index, choropleth_to_json, STATISTICS
+from .utilities import map_templates, zoom_templates, choropleth_objects
+from .check_data import check_columns
+
+
+class ChoroplethMap(BaseMap):
+    ''' Create a ChoroplethMap with quickD3map '''
+    def __init__(self, df, column=None, statistic="count", title="quickD3Map", map="us_states",
+                 cache_dir=None, width=960, height=500, lod=None, max_zoom=None,
+                 chunksize=CHUNKSIZE, hook=None):
+
+        '''
+        The ChoroplethMap class joins the points of a dataframe with Lat/lon
+        columns to the states or countries of the basemap and colors every
+        region by its count of points, or the sum or mean of a column.
+        The join runs in Python against a cached grid index of the region
+        polygons, see regions.py.
+
+        Parameters
+        ----------
+        df: pandas dataframe, CSV path or iterator of dataframes, required.
+            dataframe with latitude and longitude columns. Chunked input is
+            joined chunk by chunk, see BaseMap.
+        column: str, default None
+            numeric column aggregated with statistic "sum" or "mean".
+        statistic: str, default "count"
+            what colors a region: "count" of points, or the "sum" or "mean"
+            of `column`. NA values of the column are left out of the
+            sum/mean; regions without any value are drawn grey.
+        map: str, default "us_states".
+           template to be used for mapping: the states of "us_states" or the
+           countries of the world maps.
+        cache_dir: str, default None
+            directory for reusing data conversions and region indexes across
+            runs.
+        width: int, default 960
+            width of the map in pixels.
+        height: int, default 500
+            height of the map in pixels.
+        lod: None, "auto" or int, default None
+            basemap level of detail, see BaseMap.
+        max_zoom: float, default None
+            zoom factor the basemap should stay sharp up to with lod="auto".
+        chunksize: int, default 50000
+            rows per chunk when df is a CSV path.
+        hook: callable, default None
+            receives an event dict for every timed stage, see BaseMap.
+
+        Returns
+        -------
+        ChoroplethMap object with the create_map/display_map methods of
+        PointMap, and region_table() for the joined values.
+
+        Examples
+        --------
+        >>>from quickD3map import ChoroplethMap
+        >>>ChoroplethMap(df).create_map("states.html")
+        >>>ChoroplethMap(df, column="ELEV", statistic="mean", map="world_map").display_map()
+
+        '''
+        projection = "mercator" if map in map_templates and \
+            map_templates[map]['template'] in zoom_templates else "albers"
+        super(ChoroplethMap, self).__init__(df=df, width=width, height=height, map=map,
+                                            projection=projection, cache_dir=cache_dir,
+                                            lod=lod, max_zoom=max_zoom, chunksize=chunksize,
+                                            hook=hook)
+        head = self.df if self.chunks is None else self.chunks.head
+        if statistic not in STATISTICS:
+            raise ValueError("statistic must be one of the following:{}".format(STATISTICS))
+        if statistic != "count":
+            if column is None:
+                raise ValueError("The {} statistic needs a column".format(statistic))
+            check_columns(head, [column])
+            if not is_numeric(head[column].values):
+                raise ValueError("The {} statistic needs a numeric column".format(statistic))
+        if map not in choropleth_objects:
+            raise ValueError("Map type must be one of the following:{}".format(list(choropleth_objects)))
+        self.map = map
+        self.column = column if statistic != "count" else None
+        self.statistic = statistic
+
+        self.template_vars['title'] = title
+        self.template_vars['zoomable'] = projection == "mercator"
+
+    def page_template(self):
+        '''Choropleth maps have one page for all basemaps'''
+        return 'choropleth_map.html'
+
+    def region_index(self):
+        '''The RegionIndex of the basemap regions, built from the bundled file'''
+        filename = map_templates[self.map]['json']
+        return region_index(filename, load_asset(filename), choropleth_objects[self.map],
+                            self.cache_dir)
+
+    conversion_vars = ['choropleth']
+
+    def conversion_options(self):
+        return {'column': self.column, 'statistic': self.statistic, 'map': self.map}
+
+    def conversion_frames(self):
+        return [self.df[[self.lat, self.lon] + ([self.column] if self.column else [])]]
+
+    def conversion_counts(self):
+        if self.chunks is None:
+            return super(ChoroplethMap, self).conversion_counts()
+        choropleth = json.loads(self.template_vars['choropleth'])
+        rows, points = choropleth['rows'], choropleth['points']
+        return {'rows': rows, 'points': points, 'na_dropped': rows - points}
+
+    def convert_to_geojson(self):
+        ''' Join the points to the regions with RegionTotals, chunk by chunk
+            for chunked input, and keep the per-region counts and values as
+            the "choropleth" template var. Rows with NA lat/lon values are
+            dropped; points outside all regions are only counted. '''
+        totals = RegionTotals(self.region_index())
+        rows = 0
+        for chunk in ([self.df] if self.chunks is None else self.chunks):
+            lats, lons = chunk[self.lat].values, chunk[self.lon].values
+            mask = notnull_mask(lats, lons)
+            values = chunk[self.column].values[mask] if self.column else None
+            totals.update(np.asarray(lons[mask], dtype='float64'), np.asarray(lats[mask], dtype='float64'),
+                          values)
+            rows += len(chunk)
+        self.template_vars['choropleth'] = choropleth_to_json(totals, choropleth_objects[self.map],
+                                                              self.statistic, self.column, rows)
+
+    def region_table(self):
+        ''' Return a DataFrame with the id, point count and value of every region '''
+        self.convert_data()
+        choropleth = json.loads(self.template_vars['choropleth'])
+        return pd.DataFrame({'id': choropleth['ids'], 'count': choropleth['counts'],
+                             'value': [np.nan if v is None else v for v in choropleth['values']]},
+                            columns=['id', 'count', 'value'])
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import (absolute_import, division, print_function )
+
+import json
+
+import numpy as np
+
+from .BaseMap import BaseMap
+from .encoders import is_numeric, notnull_mask, CHUNKSIZE
+from .clustering import CELL_PIXELS
+from .density import DensityGrid, density_to_json, SHAPES, STATISTICS
+from .utilities import map_templates, density_templates
+from .topology import CLIP_MARGIN
+from .check_data import check_columns
+
+
+class DensityMap(BaseMap):
+    ''' Create a DensityMap with quickD3map '''
+    def __init__(self, df, column=None, statistic="count", shape="hex", cell_pixels=CELL_PIXELS,
+                 title="quickD3Map", map="world_map",
+                 cache_dir=None, width=960, height=500, lod=None, max_zoom=None,
+                 clip=False, clip_margin=CLIP_MARGIN, chunksize=CHUNKSIZE, hook=None):
+
+        '''
+        The DensityMap class bins the points of a dataframe with Lat/lon columns
+        into hexagonal or square cells and colors the cells, instead of drawing
+        the points. Binning happens in Python, see density.py, at one
+        resolution per zoom level, and only the occupied cells are embedded.
+
+        Parameters
+        ----------
+        df: pandas dataframe, CSV path or iterator of dataframes, required.
+            dataframe with latitude and longitude columns. Chunked input is
+            binned chunk by chunk, see BaseMap.
+        column: str, default None
+            numeric column aggregated with statistic "sum" or "mean".
+        statistic: str, default "count"
+            what colors a cell: "count" of points, or the "sum" or "mean"
+            of `column`. NA values of the column are left out of the
+            sum/mean; cells without any value are drawn grey.
+        shape: str, default "hex"
+            "hex" or "square" cells.
+        cell_pixels: int, default 10
+            hexagon radius or square side in screen pixels. A new level of
+            cells is used at every doubling of the zoom.
+        map: str, default "world_map".
+           template to be used for mapping; one of the zoomable world maps.
+           Cells are regular in Web Mercator, the projection of those maps.
+        cache_dir: str, default None
+            directory for reusing data conversions across runs.
+        width: int, default 960
+            width of the map in pixels.
+        height: int, default 500
+            height of the map in pixels.
+        lod: None, "auto" or int, default None
+            basemap level of detail, see BaseMap.
+        max_zoom: float, default None
+            zoom factor the basemap should stay sharp up to with lod="auto".
+        clip: boolean, default False
+            embed only the part of the basemap near the data. Needs an
+            in-memory DataFrame.
+        clip_margin: float, default 5
+            degrees added around the data extent when clipping.
+        chunksize: int, default 50000
+            rows per chunk when df is a CSV path.
+        hook: callable, default None
+            receives an event dict for every timed stage, see BaseMap.
+
+        Returns
+        -------
+        DensityMap object with the create_map/display_map methods of PointMap.
+
+        Examples
+        --------
+        >>>from quickD3map import DensityMap
+        >>>DensityMap(df).create_map("density.html")
+        >>>DensityMap(df, column="ELEV", statistic="mean", shape="square").display_map()
+
+        '''
+        super(DensityMap, self).__init__(df=df, width=width, height=height, projection="mercator",
+                                         cache_dir=cache_dir, lod=lod, max_zoom=max_zoom,
+                                         clip=clip, clip_margin=clip_margin, chunksize=chunksize,
+                                         hook=hook)
+        head = self.df if self.chunks is None else self.chunks.head
+        if statistic not in STATISTICS:
+            raise ValueError("statistic must be one of the following:{}".format(STATISTICS))
+        if shape not in SHAPES:
+            raise ValueError("shape must be one of the following:{}".format(SHAPES))
+        if statistic != "count":
+            if column is None:
+                raise ValueError("The {} statistic needs a column".format(statistic))
+            check_columns(head, [column])
+            if not is_numeric(head[column].values):
+                raise ValueError("The {} statistic needs a numeric column".format(statistic))
+        if map not in map_templates.keys():
+            raise ValueError("Map type must be one of the ofllowing:{}".format(map_templates.keys()))
+        self.map = map
+        self.page_template()
+        if clip and self.chunks is not None:
+            raise ValueError("Clipping the basemap of a DensityMap needs an in-memory DataFrame")
+        self.column = column if statistic != "count" else None
+        self.statistic = statistic
+        self.shape = shape
+        self.cell_pixels = cell_pixels
+
+        self.template_vars['title'] = title
+
+    def page_template(self):
+        '''Density maps have their own page, drawn with svg on the zoomable world maps'''
+        template = self.map_templates[self.map]['template']
+        if template not in density_templates:
+            raise ValueError("Density maps are only available for the world maps")
+        return density_templates[template]
+
+    conversion_vars = ['density']
+
+    def conversion_options(self):
+        return {'column': self.column, 'statistic': self.statistic, 'shape': self.shape,
+                'cell_pixels': self.cell_pixels}
+
+    def conversion_frames(self):
+        return [self.df[[self.lat, self.lon] + ([self.column] if self.column else [])]]
+
+    def conversion_counts(self):
+        if self.chunks is None:
+            return super(DensityMap, self).conversion_counts()
+        density = json.loads(self.template_vars['density'])
+        rows, points = density['rows'], density['points']
+        return {'rows': rows, 'points': points, 'na_dropped': rows - points}
+
+    def convert_to_geojson(self):
+        ''' Bin the points with a DensityGrid, chunk by chunk for chunked
+            input, and keep the occupied cells of every level as the
+            "density" template var. Rows with NA lat/lon values are dropped. '''
+        grid = DensityGrid(self.shape, cell_pixels=self.cell_pixels)
+        rows = 0
+        for chunk in ([self.df] if self.chunks is None else self.chunks):
+            lats, lons = chunk[self.lat].values, chunk[self.lon].values
+            mask = notnull_mask(lats, lons)
+            values = chunk[self.column].values[mask] if self.column else None
+            grid.update(np.asarray(lons[mask], dtype='float64'), np.asarray(lats[mask], dtype='float64'),
+                        values)
+            rows += len(chunk)
+        self.template_vars['density'] = density_to_json(grid.levels(self.statistic), self.shape,
+                                                        self.statistic, self.column, rows)
@@ -3,19 +3,24 @@
 
 from __future__ import (absolute_import, division, print_function )
 
+import numpy as np
 import pandas as pd
-import geojson
-
-from geojson import Point, Feature, FeatureCollection, LineString
 
 from .check_data import check_samplecolumn, verify_dfs_forLineMap 
 from .BaseMap import BaseMap
+from .encoders import points_to_geojson, resolve_edges, lines_to_geojson, notnull_mask
+from .geometry import pack_arcs, great_circle_arcs, MAX_SEGMENT
+from .topology import data_bounds, CLIP_MARGIN
+from .edges import edge_frame
 
 class LineMap(BaseMap): 
     ''' Create a PointMap with quickD3map '''
     def __init__(self, df, samplecolumn, distance_df,  scale=100000, 
                  map="world_map_zoom", center=None, projection="mercator", 
-                 title=None, straight_lines=False):
+                 title=None, straight_lines=False, arcs=False, max_segment=MAX_SEGMENT,
+                 cache_dir=None, min_weight=None, top_k=None, dedupe=False,
+                 width=960, height=500, lod=None, max_zoom=None,
+                 clip=False, clip_margin=CLIP_MARGIN, renderer="svg", hook=None):
                     
         '''
         LineMap is a class that takes a dataframe and returns an html webpage that
@@ -26,10 +31,13 @@ class LineMap(BaseMap):
         ----------
         df: pandas dataframe, required.
             dataframe with latitude and longitude columns.
-        distance_df: pandas dataframe, required
+        distance_df: pandas dataframe, numpy array or scipy.sparse matrix, required
            distance dataframe must be thtree columns where the first 
            two are locations found in the samplecolumn, and the third
-           is a numeric weight.
+           is a numeric weight. Alternatively an N x N matrix: a square
+           dataframe indexed by sample name, or an array/sparse matrix (or a
+           pd.DataFrame of one) whose rows and columns follow the order of
+           df[samplecolumn]. Matrix entries of 0 are not drawn.
         samplecolumn: str,  required
            samplecolumn is the name of a column in df. This columns must have the names 
            of all of the samples in the first two columns of distance_df and it must be unique
@@ -40,6 +48,41 @@ class LineMap(BaseMap):
            template to be used for mapping.
         straight_lines: boolean, defalut False
             determines whetehr lines will be drawn as arcs of striaght lines
+        arcs: boolean, default False
+            compute great-circle arcs for all edges in Python, split at the
+            antimeridian and packed as typed arrays, so the browser only
+            projects the vertices. For the "world_map_zoom" template.
+        max_segment: float, default 2.0
+            degrees of arc per interpolated segment when arcs=True.
+        cache_dir: str, default None
+            directory for reusing data conversions across runs.
+        min_weight: float, default None
+            drop edges with a weight below this value.
+        top_k: int, default None
+            keep only the k heaviest edges of every sample.
+        dedupe: boolean, default False
+            keep one edge per pair of samples, e.g. for symmetric matrices.
+        width: int, default 960
+            width of the map in pixels.
+        height: int, default 500
+            height of the map in pixels.
+        lod: None, "auto" or int, default None
+            basemap level of detail; "auto" embeds a simplified basemap
+            sized for width/height and max_zoom. See BaseMap.
+        max_zoom: float, default None
+            zoom factor the basemap should stay sharp up to with lod="auto".
+        clip: boolean, default False
+            embed only the part of the basemap near the points and
+            the great circles between them.
+        clip_margin: float, default 5
+            degrees added around the data extent when clipping.
+        renderer: str, default "svg"
+            "canvas" draws the points and lines on a <canvas>, projecting
+            them once and only rescaling them on zoom. Pair it with
+            arcs=True for large edge counts.
+        hook: callable, default None
+            receives an event dict for every timed stage, see BaseMap. The
+            timings, counts and byte sizes are kept in `stats`.
         For Future Implementation:
         center: list of legth two: lat/long (default=[-100, 0])
            provides a new center for the map
@@ -65,57 +108,84 @@ class LineMap(BaseMap):
 
         '''
         # Basic Data Check Using the BaseClass        
-        super(LineMap, self).__init__(df=df,center=center, projection=projection)
+        super(LineMap, self).__init__(df=df, width=width, height=height, center=center,
+                                      projection=projection, cache_dir=cache_dir,
+                                      lod=lod, max_zoom=max_zoom,
+                                      clip=clip, clip_margin=clip_margin, renderer=renderer,
+                                      hook=hook)
         
         ##  Support Functions to Verify Data
         ################################################################################
         
         # Check Inputs and make assignments of data
         assert isinstance(df, pd.core.frame.DataFrame)
-        assert isinstance(distance_df, pd.core.frame.DataFrame)
-        
-        if verify_dfs_forLineMap(df, samplecolumn, distance_df):
-            self.distdf = distance_df
-        self.samplecolumn = check_samplecolumn(self.df, samplecolumn)
+        with self.stage('validate_edges'):
+            check_samplecolumn(df, samplecolumn)
+            distance_df = edge_frame(distance_df, df[samplecolumn].values,
+                                     min_weight=min_weight, top_k=top_k, dedupe=dedupe)
+            
+            if verify_dfs_forLineMap(df, samplecolumn, distance_df):
+                self.distdf = distance_df
+            self.samplecolumn = check_samplecolumn(self.df, samplecolumn)
         self.title= title
         self.map = map
+        if straight_lines and arcs:
+            raise ValueError("Use either straight_lines or arcs, not both")
+        self.page_template()
         self.straight_lines = straight_lines
+        self.arcs = arcs
+        self.max_segment = max_segment
         self.template_vars['straight_lines'] =  self.straight_lines
 
+    def basemap_bounds(self):
+        ''' Extent of the points and of the edges drawn between them. Unless
+            straight_lines is set, edges follow great circles, which can
+            leave the box of their endpoints, so a coarse interpolation of
+            every edge is included. '''
+        if not self.clip:
+            return None
+        lon, lat = self.df[self.lon].values, self.df[self.lat].values
+        if not self.straight_lines and len(self.distdf):
+            edges = resolve_edges(self.df, self.samplecolumn, self.lat, self.lon,
+                                  self.distdf.iloc[:, 0].values, self.distdf.iloc[:, 1].values)
+            mask = notnull_mask(*edges)
+            arc_lon, arc_lat, _ = great_circle_arcs(*[e[mask] for e in edges], max_segment=10.)
+            lon, lat = np.concatenate([lon, arc_lon]), np.concatenate([lat, arc_lat])
+        return data_bounds(lon, lat, self.clip_margin)
+
+    conversion_vars = ['geojson', 'lines_geojson', 'packed_arcs']
+
+    def conversion_counts(self):
+        ''' Point counts plus the edges and the edges dropped because an
+            endpoint has a NA latitude/longitude '''
+        counts = super(LineMap, self).conversion_counts()
+        names = self.df[self.samplecolumn]
+        missing = names[~notnull_mask(self.df[self.lat].values, self.df[self.lon].values)]
+        dropped = (self.distdf.iloc[:, 0].isin(missing) | self.distdf.iloc[:, 1].isin(missing)).sum()
+        counts.update({'edges': len(self.distdf), 'edges_dropped': int(dropped)})
+        return counts
+
+    def conversion_options(self):
+        return {'arcs': self.arcs, 'max_segment': self.max_segment}
+
+    def conversion_frames(self):
+        return [self.df[[self.lat, self.lon, self.samplecolumn]], self.distdf]
+
     def convert_to_geojson(self):
         ''' Dataconversion happens here. Process Dataframes and get 
             necessary information into geojson which is put into the template 
-            var dictionary for later'''
-        lat, lon, df = self.lat, self.lon, self.df
-        
-        ## Support Functions For processing to geojson
-        ################################################################################
-        def feature_from_row(row):
-            if pd.notnull(row[lat]) and pd.notnull(row[lon]):
-                return Feature(geometry=Point(( row[lon], row[lat] )))
-
-        def line_feature_from_distance_df():
-            """
-            create a geojson feature collection of lines from a dataframe with three columns: source/dest/weight
-            """
-            
-            #Create the lookup for lat/long
-            ref_df = self.df.set_index( self.samplecolumn )
-            
-            def create_line_feature(source, target, weight, ref_df=ref_df):
-                lat = self.lat
-                lon = self.lon
-                
-                lat1 = ref_df.loc[source][lat]
-                lon1 = ref_df.loc[source][lon]
-                lat2 = ref_df.loc[target][lat]
-                lon2 = ref_df.loc[target][lon]
-                return Feature(geometry=LineString([(lon1, lat1), (lon2, lat2)]))
-                    
-            line_featurelist =  [ create_line_feature( row[0],row[1],row[2] ) for idx,row in self.distdf.iterrows() ]
-            return line_featurelist
+            var dictionary for later. Edge endpoints are joined to their
+            coordinates in a single indexer lookup over samplecolumn.'''
+        lat, lon, df, distdf = self.lat, self.lon, self.df, self.distdf
+        self.template_vars['geojson'] = points_to_geojson(df, lat, lon)
         
-        featurelist= [ feature_from_row(row) for idx, row in df.iterrows() ]
-        self.template_vars['geojson'] = geojson.dumps( FeatureCollection(featurelist) )
-        line_featurelist = line_feature_from_distance_df() 
-        self.template_vars['lines_geojson'] = geojson.dumps( FeatureCollection(line_featurelist) )
\ No newline at end of file
+        edges = resolve_edges(df, self.samplecolumn, lat, lon,
+                              distdf.iloc[:, 0].values, distdf.iloc[:, 1].values)
+        if self.arcs:
+            mask = notnull_mask(*edges)
+            self.template_vars['lines_geojson'] = None
+            self.template_vars['packed_arcs'] = pack_arcs(*[e[mask] for e in edges],
+                                                          max_segment=self.max_segment)
+        else:
+            self.template_vars['packed_arcs'] = None
+            self.template_vars['lines_geojson'] = lines_to_geojson(*edges)
@@ -3,17 +3,28 @@
 
 from __future__ import (absolute_import, division, print_function )
 
-import pandas as pd
-import geojson
-from geojson import Point, Feature, FeatureCollection
+import weakref
+
 from .BaseMap import BaseMap
-from .utilities import map_templates
+from .encoders import (point_columns, compact_points, write_point_features, StringIO,
+                       COMPACT_PRECISION, CHUNKSIZE)
+from .clustering import cluster_pyramid, pyramid_to_json, CELL_PIXELS
+from .utilities import map_templates, encodings, zoom_templates, time_templates
+from .topology import CLIP_MARGIN
+from .chunked import spool_path, spool_point_features, spool_compact_points, remove_spool, SPOOL_MARKER
+from .column_stats import ColumnStats
+from .check_data import check_columns
+from .frames import time_frames
 
 
 class PointMap(BaseMap): 
     ''' Create a PointMap with quickD3map '''
     def __init__(self, df, columns = None, title="quickD3Map", legend=False, scale_exp=4,  
-                 map="world_map", projection="mercator"):
+                 map="world_map", projection="mercator", encoding="geojson",
+                 precision=COMPACT_PRECISION, cluster=False, cluster_pixels=CELL_PIXELS,
+                 cache_dir=None, width=960, height=500, lod=None, max_zoom=None,
+                 clip=False, clip_margin=CLIP_MARGIN, chunksize=CHUNKSIZE, renderer="svg",
+                 time_column=None, id_column=None, hook=None):
                     
         '''
         The PointMap class takes a dataframe with Lat/lon columns and maps the point onto a map.
@@ -21,17 +32,74 @@ class PointMap(BaseMap):
         
         Parameters
         ----------
-        df: pandas dataframe, required.
-            dataframe with latitude and longitude columns.
+        df: pandas dataframe, CSV path or iterator of dataframes, required.
+            dataframe with latitude and longitude columns. A CSV path or an
+            iterator of chunks is encoded chunk by chunk into a spool file
+            (in cache_dir if given) that is copied into the page, so memory
+            use is bounded by the chunk size. Not available with cluster.
         columns: list of columsn in the df, default None
             if columns are specified, the map created by create_map or 
             display_map will allwo scaling of points based on column values.
+            Numeric columns scale and color the points, other columns color
+            them by category. The range, quantiles, NA count and color
+            classes of every column are computed once and embedded in the
+            page, see column_stats. Rows with NA values keep their point.
         scale_exp: int, default 4
             scale factor for the sizing plotted points. This is a d3.range that determines the scale
             over which values will be plotted. Using "3" will provide an appropriate scale for features
             with values going to 10^3; "6" would be good for values going to  10^6
         map: str, default "world_map".
            template to be used for mapping. 
+        encoding: str, default "geojson"
+            how points are embedded in the page. "geojson" writes a
+            FeatureCollection; "compact" writes quantized base64 typed
+            arrays that are decoded in the browser, several times smaller.
+        precision: int, default 5
+            decimal places kept for coordinates with encoding="compact".
+        cluster: boolean, default False
+            aggregate points into a pyramid of grid clusters, one level per
+            zoom scale. Only the clusters of the current level inside the
+            viewport are drawn, at most about one per cell of the view; the
+            page still embeds every level of the pyramid. Clusters carry a
+            count and the mean/sum of each numeric column. Only for the
+            zoomable world maps; ignores `encoding`.
+        cluster_pixels: int, default 10
+            size of a cluster cell in screen pixels.
+        cache_dir: str, default None
+            directory for reusing data conversions across runs.
+        width: int, default 960
+            width of the map in pixels.
+        height: int, default 500
+            height of the map in pixels.
+        lod: None, "auto" or int, default None
+            basemap level of detail; "auto" embeds a simplified basemap
+            sized for width/height and max_zoom. See BaseMap.
+        max_zoom: float, default None
+            zoom factor the basemap should stay sharp up to with lod="auto".
+        clip: boolean, default False
+            embed only the part of the basemap near the data.
+        clip_margin: float, default 5
+            degrees added around the data extent when clipping.
+        chunksize: int, default 50000
+            rows per chunk when df is a CSV path.
+        renderer: str, default "svg"
+            "canvas" draws the points on a <canvas> from the typed arrays
+            (best with encoding="compact"), with hover picking through a
+            quadtree. For the world maps; stays smooth at 200k points.
+        time_column: str, default None
+            animate the map over the sorted distinct values of this column,
+            with a slider and a play button. df then holds one row per
+            station and time, e.g. daily readings merged with the station
+            coordinates. The station coordinates are embedded once and
+            every frame only as the `columns` values that changed, see
+            frames.py. Needs `columns`; not available with cluster or
+            chunked input.
+        id_column: str, default None
+            column identifying a station with time_column. Without it each
+            distinct latitude/longitude pair is a station.
+        hook: callable, default None
+            receives an event dict for every timed stage, see BaseMap. The
+            timings, counts and byte sizes are kept in `stats`.
        
        For Future Implementation: Currently Mercator is the default.
         center: list of legth two: lat/long (default=[-100, 0])
@@ -64,47 +132,109 @@ class PointMap(BaseMap):
         >>>PointMap(qdf).display_map()
 
         '''
-        super(PointMap, self).__init__(df=df, projection=projection)
-        self.columns = columns
+        super(PointMap, self).__init__(df=df, width=width, height=height, projection=projection,
+                                       cache_dir=cache_dir, lod=lod, max_zoom=max_zoom,
+                                       clip=clip, clip_margin=clip_margin, chunksize=chunksize,
+                                       renderer=renderer, hook=hook)
+        self.columns = check_columns(self.df if self.chunks is None else self.chunks.head, columns)
         self.scale_exp = scale_exp
         self.legend = legend
         
+        if encoding not in encodings:
+            raise ValueError("Encoding must be one of the following:{}".format(encodings))
+        self.encoding = encoding
+        self.precision = precision
+        
         if map in map_templates.keys():
             self.map = map
         else:
             raise ValueError("Map type must be one of the ofllowing:{}".format(map_templates.keys()))
         
+        if cluster and self.map_templates[self.map]['template'] not in zoom_templates:
+            raise ValueError("Clustering is only available for the world maps")
+        self.page_template()
+        if cluster and self.chunks is not None:
+            raise ValueError("Clustering needs an in-memory DataFrame, not chunked input")
+        self.cluster = cluster
+        self.cluster_pixels = cluster_pixels
+
+        if time_column is not None:
+            check_columns(self.df if self.chunks is None else self.chunks.head,
+                          [time_column] + ([id_column] if id_column is not None else []))
+            if not columns:
+                raise ValueError("A time_column needs columns to animate")
+            if cluster or self.chunks is not None:
+                raise ValueError("A time_column needs an in-memory DataFrame and no clustering")
+            if self.page_template() not in time_templates:
+                raise ValueError("A time_column is only available for the point map templates")
+        self.time_column = time_column
+        self.id_column = id_column
+        
         self.template_vars['legend'] = self.legend
         self.template_vars['columns'] = self.columns
         self.template_vars['title'] = title
         self.template_vars['scale_exp'] = scale_exp
-        
-        #TODO
-        #check that the column values do not have have NAs in them.
 
     
+    conversion_vars = ['geojson', 'compact_points', 'clusters', 'spool', 'frames', 'column_stats']
+
+    def conversion_options(self):
+        return {'columns': self.columns, 'encoding': self.encoding, 'precision': self.precision,
+                'cluster': self.cluster, 'cluster_pixels': self.cluster_pixels,
+                'time_column': self.time_column, 'id_column': self.id_column}
+
+    def conversion_frames(self):
+        keys = [col for col in [self.time_column, self.id_column] if col is not None]
+        used = [col for col in self.df.columns if col in (self.columns or []) and col not in keys]
+        return [self.df[[self.lat, self.lon] + keys + used]]
+
     def convert_to_geojson(self):
         ''' Dataconversion happens here. Process Dataframes and get 
             necessary information into geojson which is put into the template 
-            var dictionary for later'''
+            var dictionary for later. Rows with NA lat/lon values are dropped
+            and the FeatureCollection is written column-wise by the encoder.
+            The statistics of the selected columns are gathered on the way.'''
         lat, lon, df, columns = self.lat, self.lon, self.df, self.columns
-        
-        ## Support Functions For processing to geojson
-        ################################################################################
-        def feature_from_row(row):
-            """ Check for NA in Lat and Lon.
-                Check for Columns. Return GeoJson for inclusion as points.
-            """
-            if pd.notnull( row[lat]) and pd.notnull(row[lon]):
-                if columns:                
-                    properties = { k:v for k,v in row.iterkv() if k in columns}
-                    return Feature(geometry=Point(( row[lon], row[lat] )),
-                                   properties=properties)
-                else:
-                    return Feature(geometry=Point(( row[lon], row[lat] )))
-                    
-
-        featurelist= [ feature_from_row(row) for idx, row in df.iterrows() ]
-        self.template_vars['geojson'] = geojson.dumps( FeatureCollection(featurelist) )
+        for key in self.conversion_vars:
+            self.template_vars[key] = None
+        stats = ColumnStats() if columns else None
 
-        
\ No newline at end of file
+        if self.chunks is not None:
+            persistent = self._disk_cache()
+            path = spool_path(self.cache_dir if persistent else None)
+            if not persistent:
+                # a temporary spool goes with the map, or with the next conversion
+                if getattr(self, '_spool_cleanup', None) is not None:
+                    self._spool_cleanup()
+                self._spool_cleanup = weakref.finalize(self, remove_spool, path)
+            if self.encoding == "compact":
+                spool = spool_compact_points(path, self.chunks, lat, lon, columns, self.precision,
+                                             stats=stats)
+                self.template_vars['compact_points'] = SPOOL_MARKER
+            else:
+                spool = spool_point_features(path, self.chunks, lat, lon, columns, stats=stats)
+                self.template_vars['geojson'] = SPOOL_MARKER
+            self.template_vars['spool'] = spool
+        elif self.time_column is not None:
+            stats.update(point_columns(df, lat, lon, columns)[2])
+            self.template_vars['frames'] = time_frames(df, lat, lon, self.time_column, columns,
+                                                       self.id_column, self.precision)
+        elif self.cluster:
+            lons, lats, properties = point_columns(df, lat, lon, columns)
+            if stats is not None:
+                stats.update(properties)
+            levels = cluster_pyramid(lons, lats, properties, cell_pixels=self.cluster_pixels)
+            self.template_vars['clusters'] = pyramid_to_json(levels)
+        else:
+            lons, lats, properties = point_columns(df, lat, lon, columns)
+            if stats is not None:
+                stats.update(properties)
+            if self.encoding == "compact":
+                self.template_vars['compact_points'] = compact_points(lons, lats, properties,
+                                                                      precision=self.precision)
+            else:
+                out = StringIO()
+                write_point_features(out, lons, lats, properties)
+                self.template_vars['geojson'] = out.getvalue()
+        if stats is not None:
+            self.template_vars['column_stats'] = stats.to_json()
@@ -5,6 +5,36 @@ __author__ = 'zach powers'
 __email__ = 'zcharlop@rockefeller.edu'
 __version__ = '0.1.4'
 
+import sys
+import importlib
 
-from .LineMap  import LineMap
-from .PointMap  import PointMap
+# The map classes pull in pandas and jinja2, so they are only imported the
+# first time they are used; `import quickD3map` itself stays cheap for the
+# command line. Flask is only imported by server.py, when a map is served.
+_lazy = {'ChoroplethMap': '.ChoroplethMap',
+         'DensityMap': '.DensityMap',
+         'LineMap': '.LineMap',
+         'PointMap': '.PointMap',
+         'render_many': '.batch'}
+
+__all__ = sorted(_lazy)
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        raise AttributeError("module 'quickD3map' has no attribute {!r}".format(name))
+    value = getattr(importlib.import_module(_lazy[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy))
+
+
+if sys.version_info < (3, 7):
+    # no module level __getattr__ (PEP 562) before Python 3.7
+    from .ChoroplethMap import ChoroplethMap
+    from .DensityMap import DensityMap
+    from .LineMap import LineMap
+    from .PointMap import PointMap
+    from .batch import render_many
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Process-wide cache for the Jinja environment and the static files in the
+templates directory.
+
+Every map instance shares one compiled Environment and one copy of each
+JS/CSS library. Assets are read from disk as raw bytes the first time they
+are requested and are only read again when the file's mtime changes.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import os
+import hashlib
+import threading
+
+from .utilities import static_assets, map_templates
+from .topology import simplified_basemap, clipped_basemap
+
+
+ASSET_HASH_LENGTH = 12
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+_lock = threading.RLock()
+_environment = None
+_assets = {}    # filename -> {'mtime':, 'bytes':, 'text':, 'hits':}
+
+
+def get_environment():
+    ''' Return the shared Jinja Environment, creating it on first use '''
+    global _environment
+    with _lock:
+        if _environment is None:
+            from jinja2 import Environment, PackageLoader
+            _environment = Environment(loader=PackageLoader('quickD3map', 'templates'))
+        return _environment
+
+def _load(filename):
+    ''' Return the cache entry for a file in the templates directory '''
+    path = os.path.join(TEMPLATE_DIR, filename)
+    mtime = os.path.getmtime(path)
+    with _lock:
+        entry = _assets.get(filename)
+        if entry is None or entry['mtime'] != mtime:
+            with open(path, 'rb') as f:
+                entry = {'mtime': mtime, 'bytes': f.read(), 'text': None, 'hits': 0}
+            _assets[filename] = entry
+        entry['hits'] += 1
+        return entry
+
+def load_asset(filename):
+    ''' Return the raw bytes of a file in the templates directory '''
+    return _load(filename)['bytes']
+
+def load_asset_text(filename):
+    ''' Return the decoded text of a file, shared by all callers '''
+    entry = _load(filename)
+    with _lock:
+        if entry['text'] is None:
+            entry['text'] = entry['bytes'].decode('utf-8')
+        return entry['text']
+
+def static_asset_vars():
+    ''' Return the template variables for the JS libraries and CSS styling '''
+    return dict((var, load_asset_text(filename)) for var, filename in static_assets.items())
+
+def load_basemap(map, level=None, cache_dir=None, bounds=None):
+    ''' Return the TopoJSON text for a `map_templates` entry.
+
+        Basemaps are data, not templates: the file is read once into the
+        shared cache and inserted into the page as is. Entries pointing at
+        the same file share one copy. With a `level` from
+        topology.LOD_LEVELS the simplified variant is returned instead, and
+        with `bounds` (west, south, east, north) only the geometries
+        intersecting that extent are kept.
+    '''
+    if map not in map_templates:
+        raise ValueError("Map type must be one of the following:{}".format(list(map_templates.keys())))
+    filename = map_templates[map]['json']
+    if level is None and bounds is None:
+        return load_asset_text(filename)
+    source = load_asset(filename)
+    if level is not None:
+        text = simplified_basemap(filename, source, level, cache_dir)
+        if bounds is None:
+            return text
+        source = text.encode('utf-8')
+    return clipped_basemap(filename, source, bounds, cache_dir)
+
+def _hashed_name(filename, content, ext=None):
+    ''' Return `name.<hash>.ext` for a file given its content '''
+    root, orig_ext = os.path.splitext(filename)
+    digest = hashlib.sha1(content).hexdigest()[:ASSET_HASH_LENGTH]
+    return '{}.{}{}'.format(root, digest, ext or orig_ext)
+
+def _write_once(asset_dir, name, content):
+    ''' Write a content-addressed file unless it is already there '''
+    path = os.path.join(asset_dir, name)
+    if not os.path.exists(path):
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.rename(tmp, path)
+    return name
+
+def write_assets(asset_dir, map=None, base_url='', level=None, cache_dir=None, bounds=None):
+    '''
+    Write the JS/CSS libraries, and optionally the basemap of a
+    `map_templates` entry, into `asset_dir` under content-hashed filenames.
+    Files already present are left alone, so many pages can share one
+    directory and browsers can cache the files indefinitely.
+
+    The basemap, at the given LOD `level` and clipped to `bounds` if
+    any, is wrapped as a script
+    defining `quickD3map_basemap` so the page templates can keep loading it
+    synchronously.
+
+    Returns a dict of template variable name -> url, where each url is
+    `base_url` joined with the hashed filename.
+    '''
+    if not os.path.isdir(asset_dir):
+        os.makedirs(asset_dir)
+    prefix = base_url.rstrip('/') + '/' if base_url else ''
+    urls = {}
+    for var, filename in static_assets.items():
+        content = load_asset(filename)
+        urls[var] = prefix + _write_once(asset_dir, _hashed_name(filename, content), content)
+    if map is not None:
+        filename = map_templates[map]['json']
+        data = (load_asset(filename) if level is None and bounds is None else
+                load_basemap(map, level, cache_dir, bounds).encode('utf-8'))
+        content = b'var quickD3map_basemap = ' + data + b';\n'
+        urls['map_data'] = prefix + _write_once(asset_dir, _hashed_name(filename, content, '.js'), content)
+    return urls
+
+def preload(maps=()):
+    ''' Load the environment, every static asset and the given basemaps '''
+    get_environment()
+    static_asset_vars()
+    for map in maps:
+        load_basemap(map)
+
+def cache_info():
+    ''' Return a dict describing the cached files: size, mtime and hit count '''
+    with _lock:
+        return {'environment': _environment is not None,
+                'assets': dict((name, {'bytes': len(entry['bytes']),
+                                       'mtime': entry['mtime'],
+                                       'hits':  entry['hits']})
+                               for name, entry in _assets.items())}
+
+def clear_cache():
+    ''' Drop the cached environment and assets '''
+    global _environment
+    with _lock:
+        _environment = None
+        _assets.clear()
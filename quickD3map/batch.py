@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Render many maps at once over a process pool.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import os
+import re
+import traceback
+import multiprocessing
+from collections import namedtuple
+
+from . import assets
+from .utilities import map_templates
+
+
+RenderResult = namedtuple('RenderResult', ['key', 'path', 'error'])
+
+
+def _safe_name(key):
+    ''' Turn a group key (possibly a tuple) into a filename fragment '''
+    if isinstance(key, tuple):
+        key = '_'.join(str(k) for k in key)
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', str(key)).strip('_') or 'map'
+
+def _iter_items(groups, kwargs):
+    ''' Yield (key, df, kwargs, error) from a groupby object or an iterable of
+        tuples. A malformed item gives its formatted error instead of failing
+        the batch; its key is the item's first element when it has one. '''
+    for item in groups:
+        try:
+            if len(item) == 2:
+                key, df = item
+                item_kwargs = {}
+            else:
+                key, df, item_kwargs = item
+            merged = dict(kwargs)
+            merged.update(item_kwargs or {})
+        except Exception:
+            key = item[0] if isinstance(item, tuple) and item else item
+            yield key, None, None, traceback.format_exc()
+            continue
+        yield key, df, merged, None
+
+def _unique_path(path, used):
+    ''' Return path, or path with a -2, -3, ... suffix when it is already in used '''
+    root, ext = os.path.splitext(path)
+    n = 1
+    while path in used:
+        n += 1
+        path = '{}-{}{}'.format(root, n, ext)
+    used.add(path)
+    return path
+
+def _tasks(groups, map_cls, out_dir, filename, kwargs, create_kwargs):
+    ''' The _render_one task of every item, each with its own file name '''
+    used = set()
+    for key, df, item_kwargs, error in _iter_items(groups, kwargs):
+        path = None
+        if error is None:
+            # keys such as "a/b" and "a b" sanitize to the same name
+            path = _unique_path(os.path.join(out_dir, filename.format(key=_safe_name(key))), used)
+        yield key, df, map_cls, item_kwargs, path, create_kwargs, error
+
+def _init_worker():
+    ''' Pool initializer: load templates, libraries and basemaps once per worker '''
+    assets.preload(map_templates.keys())
+
+def _render_one(task):
+    ''' Build and write a single map, returning a RenderResult instead of raising '''
+    key, df, map_cls, kwargs, path, create_kwargs, error = task
+    if error is not None:
+        return RenderResult(key, path, error)
+    try:
+        map_cls(df, **kwargs).create_map(path, **create_kwargs)
+        return RenderResult(key, path, None)
+    except Exception:
+        return RenderResult(key, path, traceback.format_exc())
+
+
+def render_many(groups, map_cls, out_dir, workers=None, filename='{key}.html',
+                asset_dir=None, compress=False, **kwargs):
+    '''
+    Render one map per group, fanning the work out over a process pool.
+
+    Parameters
+    ----------
+    groups: DataFrameGroupBy or iterable, required
+        either a grouped dataframe, e.g. `df.groupby('day')`, or an iterable
+        of (key, df) or (key, df, kwargs) tuples where kwargs are passed to
+        the map class for that item only.
+    map_cls: class, required
+        PointMap, LineMap or any other BaseMap subclass.
+    out_dir: str, required
+        directory for the HTML files. Created if missing.
+    workers: int, default None
+        number of worker processes. None uses every core, 1 renders in
+        the current process without a pool.
+    filename: str, default '{key}.html'
+        format string for each file name. `key` is the sanitized group key.
+        When two items get the same name, the later ones get a -2, -3, ...
+        suffix, so no page overwrites another.
+    asset_dir: str, default None
+        passed to create_map; all pages then share one set of library files.
+    compress: boolean, default False
+        passed to create_map to gzip each page.
+    **kwargs:
+        keyword arguments passed to every map_cls call.
+
+    Returns
+    -------
+    list of RenderResult(key, path, error) in input order. `error` is None on
+    success and the formatted traceback when that item failed; a failure,
+    including a malformed item, never stops the rest of the batch. `path`
+    is None for malformed items.
+    '''
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    create_kwargs = {'compress': compress, 'asset_dir': asset_dir}
+    tasks = _tasks(groups, map_cls, out_dir, filename, kwargs, create_kwargs)
+
+    if workers == 1:
+        _init_worker()
+        return [_render_one(task) for task in tasks]
+
+    pool = multiprocessing.Pool(workers, initializer=_init_worker)
+    try:
+        results = list(pool.imap(_render_one, tasks))
+    finally:
+        pool.close()
+        pool.join()
+    return results
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from .utilities import projections
 
@@ -6,7 +7,13 @@ def check_column(df, namelist, name):
         if col.strip().lower() in namelist:
             return col
     raise ValueError("No {} column found in the dataframe".format(name))
-                    
+
+def check_columns(df, columns):
+    missing = [col for col in (columns or []) if col not in df.columns]
+    if missing:
+        raise ValueError("Columns not found in the dataframe: {}".format(missing))
+    return columns
+
 def check_center(center):
     try:
         if isinstance(center, tuple) or isinstance(center, list) and len(center) == 2:
@@ -14,18 +21,15 @@ def check_center(center):
     except:
         print("Center Must be a Tuple or List")
         return None
-    
+
 def check_samplecolumn(df, samplecolumn):
-    unique = len(df[samplecolumn]) - len(pd.unique(df[samplecolumn])) # check for unique values
-    if samplecolumn in df.columns and unique == 0:
-        return samplecolumn
-    else:
-        if samplecolumn not in df.columns:
-            ### To do check this only when using distance df
-            raise ValueError('Sample column  not in dataframe')
-        elif unique != 0:
-            raise ValueError('Sample column is not unique and therefore non-indexable')
-        
+    if samplecolumn not in df.columns:
+        ### To do check this only when using distance df
+        raise ValueError('Sample column  not in dataframe')
+    if not df[samplecolumn].is_unique:
+        raise ValueError('Sample column is not unique and therefore non-indexable')
+    return samplecolumn
+
 def check_projection(projection):
     if projection in projections:
         return projection
@@ -33,43 +37,129 @@ def check_projection(projection):
         print('This is not a valid projection, using default=mercator')
         return "mercator"
 
-        
+
 def check_for_NA(df, lat, lon):
-    for col in [lat,lon]:
-        for index, item in df[col].iteritems():
-            if pd.isnull(item):
-                raise ValueError('DataFrame has NUll values which must be removed')
+    if df[[lat, lon]].isnull().values.any():
+        raise ValueError('DataFrame has NUll values which must be removed')
     return df
 
-def verify_dfs_forLineMap(df, samplecolumn, distance_df):
+
+## Validation Report
+#####################################################
+class ValidationReport(object):
+    '''
+    Collects every problem found by a validation pass instead of stopping
+    at the first one. An empty report is truthy through `ok`.
+
+    Attributes
+    ----------
+    missing_columns: list
+        columns that were expected but are not in the dataframe.
+    na_rows: dict
+        column -> number of rows with a null value.
+    bad_dtypes: dict
+        column -> dtype for columns that must be numeric but are not.
+    duplicate_ids: int
+        number of repeated values in the sample column.
+    missing_ids: list
+        distance dataframe endpoints not found in the sample column.
+    shape_errors: list
+        messages about the layout of the distance dataframe.
+    '''
+    def __init__(self):
+        self.missing_columns = []
+        self.na_rows = {}
+        self.bad_dtypes = {}
+        self.duplicate_ids = 0
+        self.missing_ids = []
+        self.shape_errors = []
+
+    @property
+    def ok(self):
+        return not self.errors()
+
+    def errors(self):
+        ''' Return a list of human readable messages, one per problem '''
+        messages = list(self.shape_errors)
+        for col in self.missing_columns:
+            messages.append("Column {} not in dataframe".format(col))
+        for col, count in sorted(self.na_rows.items(), key=lambda kv: str(kv[0])):
+            if count:
+                messages.append("Column {} has {} NA rows".format(col, count))
+        for col, dtype in sorted(self.bad_dtypes.items(), key=lambda kv: str(kv[0])):
+            messages.append("Column {} must be numeric, found {}".format(col, dtype))
+        if self.duplicate_ids:
+            messages.append("Sample column has {} duplicate values".format(self.duplicate_ids))
+        if len(self.missing_ids):
+            shown = ', '.join(str(i) for i in self.missing_ids[:10])
+            messages.append("{} distance dataframe members not found in your "
+                            "primary dataframe: {}".format(len(self.missing_ids), shown))
+        return messages
+
+    def raise_for_errors(self):
+        ''' Raise a single ValueError listing every problem found '''
+        messages = self.errors()
+        if messages:
+            raise ValueError('\n'.join(messages))
+        return self
+
+    def __repr__(self):
+        return "ValidationReport({})".format(self.errors() or 'ok')
+
+
+def validate_points(df, lat, lon, report=None):
+    '''
+    Count NA rows and check the dtype of the latitude/longitude columns
+    with a null mask per column.
+    '''
+    report = report if report is not None else ValidationReport()
+    for col in [lat, lon]:
+        if col not in df.columns:
+            report.missing_columns.append(col)
+            continue
+        report.na_rows[col] = int(df[col].isnull().sum())
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            report.bad_dtypes[col] = df[col].dtype
+    return report
+
+def validate_linemap(df, samplecolumn, distance_df, report=None):
     """
-    check 3 things:
-      1: the dimensions of the distance_frame
-      2: that samplecolumn is a column of df
-      3: that all members of the first two columns of of distance_df are in df[samplecolumn]
+    check 3 things in a single pass:
+      1: the dimensions and weight dtype of the distance_frame
+      2: that samplecolumn is a unique column of df
+      3: that all members of the first two columns of distance_df are in df[samplecolumn]
+    Membership is a hash lookup (`isin`) over the unique endpoints.
     """
-    
+    report = report if report is not None else ValidationReport()
+
     #check shape of distance_df
-    dtypes  = distance_df.dtypes
-    columns = distance_df.columns
-    assert len(dtypes)==3 #there should be three columns a source, destination and target
-    assert dtypes[2] in ['float64','int64'] # the weight column needs to be numeric
-    
+    if distance_df.shape[1] != 3:
+        #there should be three columns a source, destination and target
+        report.shape_errors.append("Distance dataframe must have 3 columns, found {}"
+                                   .format(distance_df.shape[1]))
+    elif not pd.api.types.is_numeric_dtype(distance_df.iloc[:, 2]):
+        # the weight column needs to be numeric
+        report.bad_dtypes[distance_df.columns[2]] = distance_df.dtypes.iloc[2]
+
     #check_samplecolumn
-    check_samplecolumn(df, samplecolumn)
-    
+    if samplecolumn not in df.columns:
+        report.missing_columns.append(samplecolumn)
+        return report
+    samples = df[samplecolumn]
+    report.duplicate_ids = int(samples.duplicated().sum())
+
     #check agreement between df and distance_df
-    samplecolumn_values = list(df[samplecolumn])
-    distance_values = list( distance_df[ columns[0] ] ) + list( distance_df[columns[1]] )  
-    
-    correct = True
-    for d in distance_values:
-        if not d in samplecolumn_values:
-            correct = False
-    
-    if not correct:
-        raise ValueError("Value mismatch between your two dataframes. \
-                          Check your distance dataframe for members that are not \
-                          found in your primary dataframe")
-    else:
-        return correct
+    if distance_df.shape[1] >= 2:
+        endpoints = pd.unique(np.concatenate([distance_df.iloc[:, 0].values,
+                                              distance_df.iloc[:, 1].values]))
+        missing = ~pd.Series(endpoints).isin(samples.values).values
+        report.missing_ids = list(endpoints[missing])
+    return report
+
+def verify_dfs_forLineMap(df, samplecolumn, distance_df):
+    """
+    Validate df and distance_df for a LineMap. All problems are collected
+    in a ValidationReport and raised together as a ValueError.
+    """
+    validate_linemap(df, samplecolumn, distance_df).raise_for_errors()
+    return True
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Out-of-core point input.
+
+A ChunkedSource wraps a CSV path or an iterator of DataFrames. The spool
+writers encode it one chunk at a time into a spool file holding exactly the
+text compact_points / points_to_geojson would have produced, so memory use
+is bounded by the chunk size. The page template receives SPOOL_MARKER in
+place of the data and BaseMap.write_map copies the spool file in its place.
+Spool files in the temp directory live as long as the map that wrote them;
+those in a cache_dir are kept for later runs.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import io
+import os
+import json
+import base64
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from .encoders import (is_numeric, point_columns, write_point_rows, dictionary_encode, COORDINATE_PRECISION,
+                       COMPACT_PRECISION, MAX_COMPACT_PRECISION, CHUNKSIZE,
+                       FEATURECOLLECTION_HEAD, FEATURECOLLECTION_TAIL)
+
+
+SPOOL_MARKER = '\x00quickD3map-spool\x00'
+COPY_BLOCKSIZE = 1 << 16
+
+
+class ChunkedSource(object):
+    '''
+    A table read in chunks.
+
+    Parameters
+    ----------
+    source: str or iterator of DataFrames, required
+        a CSV path, read with pd.read_csv(path, chunksize=chunksize), or an
+        iterator such as the result of pd.read_csv(..., chunksize=...).
+        An iterator can only be read once.
+    chunksize: int, default CHUNKSIZE
+        rows per chunk when reading a CSV path.
+    '''
+    def __init__(self, source, chunksize=CHUNKSIZE):
+        self.path = source if isinstance(source, str) else None
+        self.chunksize = chunksize
+        self._chunks = iter(self._read() if self.path else source)
+        try:
+            self.head = next(self._chunks)
+        except StopIteration:
+            raise ValueError("The chunked input holds no data")
+        if not isinstance(self.head, pd.DataFrame):
+            raise ValueError("Chunked input must yield DataFrames")
+        self.consumed = False
+
+    def _read(self):
+        return pd.read_csv(self.path, chunksize=self.chunksize)
+
+    @property
+    def columns(self):
+        return self.head.columns
+
+    def key(self):
+        ''' Identify the data for conversion caching: the file's path, size
+            and mtime, or None for a one-shot iterator, whose conversions
+            must not be cached on disk '''
+        if self.path:
+            stat = os.stat(self.path)
+            return (os.path.abspath(self.path), stat.st_size, stat.st_mtime)
+        return None
+
+    def __iter__(self):
+        if self.path and self.consumed:
+            self._chunks, self.head = iter(self._read()), None
+        elif self.consumed:
+            raise ValueError("The chunk iterator was already read; pass a CSV path to convert again")
+        self.consumed = True
+        if self.head is not None:
+            yield self.head
+        for chunk in self._chunks:
+            yield chunk
+
+
+class _Extent(object):
+    ''' Longitude/latitude extremes of every chunk, as aligned lon/lat
+        lists that give the same data_bounds as all of the points '''
+    def __init__(self):
+        self.lon, self.lat = [], []
+
+    def update(self, lon, lat):
+        if len(lon):
+            shifted = np.mod(lon, 360.)
+            self.lon += [float(v) for v in (lon.min(), lon.max(), (shifted.min() + 180.) % 360. - 180.,
+                                            (shifted.max() + 180.) % 360. - 180.)]
+            self.lat += [float(v) for v in (lat.min(), lat.max(), lat.min(), lat.max())]
+
+
+class _Base64Spool(object):
+    ''' Base64 encode a byte stream into a temporary file, keeping the
+        bytes that do not fill a 3 byte group for the next write '''
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.rest = b''
+
+    def write(self, data):
+        data = self.rest + data
+        cut = len(data) - len(data) % 3
+        self.file.write(base64.b64encode(data[:cut]))
+        self.rest = data[cut:]
+
+    def copy_to(self, out):
+        self.file.write(base64.b64encode(self.rest))
+        self.file.seek(0)
+        for block in iter(lambda: self.file.read(COPY_BLOCKSIZE), b''):
+            out.write(block.decode('ascii'))
+        self.file.close()
+
+
+class _DictionarySpool(object):
+    ''' Dictionary codes of a label column in a _Base64Spool, with the
+        distinct values numbered in order of first appearance over all
+        chunks, as encoders.dictionary_encode numbers them for the whole
+        column '''
+    def __init__(self):
+        self.codes = _Base64Spool()
+        self.lookup = {}
+        self.values = []
+
+    def write(self, values):
+        codes, uniques = dictionary_encode(values)
+        for value in uniques:
+            if value not in self.lookup:
+                self.lookup[value] = len(self.values)
+                self.values.append(value)
+        remap = np.array([self.lookup[value] for value in uniques] + [-1], dtype='int32')
+        self.codes.write(np.ascontiguousarray(remap[codes], dtype=np.dtype('int32').newbyteorder('<')).tobytes())
+
+    def copy_to(self, out):
+        self.codes.copy_to(out)
+
+
+def spool_path(cache_dir=None):
+    ''' Return the path of a new, empty spool file in cache_dir or the temp directory '''
+    if cache_dir and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    handle, path = tempfile.mkstemp(suffix='.spool', prefix='quickD3map-', dir=cache_dir)
+    os.close(handle)
+    return path
+
+def remove_spool(path):
+    ''' Delete a spool file, if it is still there '''
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def spool_point_features(path, chunks, lat, lon, columns=None, precision=COORDINATE_PRECISION,
+                         stats=None):
+    '''
+    Write the GeoJSON FeatureCollection of a chunked table to `path`.
+
+    Returns a dict with the spool `path`, the number of `rows` written, the
+    number of rows `dropped` for a null latitude/longitude and the per-chunk
+    `lon`/`lat` extremes. A column_stats.ColumnStats passed as `stats` is
+    updated with the property columns of every chunk.
+    '''
+    extent, rows, dropped = _Extent(), 0, 0
+    with io.open(path, 'w', encoding='utf-8') as out:
+        out.write(FEATURECOLLECTION_HEAD)
+        for chunk in chunks:
+            lons, lats, properties = point_columns(chunk, lat, lon, columns)
+            dropped += len(chunk) - len(lons)
+            if stats is not None:
+                stats.update(properties)
+            if not len(lons):
+                continue
+            if rows:
+                out.write(', ')
+            write_point_rows(out, lons, lats, properties, precision)
+            extent.update(lons.astype('float64'), lats.astype('float64'))
+            rows += len(lons)
+        out.write(FEATURECOLLECTION_TAIL)
+    return {'path': path, 'rows': rows, 'dropped': dropped, 'lon': extent.lon, 'lat': extent.lat}
+
+def spool_compact_points(path, chunks, lat, lon, columns=None, precision=COMPACT_PRECISION,
+                         stats=None):
+    '''
+    Write the compact_points payload of a chunked table to `path`.
+
+    Every column is base64 encoded into its own temporary file while the
+    chunks are read and the files are joined into the payload at the end.
+    Whether a property is stored as Float32 or as dictionary codes is
+    decided by its dtype in the first chunk. Returns the same summary as
+    spool_point_features and updates `stats` the same way.
+    '''
+    if not 0 <= precision <= MAX_COMPACT_PRECISION:
+        raise ValueError("precision must be between 0 and {}".format(MAX_COMPACT_PRECISION))
+    scale = 10 ** precision
+    quantize = lambda arr: np.round(np.asarray(arr, dtype='float64') * scale)
+    little = lambda dtype: np.dtype(dtype).newbyteorder('<')
+    lon_spool, lat_spool = _Base64Spool(), _Base64Spool()
+    props = None
+    extent, rows, dropped = _Extent(), 0, 0
+    for chunk in chunks:
+        lons, lats, properties = point_columns(chunk, lat, lon, columns)
+        dropped += len(chunk) - len(lons)
+        if stats is not None:
+            stats.update(properties)
+        if props is None:
+            props = [(str(name), 'float32' if is_numeric(values) else 'dictionary',
+                      _Base64Spool() if is_numeric(values) else _DictionarySpool())
+                     for name, values in properties]
+        lon_spool.write(np.ascontiguousarray(quantize(lons), dtype=little('int32')).tobytes())
+        lat_spool.write(np.ascontiguousarray(quantize(lats), dtype=little('int32')).tobytes())
+        for (name, kind, spool), (_, values) in zip(props, properties):
+            if kind == 'float32':
+                spool.write(np.ascontiguousarray(np.asarray(values, dtype='float64'),
+                                                 dtype=little('float32')).tobytes())
+            else:
+                spool.write(np.asarray(values))
+        extent.update(lons.astype('float64'), lats.astype('float64'))
+        rows += len(lons)
+
+    with io.open(path, 'w', encoding='utf-8') as out:
+        out.write(u'{{"n": {}, "scale": {}, "lon": "'.format(rows, scale))
+        lon_spool.copy_to(out)
+        out.write(u'", "lat": "')
+        lat_spool.copy_to(out)
+        out.write(u'", "properties": {')
+        for idx, (name, kind, spool) in enumerate(props or []):
+            out.write(u'{}{}: {{"type": "{}", "data": "'.format(', ' if idx else '', json.dumps(name), kind))
+            spool.copy_to(out)
+            if kind == 'float32':
+                out.write(u'"}')
+            else:
+                out.write(u'", "values": {}}}'.format(json.dumps(spool.values)))
+        out.write(u'}}')
+    return {'path': path, 'rows': rows, 'dropped': dropped, 'lon': extent.lon, 'lat': extent.lat}
+
+def copy_spool(path, write, blocksize=COPY_BLOCKSIZE):
+    ''' Pass the text of a spool file to `write` in blocks '''
+    with io.open(path, 'r', encoding='utf-8') as f:
+        for block in iter(lambda: f.read(blocksize), u''):
+            write(block)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Command line renderer.
+
+    quickd3map point stations.csv -o map.html --columns ELEV
+    quickd3map density stations.csv -o density.html --column ELEV --statistic mean
+    quickd3map choropleth stations.csv -o states.html --map us_states
+    quickd3map line samples.csv distances.csv --samplecolumn name -o lines.html
+    cat stations.csv | quickd3map point - -o - --encoding compact > map.html
+
+Only the standard library is imported up front; pandas, jinja2 and the map
+classes are loaded once the arguments are parsed, so `--help` and argument
+errors return immediately.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import sys
+import json
+import argparse
+
+
+STDIO = '-'
+
+
+def _lod(value):
+    if value == 'auto':
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected 'auto' or a level such as 1024")
+
+def _add_common(parser):
+    parser.add_argument('-o', '--output', default='map.html',
+                        help="HTML file to write, '-' for stdout (default map.html)")
+    parser.add_argument('--title')
+    parser.add_argument('--map', help='map template, e.g. world_map or world_map_zoom')
+    parser.add_argument('--width', type=int, default=960)
+    parser.add_argument('--height', type=int, default=500)
+    parser.add_argument('--lod', type=_lod, help="basemap level of detail, 'auto' or a level")
+    parser.add_argument('--max-zoom', type=float)
+    parser.add_argument('--clip', action='store_true', help='embed only the basemap near the data')
+    parser.add_argument('--renderer', choices=['svg', 'canvas'], default='svg',
+                        help='canvas batch draws large point and line counts')
+    parser.add_argument('--cache-dir', help='directory for reusing conversions across runs')
+    parser.add_argument('--sep', default=',', help='CSV field delimiter (default ,)')
+    parser.add_argument('--compress', action='store_true', help='gzip the page')
+    parser.add_argument('--asset-dir', help='write libraries and basemap here instead of inlining them')
+    parser.add_argument('--stats', action='store_true', help='print the build statistics to stderr as JSON')
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='quickd3map',
+                                     description='Render a D3 map from CSV data.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    point = commands.add_parser('point', help='points from a CSV with latitude/longitude columns')
+    point.add_argument('input', help="CSV file, '-' for stdin")
+    point.add_argument('--columns', nargs='+', help='columns to scale the points by')
+    point.add_argument('--encoding', choices=['geojson', 'compact'], default='geojson')
+    point.add_argument('--precision', type=int)
+    point.add_argument('--cluster', action='store_true')
+    point.add_argument('--time-column', help='animate the columns over the values of this column')
+    point.add_argument('--id-column', help='column identifying a station with --time-column')
+    point.add_argument('--chunksize', type=int,
+                       help='read the CSV in chunks of this many rows, bounding memory use')
+    _add_common(point)
+
+    density = commands.add_parser('density', help='points binned into colored hexagon or square cells')
+    density.add_argument('input', help="CSV file, '-' for stdin")
+    density.add_argument('--column', help='numeric column for the sum and mean statistics')
+    density.add_argument('--statistic', choices=['count', 'sum', 'mean'], default='count')
+    density.add_argument('--shape', choices=['hex', 'square'], default='hex')
+    density.add_argument('--cell-pixels', type=int, help='cell radius or side in pixels')
+    density.add_argument('--chunksize', type=int,
+                         help='read the CSV in chunks of this many rows, bounding memory use')
+    _add_common(density)
+
+    choropleth = commands.add_parser('choropleth', help='points joined to the states or countries of the map')
+    choropleth.add_argument('input', help="CSV file, '-' for stdin")
+    choropleth.add_argument('--column', help='numeric column for the sum and mean statistics')
+    choropleth.add_argument('--statistic', choices=['count', 'sum', 'mean'], default='count')
+    choropleth.add_argument('--chunksize', type=int,
+                            help='read the CSV in chunks of this many rows, bounding memory use')
+    _add_common(choropleth)
+
+    line = commands.add_parser('line', help='connections between samples')
+    line.add_argument('nodes', help="CSV of samples with latitude/longitude, '-' for stdin")
+    line.add_argument('edges', help="CSV of source, target, weight rows, or an N x N matrix with --matrix")
+    line.add_argument('--samplecolumn', required=True, help='column of the sample names')
+    line.add_argument('--matrix', action='store_true',
+                      help='edges is a square matrix with sample names in the first row and column')
+    line.add_argument('--min-weight', type=float)
+    line.add_argument('--top-k', type=int)
+    line.add_argument('--dedupe', action='store_true')
+    line.add_argument('--arcs', action='store_true', help='compute great-circle arcs in Python')
+    line.add_argument('--straight-lines', action='store_true')
+    _add_common(line)
+    return parser
+
+
+def _common_kwargs(args):
+    kwargs = {'width': args.width, 'height': args.height, 'lod': args.lod,
+              'max_zoom': args.max_zoom, 'clip': args.clip, 'cache_dir': args.cache_dir,
+              'renderer': args.renderer}
+    for name in ['title', 'map']:
+        if getattr(args, name) is not None:
+            kwargs[name] = getattr(args, name)
+    return kwargs
+
+def _read_csv(source, sep, **kwargs):
+    import pandas as pd
+    return pd.read_csv(sys.stdin if source == STDIO else source, sep=sep, **kwargs)
+
+def _points(args, kwargs):
+    ''' The point table, or with --chunksize a CSV path or chunk iterator '''
+    if args.chunksize and args.sep == ',' and args.input != STDIO:
+        kwargs['chunksize'] = args.chunksize
+        return args.input
+    if args.chunksize:
+        return _read_csv(args.input, args.sep, chunksize=args.chunksize)
+    return _read_csv(args.input, args.sep)
+
+def point_map(args):
+    from .PointMap import PointMap
+    kwargs = _common_kwargs(args)
+    kwargs.update(columns=args.columns, encoding=args.encoding, cluster=args.cluster,
+                  time_column=args.time_column, id_column=args.id_column)
+    if args.precision is not None:
+        kwargs['precision'] = args.precision
+    df = _points(args, kwargs)
+    return PointMap(df, **kwargs)
+
+def density_map(args):
+    from .DensityMap import DensityMap
+    kwargs = _common_kwargs(args)
+    if kwargs.pop('renderer') != 'svg':
+        raise ValueError("Density maps are drawn with the svg renderer")
+    kwargs.update(column=args.column, statistic=args.statistic, shape=args.shape)
+    if args.cell_pixels is not None:
+        kwargs['cell_pixels'] = args.cell_pixels
+    df = _points(args, kwargs)
+    return DensityMap(df, **kwargs)
+
+def choropleth_map(args):
+    from .ChoroplethMap import ChoroplethMap
+    kwargs = _common_kwargs(args)
+    if kwargs.pop('renderer') != 'svg':
+        raise ValueError("Choropleth maps are drawn with the svg renderer")
+    if kwargs.pop('clip'):
+        raise ValueError("Choropleth maps always embed the whole basemap")
+    kwargs.update(column=args.column, statistic=args.statistic)
+    df = _points(args, kwargs)
+    return ChoroplethMap(df, **kwargs)
+
+def line_map(args):
+    from .LineMap import LineMap
+    if args.nodes == STDIO and args.edges == STDIO:
+        raise ValueError("Only one of nodes and edges can be read from stdin")
+    nodes = _read_csv(args.nodes, args.sep)
+    if args.matrix:
+        edges = _read_csv(args.edges, args.sep, index_col=0)
+    else:
+        edges = _read_csv(args.edges, args.sep)
+    kwargs = _common_kwargs(args)
+    kwargs.update(min_weight=args.min_weight, top_k=args.top_k, dedupe=args.dedupe,
+                  arcs=args.arcs, straight_lines=args.straight_lines)
+    return LineMap(nodes, args.samplecolumn, edges, **kwargs)
+
+def write(m, args):
+    if args.output != STDIO:
+        m.create_map(args.output, compress=args.compress, asset_dir=args.asset_dir)
+        return
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    m.write_map(stdout, compress=args.compress)
+    stdout.flush()
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.output == STDIO and args.asset_dir:
+        parser.error('--asset-dir needs an output file, not stdout')
+    try:
+        m = {'point': point_map, 'density': density_map, 'choropleth': choropleth_map,
+             'line': line_map}[args.command](args)
+        write(m, args)
+    except (ValueError, IOError) as e:
+        print('quickd3map: error: {}'.format(e), file=sys.stderr)
+        return 1
+    if args.stats:
+        print(json.dumps(m.stats, sort_keys=True), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Server-side point clustering for the zoomable world templates.
+
+Points are projected to normalized Web Mercator ([0, 1] on both axes),
+binned on a square grid whose cell size is a fixed number of pixels at each
+zoom scale, and aggregated with np.unique/np.bincount. The result is a
+pyramid of levels; the template picks the level for the current zoom so the
+number of drawn marks depends on the grid, not on the number of rows.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import numpy as np
+
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from .encoders import is_numeric, write_point_features
+
+
+## Global Variables
+#####################################################
+MAX_LATITUDE = 85.0511287798   # Web Mercator cut-off
+# world width in pixels, zoom.scale() in world_map.html / world_map_Line.html:
+# the initial projection (1 << 10) up to the zoom scaleExtent maximum (1 << 14)
+ZOOM_SCALES = [1 << 10, 1 << 11, 1 << 12, 1 << 13, 1 << 14]
+CELL_PIXELS = 10
+
+
+## Projection Helpers
+#####################################################
+def mercator_xy(lon, lat):
+    ''' Project lon/lat degrees to normalized Web Mercator x/y in [0, 1] '''
+    lon = np.asarray(lon, dtype='float64')
+    lat = np.radians(np.clip(np.asarray(lat, dtype='float64'), -MAX_LATITUDE, MAX_LATITUDE))
+    x = (lon + 180.) / 360.
+    y = (1. - np.log(np.tan(lat) + 1. / np.cos(lat)) / np.pi) / 2.
+    return x, y
+
+def mercator_lonlat(x, y):
+    ''' Inverse of mercator_xy '''
+    lon = np.asarray(x) * 360. - 180.
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1. - 2. * np.asarray(y)))))
+    return lon, lat
+
+
+## Clustering
+#####################################################
+def grid_clusters(x, y, cell, values=()):
+    '''
+    Aggregate projected points on a square grid of size `cell`.
+
+    Parameters
+    ----------
+    x, y: array, required
+        normalized mercator coordinates.
+    cell: float, required
+        cell size in normalized units.
+    values: list of arrays, default ()
+        numeric columns to aggregate. NaN values are ignored.
+
+    Returns
+    -------
+    cx, cy, count, sums, means where cx/cy are the member centroids and
+    sums/means are lists aligned with `values`.
+    '''
+    ncols = int(np.ceil(1. / cell)) + 1
+    keys = np.floor(y / cell).astype('int64') * ncols + np.floor(x / cell).astype('int64')
+    _, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    count = np.bincount(inverse)
+    cx = np.bincount(inverse, weights=x) / count
+    cy = np.bincount(inverse, weights=y) / count
+    sums, means = [], []
+    for v in values:
+        v = np.asarray(v, dtype='float64')
+        valid = ~np.isnan(v)
+        total = np.bincount(inverse, weights=np.where(valid, v, 0.), minlength=len(count))
+        n = np.bincount(inverse, weights=valid, minlength=len(count))
+        sums.append(total)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means.append(np.where(n > 0, total / np.maximum(n, 1), np.nan))
+    return cx, cy, count, sums, means
+
+def cluster_pyramid(lon, lat, properties=None, scales=ZOOM_SCALES, cell_pixels=CELL_PIXELS):
+    '''
+    Build one clustering level per zoom scale.
+
+    Each level is a dict with the zoom `scale` it applies from, the cluster
+    `lon`/`lat` arrays and a list of (name, array) `properties`: the member
+    `count`, then for every numeric property column its mean under the
+    column name and its sum under `<name>_sum`. Non-numeric columns are
+    not aggregated. The pyramid stops early once a level keeps every point
+    in its own cluster.
+    '''
+    numeric = [(name, values) for name, values in (properties or [])
+               if is_numeric(values)]
+    x, y = mercator_xy(lon, lat)
+    levels = []
+    for scale in scales:
+        cx, cy, count, sums, means = grid_clusters(x, y, cell_pixels / scale,
+                                                   [values for _, values in numeric])
+        clon, clat = mercator_lonlat(cx, cy)
+        props = [('count', count)]
+        for (name, _), total, mean in zip(numeric, sums, means):
+            props.append((name, mean))
+            props.append(('{}_sum'.format(name), total))
+        levels.append({'scale': scale, 'lon': clon, 'lat': clat, 'properties': props})
+        if len(count) == len(x):
+            break
+    return levels
+
+def pyramid_to_json(levels):
+    ''' Serialize cluster levels as [{"scale": k, "samples": FeatureCollection}, ...] '''
+    out = StringIO()
+    out.write('[')
+    for idx, level in enumerate(levels):
+        if idx:
+            out.write(', ')
+        out.write('{"scale": %d, "samples": ' % level['scale'])
+        write_point_features(out, level['lon'], level['lat'], level['properties'])
+        out.write('}')
+    out.write(']')
+    return out.getvalue()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-column statistics for the PointMap `columns` dropdown.
+
+One vectorized pass over each selected column gives its NA count, range,
+quantile breaks and, for non-numeric columns, the category counts. The
+result is embedded in the page once, with scale domains and colorbrewer
+class breaks ready to use, so switching columns in the browser does not
+scan the features.
+
+ColumnStats is an accumulator fed one chunk at a time, so chunked input
+gets the same summary as a whole DataFrame. Quantiles are computed from
+every row up to SAMPLE_SIZE non-null values per column and from an evenly
+strided sample beyond that; the sample depends only on the row order, not
+on the chunk boundaries.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import json
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .encoders import is_numeric
+
+
+QUANTILES = [0., 0.05, 0.25, 0.5, 0.75, 0.95, 1.]
+CLASSES = 5                 # colorbrewer classes for numeric columns
+SEQUENTIAL_SCHEME = 'YlOrRd'
+QUALITATIVE_SCHEME = 'Set3'
+MAX_CATEGORIES = 12         # categories colored individually, the rest are "other"
+SAMPLE_SIZE = 1 << 20       # values kept per column for the quantiles
+
+
+def _number(value):
+    ''' A JSON friendly float, None for NaN '''
+    value = float(value)
+    return None if np.isnan(value) else value
+
+def _label(value):
+    ''' A JSON friendly category label '''
+    return value.item() if hasattr(value, 'item') else value
+
+
+class _Numeric(object):
+    def __init__(self):
+        self.count, self.na = 0, 0
+        self.min, self.max = np.inf, -np.inf
+        self.stride, self.sample = 1, []
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64')
+        valid = values[~np.isnan(values)]
+        self.na += len(values) - len(valid)
+        if len(valid):
+            self.min = min(self.min, valid.min())
+            self.max = max(self.max, valid.max())
+            # keep the values at positions that are multiples of the stride
+            self.sample.append(valid[(-self.count) % self.stride::self.stride])
+            self.count += len(valid)
+            while sum(len(s) for s in self.sample) > SAMPLE_SIZE:
+                self.sample = [np.concatenate(self.sample)[::2]]
+                self.stride *= 2
+
+    def result(self, classes):
+        out = {'type': 'numeric', 'count': self.count, 'na': self.na,
+               'min': None, 'max': None, 'quantiles': [], 'breaks': [], 'domain': None,
+               'scheme': SEQUENTIAL_SCHEME}
+        if not self.count:
+            return out
+        sample = np.concatenate(self.sample)
+        breaks = np.unique(np.percentile(sample, [100. * i / classes for i in range(1, classes)]))
+        out.update(min=_number(self.min), max=_number(self.max),
+                   quantiles=[_number(q) for q in np.percentile(sample, [100. * q for q in QUANTILES])],
+                   breaks=[_number(b) for b in breaks if self.min < b <= self.max],
+                   domain=[_number(self.min), _number(self.max)])
+        return out
+
+
+class _Categorical(object):
+    def __init__(self):
+        self.count, self.na = 0, 0
+        self.counts = OrderedDict()    # category -> rows, in order of first appearance
+
+    def update(self, values):
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        self.na += int((codes < 0).sum())
+        self.count += int((codes >= 0).sum())
+        for value, n in zip(uniques.tolist(), np.bincount(codes[codes >= 0], minlength=len(uniques))):
+            self.counts[value] = self.counts.get(value, 0) + int(n)
+
+    def result(self, max_categories):
+        ranked = sorted(self.counts.items(), key=lambda item: -item[1])
+        shown = ranked[:max_categories]
+        return {'type': 'categorical', 'count': self.count, 'na': self.na,
+                'distinct': len(ranked),
+                'categories': [_label(value) for value, _ in shown],
+                'counts': [n for _, n in shown],
+                'other': sum(n for _, n in ranked[max_categories:]),
+                'scheme': QUALITATIVE_SCHEME}
+
+
+class ColumnStats(object):
+    '''
+    Accumulate statistics for property columns one chunk at a time.
+
+    Numeric columns (int/float/bool, see encoders.is_numeric) get count,
+    na, min, max, the QUANTILES, `classes` - 1 quantile class breaks for a
+    colorbrewer threshold scale and a domain for the point radius. Other
+    columns (strings, dates) get the `max_categories` most frequent categories with their counts,
+    for an ordinal color scale. The kind of a column is decided by its
+    first chunk.
+    '''
+    def __init__(self, classes=CLASSES, max_categories=MAX_CATEGORIES):
+        self.classes = classes
+        self.max_categories = max_categories
+        self.columns = OrderedDict()
+
+    def update(self, properties):
+        ''' Add a chunk given as the (name, values) pairs of point_columns '''
+        for name, values in properties:
+            name = str(name)
+            if name not in self.columns:
+                self.columns[name] = _Numeric() if is_numeric(values) else _Categorical()
+            self.columns[name].update(values)
+        return self
+
+    def result(self):
+        ''' Return {column: statistics} '''
+        return OrderedDict((name, acc.result(self.classes if isinstance(acc, _Numeric)
+                                             else self.max_categories))
+                           for name, acc in self.columns.items())
+
+    def to_json(self):
+        return json.dumps(self.result())
+
+
+def column_stats(properties, classes=CLASSES, max_categories=MAX_CATEGORIES):
+    ''' Statistics for in-memory (name, values) columns, see ColumnStats '''
+    return ColumnStats(classes, max_categories).update(properties).result()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Server-side density binning for DensityMap.
+
+Points are projected to normalized Web Mercator like the clusters and
+binned on a grid of hexagons or squares whose size is a fixed number of
+pixels at each zoom scale. Every level keeps only its occupied cells, as
+integer cell indices with the point count and the sum/mean of a column,
+so the embedded data grows with the area covered, not with the rows.
+
+Hexagons are pointy-topped, as in d3.hexbin: for a radius r the centers
+of row j lie at y = j * 1.5r and x = (i + (j & 1) / 2) * sqrt(3)r. A point
+lies between two rows and belongs to whichever of the nearest centers in
+those two rows is closer, which is exact for a hexagonal grid.
+
+DensityGrid is an accumulator fed one chunk at a time; merging a chunk
+costs a pass over the occupied cells, so chunked input is binned in
+bounded memory.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import json
+
+import numpy as np
+
+from .clustering import mercator_xy, ZOOM_SCALES, CELL_PIXELS
+from .column_stats import column_stats
+from .encoders import pack_array
+
+
+SHAPES = ['hex', 'square']
+STATISTICS = ['count', 'sum', 'mean']
+SQRT3 = np.sqrt(3.)
+
+
+## Binning
+#####################################################
+def hex_cells(x, y, radius):
+    ''' Column/row indices of the hexagons of `radius` holding each point '''
+    dx, dy = radius * SQRT3, radius * 1.5
+    j0 = np.floor(y / dy)
+    best = None
+    for j in (j0, j0 + 1):
+        offset = np.mod(j, 2) / 2.
+        i = np.round(x / dx - offset)
+        distance = ((i + offset) * dx - x) ** 2 + (j * dy - y) ** 2
+        if best is None:
+            best = (i, j, distance)
+        else:
+            closer = distance < best[2]
+            best = (np.where(closer, i, best[0]), np.where(closer, j, best[1]), None)
+    return best[0].astype('int64'), best[1].astype('int64')
+
+def square_cells(x, y, size):
+    ''' Column/row indices of the squares of side `size` holding each point '''
+    return np.floor(x / size).astype('int64'), np.floor(y / size).astype('int64')
+
+def _grid_width(shape, size):
+    ''' Cell columns spanning [0, 1], with room for the -1 and last+1 columns '''
+    step = size * SQRT3 if shape == 'hex' else size
+    return int(np.ceil(1. / step)) + 3
+
+def cell_keys(x, y, size, shape='hex'):
+    ''' One int64 key per point identifying its cell '''
+    i, j = hex_cells(x, y, size) if shape == 'hex' else square_cells(x, y, size)
+    width = _grid_width(shape, size)
+    return (j + 1) * width + (i + 1)
+
+def key_cells(keys, size, shape='hex'):
+    ''' Inverse of cell_keys: the column and row index of every key '''
+    width = _grid_width(shape, size)
+    return keys % width - 1, keys // width - 1
+
+def _merge(keys, columns):
+    ''' Sort the distinct keys and sum every column over equal keys '''
+    unique, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.ravel()
+    return unique, [np.bincount(inverse, weights=c, minlength=len(unique)) for c in columns]
+
+
+## Accumulation
+#####################################################
+class DensityGrid(object):
+    '''
+    Accumulate point counts and column sums per cell at every zoom scale.
+
+    Parameters
+    ----------
+    shape: str, default "hex"
+        "hex" or "square" cells.
+    scales: list of int, default ZOOM_SCALES
+        world widths in pixels, one level per scale.
+    cell_pixels: float, default CELL_PIXELS
+        hexagon radius or square side in pixels at each level's scale.
+    '''
+    def __init__(self, shape='hex', scales=ZOOM_SCALES, cell_pixels=CELL_PIXELS):
+        if shape not in SHAPES:
+            raise ValueError("shape must be one of the following:{}".format(SHAPES))
+        self.shape = shape
+        self.scales = list(scales)
+        self.sizes = [cell_pixels / scale for scale in self.scales]
+        # per level: cell keys and their count, column sum and non-NaN count
+        self.cells = [(np.zeros(0, dtype='int64'), [np.zeros(0)] * 3) for _ in self.scales]
+        self.points = 0
+
+    def update(self, lon, lat, values=None):
+        ''' Add points; NaN `values` count as points but not in the sum/mean '''
+        if not len(lon):
+            return self
+        x, y = mercator_xy(lon, lat)
+        ones = np.ones(len(x))
+        if values is None:
+            total, valid = np.zeros(len(x)), np.zeros(len(x))
+        else:
+            values = np.asarray(values, dtype='float64')
+            valid = (~np.isnan(values)).astype('float64')
+            total = np.where(valid > 0, values, 0.)
+        for level, size in enumerate(self.sizes):
+            keys, sums = _merge(cell_keys(x, y, size, self.shape), [ones, total, valid])
+            old_keys, old_sums = self.cells[level]
+            if len(old_keys):
+                keys, sums = _merge(np.concatenate([old_keys, keys]),
+                                    [np.concatenate(pair) for pair in zip(old_sums, sums)])
+            self.cells[level] = (keys, sums)
+        self.points += len(x)
+        return self
+
+    def levels(self, statistic='count'):
+        '''
+        Return one dict per level with the `scale` it applies from, the
+        cell `size` in normalized units, the `i`/`j` cell indices, the
+        point `count` and the `value` of the statistic: the count, or the
+        sum/mean of the column (NaN for cells without a value). Levels
+        stop once every cell holds a single point.
+        '''
+        if statistic not in STATISTICS:
+            raise ValueError("statistic must be one of the following:{}".format(STATISTICS))
+        out = []
+        for scale, size, (keys, (count, total, valid)) in zip(self.scales, self.sizes, self.cells):
+            i, j = key_cells(keys, size, self.shape)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                value = {'count': count,
+                         'sum': np.where(valid > 0, total, np.nan),
+                         'mean': np.where(valid > 0, total / valid, np.nan)}[statistic]
+            out.append({'scale': scale, 'size': size, 'i': i, 'j': j,
+                        'count': count.astype('int64'), 'value': value})
+            if len(count) and (count == 1).all():
+                break
+        return out
+
+
+def density_to_json(levels, shape, statistic, column=None, rows=None):
+    '''
+    Serialize density levels for the density_map.html template.
+
+    Cell indices and counts are base64 Int32 arrays, the values Float32
+    (left out for the count statistic), and every level carries the
+    column_stats summary of its values for the colorbrewer scale.
+    '''
+    points = int(levels[0]['count'].sum()) if levels else 0
+    payload = {'shape': shape, 'statistic': statistic, 'column': column,
+               'rows': points if rows is None else rows, 'points': points, 'levels': []}
+    for level in levels:
+        entry = {'scale': level['scale'], 'size': level['size'], 'n': int(len(level['i'])),
+                 'i': pack_array(level['i'], 'int32'), 'j': pack_array(level['j'], 'int32'),
+                 'count': pack_array(level['count'], 'int32'),
+                 'stats': column_stats([('value', level['value'])])['value']}
+        if statistic != 'count':
+            entry['value'] = pack_array(level['value'], 'float32')
+        payload['levels'].append(entry)
+    return json.dumps(payload)
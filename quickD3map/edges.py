@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Edge lists for LineMap from long-form tables or N x N matrices.
+
+Matrices (NumPy arrays, square DataFrames indexed by sample name, or
+scipy.sparse matrices) are turned into (source, target, weight) arrays
+row block by row block, with the pruning options applied before the long
+table is built, so only the surviving edges are ever materialized.
+
+A matrix entry of 0 means "no edge", as for the entries a sparse matrix
+does not store, so zeros are dropped from dense and sparse matrices
+alike. The rows of a long table are always kept.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import numpy as np
+import pandas as pd
+
+
+ROW_BLOCK = 1024   # matrix rows scanned at a time
+
+
+def is_sparse(matrix):
+    ''' True for scipy.sparse matrices, checked without importing scipy '''
+    return hasattr(matrix, 'tocoo') and hasattr(matrix, 'nnz')
+
+def is_matrix_frame(df, labels=None):
+    '''
+    True for a square DataFrame whose index and columns hold the same labels.
+
+    With the default RangeIndex on both axes, as for pd.DataFrame(matrix),
+    the frame is a matrix when its values are numeric, unless it is a
+    three row long table whose first two columns hold the `labels`.
+    '''
+    if not (isinstance(df, pd.DataFrame) and df.shape[0] == df.shape[1] and
+            list(df.index) == list(df.columns)):
+        return False
+    if not isinstance(df.index, pd.RangeIndex):
+        return True
+    if not all(dtype.kind in 'fiub' for dtype in df.dtypes):
+        return False
+    if df.shape[1] == 3 and labels is not None:
+        return not np.isin(df.iloc[:, :2].values, np.asarray(labels)).all()
+    return True
+
+def _keep(weights, min_weight):
+    keep = ~np.isnan(weights)
+    if min_weight is not None:
+        keep &= weights >= min_weight
+    return keep
+
+def _top_k(src, tgt, weights, k):
+    ''' Keep the k largest weights for every source node '''
+    order = np.lexsort((-weights, src))
+    src, tgt, weights = src[order], tgt[order], weights[order]
+    starts = np.flatnonzero(np.r_[True, src[1:] != src[:-1]])
+    rank = np.arange(len(src)) - np.repeat(starts, np.diff(np.r_[starts, len(src)]))
+    keep = rank < k
+    return src[keep], tgt[keep], weights[keep]
+
+def _dedupe(src, tgt, weights, n):
+    ''' Keep one edge per unordered pair, the first one seen '''
+    lo, hi = np.minimum(src, tgt), np.maximum(src, tgt)
+    _, first = np.unique(lo.astype('int64') * n + hi, return_index=True)
+    first.sort()
+    return src[first], tgt[first], weights[first]
+
+def _dense_edges(matrix, min_weight, top_k, upper):
+    ''' Scan a dense matrix in row blocks, returning src, tgt, weight arrays '''
+    n = matrix.shape[0]
+    parts = []
+    for start in range(0, n, ROW_BLOCK):
+        block = np.array(matrix[start:start + ROW_BLOCK], dtype='float64')
+        rows = np.arange(start, start + len(block))
+        block[np.arange(len(block)), rows] = np.nan            # no self loops
+        block[block == 0] = np.nan                             # nor zero weights
+        if upper:
+            block[np.arange(n)[None, :] <= rows[:, None]] = np.nan
+        if min_weight is not None:
+            block[~(block >= min_weight)] = np.nan
+        if top_k is not None and top_k < n:
+            filled = np.where(np.isnan(block), -np.inf, block)
+            cols = np.argpartition(-filled, top_k - 1, axis=1)[:, :top_k]
+            i = np.repeat(rows, top_k)
+            j = cols.ravel()
+            w = block[i - start, j]
+        else:
+            i, j = np.nonzero(~np.isnan(block))
+            w = block[i, j]
+            i = i + start
+        keep = ~np.isnan(w)
+        parts.append((i[keep], j[keep], w[keep]))
+    if not parts:
+        return np.zeros(0, 'int64'), np.zeros(0, 'int64'), np.zeros(0)
+    return tuple(np.concatenate(p) for p in zip(*parts))
+
+
+def prune_edges(src, tgt, weights, n, min_weight=None, top_k=None, dedupe=False):
+    '''
+    Apply the pruning options to integer-coded edge arrays.
+
+    Parameters
+    ----------
+    src, tgt: int arrays, required
+        node codes in range(n).
+    weights: float array, required
+    n: int, required
+        number of nodes.
+    min_weight: float, default None
+        drop edges with a weight below this value.
+    top_k: int, default None
+        keep only the k heaviest edges of every source node.
+    dedupe: boolean, default False
+        keep a single edge for (a, b) and (b, a).
+    '''
+    weights = np.asarray(weights, dtype='float64')
+    keep = _keep(weights, min_weight) & (src != tgt)
+    src, tgt, weights = src[keep], tgt[keep], weights[keep]
+    if top_k is not None:
+        src, tgt, weights = _top_k(src, tgt, weights, top_k)
+    if dedupe:
+        src, tgt, weights = _dedupe(src, tgt, weights, n)
+    return src, tgt, weights
+
+def edge_frame(distance, labels, min_weight=None, top_k=None, dedupe=False):
+    '''
+    Return a long (source, target, weight) DataFrame for LineMap.
+
+    Parameters
+    ----------
+    distance: DataFrame, ndarray or scipy.sparse matrix, required
+        either the long three column table LineMap always accepted, a
+        square DataFrame indexed by sample name, or an N x N array/sparse
+        matrix or DataFrame(matrix) whose rows and columns follow `labels`.
+    labels: array-like, required
+        sample names for the rows/columns of an array or sparse matrix,
+        usually df[samplecolumn].
+    min_weight, top_k, dedupe:
+        pruning options, see prune_edges. With dedupe and no top_k, a dense
+        matrix is only scanned above the diagonal.
+    '''
+    matrix_frame = is_matrix_frame(distance, labels)
+    if isinstance(distance, pd.DataFrame) and not matrix_frame:
+        if min_weight is None and top_k is None and not dedupe:
+            return distance
+        codes, uniques = pd.factorize(np.concatenate([distance.iloc[:, 0].values,
+                                                      distance.iloc[:, 1].values]))
+        n = len(distance)
+        # factorize codes missing endpoints as -1, which would index the last label
+        missing = int(((codes[:n] < 0) | (codes[n:] < 0)).sum())
+        if missing:
+            raise ValueError("{} rows of the distance dataframe have a missing source or target"
+                             .format(missing))
+        src, tgt, weights = prune_edges(codes[:n], codes[n:], distance.iloc[:, 2].values,
+                                        len(uniques), min_weight, top_k, dedupe)
+        labels = uniques
+    else:
+        if matrix_frame:
+            if not isinstance(distance.index, pd.RangeIndex):
+                labels = distance.index.values
+            distance = distance.values
+        elif not is_sparse(distance):
+            distance = np.asarray(distance)
+        labels = np.asarray(labels)
+        if distance.shape != (len(labels), len(labels)):
+            raise ValueError("Distance matrix must be {0} x {0} to match the sample column"
+                             .format(len(labels)))
+        if is_sparse(distance):
+            coo = distance.tocoo()
+            stored = coo.data != 0
+            src, tgt, weights = prune_edges(coo.row[stored].astype('int64'), coo.col[stored].astype('int64'),
+                                            coo.data[stored], len(labels), min_weight, top_k, dedupe)
+        else:
+            upper = dedupe and top_k is None
+            src, tgt, weights = _dense_edges(distance, min_weight, top_k, upper)
+            if dedupe and not upper:
+                src, tgt, weights = _dedupe(src, tgt, weights, len(labels))
+    return pd.DataFrame({'source': labels[src], 'target': labels[tgt], 'weight': weights},
+                        columns=['source', 'target', 'weight'])
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Column oriented GeoJSON writers.
+
+The map classes used to build one `geojson.Feature` per DataFrame row and
+then serialize the whole `FeatureCollection`. The functions here take the
+coordinate and property columns as NumPy arrays and write the JSON text
+directly, a chunk of rows at a time, so the cost is a few string operations
+per row and memory does not grow with the number of Python objects.
+
+The output matches `geojson.dumps(FeatureCollection(...))`: same key order,
+same separators and coordinates rounded to `COORDINATE_PRECISION` places.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import json
+import base64
+import numpy as np
+import pandas as pd
+
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+
+## Global Variables
+#####################################################
+COORDINATE_PRECISION = 6   # same default rounding as geojson.Point
+CHUNKSIZE = 50000          # rows encoded per write
+
+FEATURECOLLECTION_HEAD = '{"type": "FeatureCollection", "features": ['
+FEATURECOLLECTION_TAIL = ']}'
+POINT_FEATURE = ('{"type": "Feature", "geometry": {"type": "Point", '
+                 '"coordinates": [%s, %s]}, "properties": {%s}}')
+LINE_FEATURE = ('{"type": "Feature", "geometry": {"type": "LineString", '
+                '"coordinates": [[%s, %s], [%s, %s]]}, "properties": {}}')
+
+COMPACT_PRECISION = 5      # decimal places kept by the compact encoding
+MAX_COMPACT_PRECISION = 7  # 180 * 10**7 still fits in an Int32
+
+_encode = json.JSONEncoder().encode
+
+
+## Value Encoding
+#####################################################
+def is_numeric(values):
+    ''' Whether a column is stored and scaled as numbers: floats, ints and
+        bools (as 0/1). Every other column is a set of category labels. '''
+    return np.asarray(values).dtype.kind in 'fiub'
+
+def encode_coordinates(values, precision=COORDINATE_PRECISION):
+    ''' Return JSON number strings for an array of coordinates.
+
+        geojson rounds the np.float64 values of DataFrame rows with
+        numpy's rounding, so np.round gives the same numbers.
+    '''
+    values = np.round(np.asarray(values, dtype='float64'), precision)
+    return list(map(float.__repr__, values.tolist()))
+
+def encode_values(values):
+    ''' Return JSON strings for every element of a 1D array.
+
+        Floats and ints are formatted with their own repr, which is what
+        the json module does, everything else goes through the encoder.
+    '''
+    values = np.asarray(values)
+    kind = values.dtype.kind
+    if kind == 'f':
+        strings = list(map(float.__repr__, values.astype('float64').tolist()))
+        for idx in np.flatnonzero(~np.isfinite(values)):
+            strings[idx] = _encode(float(values[idx]))
+        return strings
+    elif kind in 'iu':
+        return list(map(int.__repr__, values.tolist()))
+    elif kind == 'b':
+        return ['true' if v else 'false' for v in values.tolist()]
+    return [_encode(v) for v in values.tolist()]
+
+def notnull_mask(*arrays):
+    ''' Boolean mask of rows where none of the arrays are null '''
+    mask = np.ones(len(arrays[0]), dtype=bool)
+    for arr in arrays:
+        mask &= np.asarray(pd.notnull(arr))
+    return mask
+
+
+## Writers
+#####################################################
+def write_point_features(out, lon, lat, properties=None,
+                         precision=COORDINATE_PRECISION, chunksize=CHUNKSIZE):
+    '''
+    Write a FeatureCollection of Points to a file-like object.
+
+    Parameters
+    ----------
+    out: file-like, required
+        anything with a `write` method accepting text.
+    lon, lat: array-like, required
+        coordinate arrays of equal length with no null values.
+    properties: list of (name, array) pairs, default None
+        property columns, aligned with lon/lat.
+    precision: int, default COORDINATE_PRECISION
+        decimal places kept for each coordinate.
+    chunksize: int, default CHUNKSIZE
+        number of features formatted before each write.
+    '''
+    out.write(FEATURECOLLECTION_HEAD)
+    write_point_rows(out, lon, lat, properties, precision, chunksize)
+    out.write(FEATURECOLLECTION_TAIL)
+
+def write_point_rows(out, lon, lat, properties=None,
+                     precision=COORDINATE_PRECISION, chunksize=CHUNKSIZE):
+    ''' Write the comma separated Point features of write_point_features
+        without the surrounding FeatureCollection, so several batches of
+        rows can be written into one collection. '''
+    properties = properties or []
+    keys = [_encode(str(name)) + ': ' for name, _ in properties]
+    for start in range(0, len(lon), chunksize):
+        stop = start + chunksize
+        lons = encode_coordinates(lon[start:stop], precision)
+        lats = encode_coordinates(lat[start:stop], precision)
+        if properties:
+            columns = [[key + v for v in encode_values(values[start:stop])]
+                       for key, (_, values) in zip(keys, properties)]
+            props = [', '.join(row) for row in zip(*columns)]
+        else:
+            props = [''] * len(lons)
+        if start:
+            out.write(', ')
+        out.write(', '.join([POINT_FEATURE % row for row in zip(lons, lats, props)]))
+
+def write_line_features(out, lon1, lat1, lon2, lat2,
+                        precision=COORDINATE_PRECISION, chunksize=CHUNKSIZE):
+    '''
+    Write a FeatureCollection of two point LineStrings to a file-like object.
+    The four coordinate arrays hold the source and target of every edge.
+    '''
+    out.write(FEATURECOLLECTION_HEAD)
+    for start in range(0, len(lon1), chunksize):
+        stop = start + chunksize
+        coords = [encode_coordinates(arr[start:stop], precision)
+                  for arr in (lon1, lat1, lon2, lat2)]
+        if start:
+            out.write(', ')
+        out.write(', '.join([LINE_FEATURE % row for row in zip(*coords)]))
+    out.write(FEATURECOLLECTION_TAIL)
+
+
+## Compact Encoding
+#####################################################
+def pack_array(values, dtype):
+    ''' Return the little-endian bytes of an array as a base64 string '''
+    data = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    return base64.b64encode(data.tobytes()).decode('ascii')
+
+def dictionary_encode(values):
+    ''' Return Int32 codes and the list of distinct values, in order of first
+        appearance, for a column of labels. Nulls get the code -1. '''
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    return codes, [v.item() if hasattr(v, 'item') else v for v in uniques.tolist()]
+
+def pack_column(values):
+    ''' Encode one property column: numbers as Float32, anything else as
+        dictionary codes (Int32, -1 for null) and the list of distinct values '''
+    values = np.asarray(values)
+    if is_numeric(values):
+        return {'type': 'float32', 'data': pack_array(values.astype('float64'), 'float32')}
+    codes, uniques = dictionary_encode(values)
+    return {'type': 'dictionary', 'data': pack_array(codes, 'int32'), 'values': uniques}
+
+def compact_points(lon, lat, properties=None, precision=COMPACT_PRECISION):
+    '''
+    Encode points as base64 typed arrays instead of GeoJSON features.
+
+    Coordinates are quantized to `precision` decimal places and stored as
+    Int32 arrays; numeric property columns are stored as Float32 arrays
+    and other columns as Int32 codes into a list of their distinct values.
+    The `quickD3map_decode` function in compact_decoder.js rebuilds the
+    FeatureCollection in the browser.
+
+    Returns the JSON text of {n, scale, lon, lat, properties}.
+    '''
+    if not 0 <= precision <= MAX_COMPACT_PRECISION:
+        raise ValueError("precision must be between 0 and {}".format(MAX_COMPACT_PRECISION))
+    scale = 10 ** precision
+    quantize = lambda arr: np.round(np.asarray(arr, dtype='float64') * scale)
+    payload = {'n': int(len(lon)),
+               'scale': scale,
+               'lon': pack_array(quantize(lon), 'int32'),
+               'lat': pack_array(quantize(lat), 'int32'),
+               'properties': dict((str(name), pack_column(values))
+                                  for name, values in (properties or []))}
+    return json.dumps(payload)
+
+
+## DataFrame Helpers
+#####################################################
+def point_columns(df, lat, lon, columns=None):
+    '''
+    Return lon, lat and a list of (name, values) property columns with the
+    rows that have a null latitude or longitude removed.
+    '''
+    lats, lons = df[lat].values, df[lon].values
+    mask = notnull_mask(lats, lons)
+    properties = []
+    if columns:
+        # properties keep the DataFrame column order, as row.iteritems() did
+        properties = [(col, df[col].values[mask]) for col in df.columns if col in columns]
+    return lons[mask], lats[mask], properties
+
+def points_to_geojson(df, lat, lon, columns=None, precision=COORDINATE_PRECISION):
+    '''
+    Convert the lat/lon columns of a DataFrame, and optionally some property
+    columns, into a GeoJSON FeatureCollection string. Rows with a null
+    latitude or longitude are dropped.
+    '''
+    lons, lats, properties = point_columns(df, lat, lon, columns)
+    out = StringIO()
+    write_point_features(out, lons, lats, properties, precision)
+    return out.getvalue()
+
+def resolve_edges(df, samplecolumn, lat, lon, sources, targets):
+    '''
+    Look up the coordinates of both ends of every edge in one step.
+    `sources` and `targets` hold values of `df[samplecolumn]`, which must be
+    unique. Returns four arrays: lon1, lat1, lon2, lat2.
+    '''
+    index = pd.Index(df[samplecolumn].values)
+    src = index.get_indexer(np.asarray(sources))
+    tgt = index.get_indexer(np.asarray(targets))
+    if (src < 0).any() or (tgt < 0).any():
+        raise ValueError("Edge endpoints missing from column {}".format(samplecolumn))
+    lats = df[lat].values.astype('float64')
+    lons = df[lon].values.astype('float64')
+    return lons[src], lats[src], lons[tgt], lats[tgt]
+
+def lines_to_geojson(lon1, lat1, lon2, lat2, precision=COORDINATE_PRECISION):
+    '''
+    Convert resolved edge coordinates into a GeoJSON FeatureCollection
+    string of LineStrings. Edges with a null coordinate are dropped.
+    '''
+    mask = notnull_mask(lon1, lat1, lon2, lat2)
+    out = StringIO()
+    write_line_features(out, lon1[mask], lat1[mask], lon2[mask], lat2[mask], precision)
+    return out.getvalue()
+
+def points_to_compact(df, lat, lon, columns=None, precision=COMPACT_PRECISION):
+    ''' Same as points_to_geojson but returns the compact typed-array payload '''
+    lons, lats, properties = point_columns(df, lat, lon, columns)
+    return compact_points(lons, lats, properties, precision)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Time frames for an animated PointMap.
+
+A long table with one row per (station, time) is pivoted into one value
+array per frame, aligned to a single station order, so the station
+coordinates are embedded once however many frames there are. For every
+property column a frame is stored as two bit masks and the values that
+changed:
+
+    na       stations without a value in the frame
+    changed  stations whose value differs from the previous frame
+    values   the changed, non-NA values, frame after frame
+
+Numeric columns keep Float32 values, other columns Int32 codes into a
+list of their distinct values. `quickD3map_decodeFrames` in frames.js
+rebuilds every frame once when the page loads.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from .encoders import is_numeric, pack_array, notnull_mask, dictionary_encode, COMPACT_PRECISION, MAX_COMPACT_PRECISION
+
+
+def station_codes(df, lat, lon, id_column=None):
+    '''
+    Number the stations of a long table.
+
+    Stations are the distinct values of `id_column`, or the distinct
+    coordinate pairs without one. Returns the code of every row and the
+    lon/lat of every station, taken from its first row.
+    '''
+    if id_column is not None:
+        codes, _ = pd.factorize(df[id_column].values)
+    else:
+        codes, _ = pd.factorize(pd.MultiIndex.from_arrays([df[lon].values, df[lat].values]))
+    _, first = np.unique(codes, return_index=True)
+    return codes, df[lon].values[first], df[lat].values[first]
+
+def frame_labels(times):
+    ''' JSON friendly labels for the sorted distinct times '''
+    times = pd.Index(times)
+    if times.dtype.kind == 'M':
+        return [str(t) for t in times.astype(str)]
+    return [t.item() if hasattr(t, 'item') else t for t in times.tolist()]
+
+def pivot_frames(frame_codes, codes, n_frames, n_stations, values):
+    '''
+    Scatter a long column into an n_frames x n_stations matrix in one step.
+    Cells without a row are NaN (numeric) or None; for duplicate
+    (frame, station) rows the last one wins.
+    '''
+    values = np.asarray(values)
+    if is_numeric(values):
+        matrix = np.full((n_frames, n_stations), np.nan)
+    else:
+        matrix = np.full((n_frames, n_stations), None, dtype=object)
+    matrix[frame_codes, codes] = values
+    return matrix
+
+def _pack_bits(mask):
+    ''' base64 of a frames x stations boolean matrix, every frame padded to whole bytes '''
+    return pack_array(np.packbits(mask, axis=1).ravel(), 'uint8')
+
+def encode_frame_column(matrix):
+    ''' The na/changed/values encoding of one pivoted column '''
+    if matrix.dtype.kind == 'f':
+        na = np.isnan(matrix)
+        data, kind, extra = matrix.astype('float32'), 'float32', {}
+    else:
+        codes, uniques = dictionary_encode(matrix.ravel())
+        data = codes.reshape(matrix.shape).astype('int32')
+        na, kind, extra = data < 0, 'dictionary', {'values': uniques}
+    previous = np.vstack([np.zeros((1, data.shape[1]), dtype=data.dtype), data[:-1]])
+    previous_na = np.vstack([np.ones((1, data.shape[1]), dtype=bool), na[:-1]])
+    changed = ~na & (previous_na | (data != previous))
+    column = {'type': kind,
+              'na': _pack_bits(na),
+              'changed': _pack_bits(changed),
+              'data': pack_array(data[changed], 'float32' if kind == 'float32' else 'int32')}
+    column.update(extra)
+    return column
+
+def time_frames(df, lat, lon, time_column, columns, id_column=None, precision=COMPACT_PRECISION):
+    '''
+    Encode a long table as station geometry plus one frame per time.
+
+    Parameters
+    ----------
+    df: DataFrame, required
+        one row per station and time, with latitude/longitude columns.
+        Rows with a null latitude, longitude, time or id are dropped.
+    lat, lon: str, required
+    time_column: str, required
+        column whose sorted distinct values are the frames.
+    columns: list, required
+        property columns animated over the frames.
+    id_column: str, default None
+        column identifying a station; without it every distinct
+        coordinate pair is a station.
+    precision: int, default COMPACT_PRECISION
+        decimal places kept for the station coordinates.
+
+    Returns the JSON text of {n, scale, lon, lat, times, properties}.
+    '''
+    if not 0 <= precision <= MAX_COMPACT_PRECISION:
+        raise ValueError("precision must be between 0 and {}".format(MAX_COMPACT_PRECISION))
+    keys = [lat, lon, time_column] + ([id_column] if id_column is not None else [])
+    df = df[notnull_mask(*[df[key].values for key in keys])]
+    codes, lons, lats = station_codes(df, lat, lon, id_column)
+    frame_codes, times = pd.factorize(df[time_column].values, sort=True)
+    scale = 10 ** precision
+    quantize = lambda arr: np.round(np.asarray(arr, dtype='float64') * scale)
+    properties = dict((str(col), encode_frame_column(pivot_frames(frame_codes, codes, len(times),
+                                                                  len(lons), df[col].values)))
+                      for col in df.columns if col in columns)
+    return json.dumps({'n': int(len(lons)),
+                       'scale': scale,
+                       'lon': pack_array(quantize(lons), 'int32'),
+                       'lat': pack_array(quantize(lats), 'int32'),
+                       'times': frame_labels(times),
+                       'properties': properties})
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Vectorized great-circle interpolation for LineMap edges.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import json
+import numpy as np
+
+from .encoders import pack_array, MAX_COMPACT_PRECISION
+
+
+## Global Variables
+#####################################################
+MAX_SEGMENT = 2.0      # degrees of arc per interpolated segment
+ARC_PRECISION = 4      # decimal places kept for packed arc vertices
+
+
+## Great Circles
+#####################################################
+def angular_distance(lon1, lat1, lon2, lat2):
+    ''' Central angle in radians between two arrays of points (haversine) '''
+    lon1, lat1, lon2, lat2 = [np.radians(np.asarray(a, dtype='float64')) for a in (lon1, lat1, lon2, lat2)]
+    h = (np.sin((lat2 - lat1) / 2.) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.) ** 2)
+    return 2. * np.arcsin(np.sqrt(np.clip(h, 0., 1.)))
+
+def great_circle_arcs(lon1, lat1, lon2, lat2, max_segment=MAX_SEGMENT):
+    '''
+    Interpolate every edge along its great circle in one pass.
+
+    Each edge gets ceil(angle / max_segment) segments, so short edges stay
+    two-point lines and long ones are smooth. Vertices come from spherical
+    linear interpolation between the endpoint unit vectors.
+
+    Returns lon, lat, offsets where the vertices of edge i are
+    lon[offsets[i]:offsets[i + 1]].
+    '''
+    angle = angular_distance(lon1, lat1, lon2, lat2)
+    nseg = np.maximum(1, np.ceil(np.degrees(angle) / max_segment)).astype('int64')
+    offsets = np.concatenate([[0], np.cumsum(nseg + 1)])
+    edge = np.repeat(np.arange(len(nseg)), nseg + 1)
+    f = (np.arange(offsets[-1]) - offsets[edge]) / nseg[edge]
+
+    rlon1, rlat1, rlon2, rlat2 = [np.radians(np.asarray(a, dtype='float64'))[edge]
+                                  for a in (lon1, lat1, lon2, lat2)]
+    d = angle[edge]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sind = np.sin(d)
+        a = np.where(sind > 1e-12, np.sin((1. - f) * d) / sind, 1. - f)
+        b = np.where(sind > 1e-12, np.sin(f * d) / sind, f)
+    x = a * np.cos(rlat1) * np.cos(rlon1) + b * np.cos(rlat2) * np.cos(rlon2)
+    y = a * np.cos(rlat1) * np.sin(rlon1) + b * np.cos(rlat2) * np.sin(rlon2)
+    z = a * np.sin(rlat1) + b * np.sin(rlat2)
+    lat = np.degrees(np.arctan2(z, np.sqrt(x ** 2 + y ** 2)))
+    lon = np.degrees(np.arctan2(y, x))
+    return lon, lat, offsets
+
+def split_antimeridian(lon, lat, offsets):
+    '''
+    Split arcs where consecutive vertices jump across the antimeridian.
+
+    A vertex pair is added on +/-180 at the interpolated crossing latitude,
+    ending one part and starting the next, so the parts can be projected
+    and drawn as plain polylines.
+
+    Returns lon, lat, part_offsets, arc_parts where the parts of edge i are
+    parts arc_parts[i]:arc_parts[i + 1] and the vertices of part j are
+    lon[part_offsets[j]:part_offsets[j + 1]].
+    '''
+    jump = np.abs(np.diff(lon)) > 180.
+    jump[offsets[1:-1] - 1] = False          # never split across two edges
+    crossings = np.flatnonzero(jump)         # split between crossings and crossings + 1
+
+    lon_a, lat_a = lon[crossings], lat[crossings]
+    lon_b, lat_b = lon[crossings + 1], lat[crossings + 1]
+    side = np.where(lon_a > 0, 180., -180.)
+    unwrapped = lon_b + 2 * side
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(unwrapped != lon_a, (side - lon_a) / (unwrapped - lon_a), 0.)
+    lat_c = lat_a + t * (lat_b - lat_a)
+
+    # every crossing inserts two vertices after position `crossings`
+    insert_at = np.repeat(crossings + 1, 2)
+    new_lon = np.insert(lon, insert_at, np.column_stack([side, -side]).ravel())
+    new_lat = np.insert(lat, insert_at, np.column_stack([lat_c, lat_c]).ravel())
+
+    # vertex offsets shift by two per crossing before them
+    shift = 2 * np.searchsorted(crossings, offsets, side='left')
+    edge_offsets = offsets + shift
+    part_starts = np.sort(np.concatenate([edge_offsets[:-1],
+                                          crossings + 2 * np.arange(len(crossings)) + 2]))
+    part_offsets = np.concatenate([part_starts, [len(new_lon)]])
+    arc_parts = np.searchsorted(part_starts, edge_offsets, side='left')
+    return new_lon, new_lat, part_offsets, arc_parts
+
+def pack_arcs(lon1, lat1, lon2, lat2, max_segment=MAX_SEGMENT, precision=ARC_PRECISION):
+    '''
+    Interpolate, split and pack every edge for the browser.
+
+    Returns the JSON text of {scale, lon, lat, parts, arcs}: quantized Int32
+    vertex arrays, Int32 vertex offsets per part and Int32 part offsets per
+    edge, all base64 encoded. `arcs.js` draws them without any further
+    interpolation.
+    '''
+    if not 0 <= precision <= MAX_COMPACT_PRECISION:
+        raise ValueError("precision must be between 0 and {}".format(MAX_COMPACT_PRECISION))
+    lon, lat, offsets = great_circle_arcs(lon1, lat1, lon2, lat2, max_segment)
+    lon, lat, parts, arcs = split_antimeridian(lon, lat, offsets)
+    scale = 10 ** precision
+    return json.dumps({'scale': scale,
+                       'lon': pack_array(np.round(lon * scale), 'int32'),
+                       'lat': pack_array(np.round(lat * scale), 'int32'),
+                       'parts': pack_array(parts, 'int32'),
+                       'arcs': pack_array(arcs, 'int32')})
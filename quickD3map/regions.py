@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Point-in-polygon joins against the regions of the bundled TopoJSON basemaps.
+
+A TopoJSON object (the states of us_states.json, the countries of the
+world maps) is decoded once into the edges of its polygon rings and
+indexed on a regular longitude/latitude grid:
+
+    cell_start  every cell's slice of the edges whose bounding box touches it
+    labels      the region holding every cell center, -1 for none
+
+A point in a cell without edges takes the label of the cell. A point in
+any other cell starts from the center label and toggles every region whose
+edges cross the segment from the center to the point, so only the few
+edges of its own cell are tested, never a whole polygon. Crossings use a
+half-open side rule, so a segment through a shared vertex is counted once.
+
+Regions are numbered by their position in the object's geometries, which
+the basemap level-of-detail variants keep. Indexes are cached in memory
+and as .npz files next to the simplified basemaps.
+
+RegionTotals accumulates the point count and column sum of every region
+one chunk at a time, for ChoroplethMap.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+
+from .topology import decode_arcs, default_cache_dir, HASH_LENGTH
+from .column_stats import column_stats
+
+
+## Global Variables
+#####################################################
+CELL_EDGES = 1              # default cell size, in median edge lengths
+MAX_CELLS = 1 << 20         # the default cell size is raised to keep the grid below this
+PAIR_BATCH = 1 << 22        # point/edge pairs tested at once
+INDEX_VERSION = 1           # bump when the cached index layout changes
+STATISTICS = ['count', 'sum', 'mean']
+
+_lock = threading.Lock()
+_indexes = {}   # (digest, object name) -> RegionIndex
+
+
+## Decoding
+#####################################################
+def _polygons(geometry):
+    ''' The polygons (lists of rings of arc references) of a geometry '''
+    if geometry.get('type') == 'Polygon':
+        return [geometry['arcs']]
+    if geometry.get('type') == 'MultiPolygon':
+        return geometry['arcs']
+    return []
+
+def _unwrap_rings(lon, ring_length):
+    '''
+    Remove the 360 degree jumps of rings crossing the antimeridian, so
+    every ring is one planar polygon starting within [-180, 180). Rings
+    that do not close once unwrapped (around a pole) are left as they are.
+    '''
+    ring = np.repeat(np.arange(len(ring_length)), ring_length)
+    step = np.r_[0., np.diff(lon)]
+    step[ring != np.r_[-1, ring[:-1]]] = 0.
+    shift = np.cumsum(-360. * np.round(step / 360.))
+    ends = np.cumsum(ring_length) - 1
+    shift -= np.repeat(shift[ends - ring_length + 1], ring_length)
+    closed = shift[ends] == 0.
+    unwrapped = lon + np.where(closed[ring], shift, 0.)
+    first = np.minimum.reduceat(unwrapped, ends - ring_length + 1) if len(lon) else unwrapped
+    return unwrapped - 360. * np.floor((first[ring] + 180.) / 360.)
+
+def region_edges(topology, name):
+    '''
+    Decode the polygons of TopoJSON object `name` into straight edges.
+
+    Returns x0, y0, x1, y1 (degrees), the region of every edge and the ids
+    of the regions (the geometry `id`, None when missing), in the order of
+    the object's geometries.
+    '''
+    x, y, offsets = decode_arcs(topology['arcs'])
+    (sx, sy), (tx, ty) = topology['transform']['scale'], topology['transform']['translate']
+    geometries = topology['objects'][name].get('geometries', [topology['objects'][name]])
+    pieces, ring_length, ring_region = [], [], []
+    for region, geometry in enumerate(geometries):
+        for polygon in _polygons(geometry):
+            for ring in polygon:
+                length = 0
+                for position, ref in enumerate(ring):
+                    arc = ref if ref >= 0 else ~ref
+                    vertices = np.arange(offsets[arc], offsets[arc + 1])
+                    vertices = vertices if ref >= 0 else vertices[::-1]
+                    # consecutive arcs of a ring share their end point
+                    pieces.append(vertices[1:] if position else vertices)
+                    length += len(pieces[-1])
+                ring_length.append(length)
+                ring_region.append(region)
+    index = np.concatenate(pieces) if pieces else np.zeros(0, dtype='int64')
+    vx, vy = _unwrap_rings(x[index] * sx + tx, np.array(ring_length, dtype='int64')), y[index] * sy + ty
+    # rings are closed, so every vertex but the last of its ring starts an edge
+    starts = np.ones(len(index), dtype=bool)
+    starts[np.cumsum(ring_length) - 1] = False
+    first = np.flatnonzero(starts)
+    first = first[(vx[first] != vx[first + 1]) | (vy[first] != vy[first + 1])]
+    region = np.repeat(np.array(ring_region, dtype='int64'), ring_length)[first]
+    ids = [geometry.get('id') for geometry in geometries]
+    return vx[first], vy[first], vx[first + 1], vy[first + 1], region, ids
+
+
+## Index
+#####################################################
+def _orient(ax, ay, bx, by, cx, cy):
+    ''' Sign of the turn a -> b -> c, True for strictly counter-clockwise '''
+    return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax) > 0
+
+def _expand(first, count):
+    ''' Positions first[k] .. first[k] + count[k] - 1 for every k, and their k '''
+    owner = np.repeat(np.arange(len(count)), count)
+    step = np.arange(len(owner)) - np.repeat(np.cumsum(count) - count, count)
+    return first[owner] + step, owner
+
+
+class RegionIndex(object):
+    '''
+    Grid index assigning points to the regions of a set of polygon edges.
+
+    Parameters
+    ----------
+    x0, y0, x1, y1: array, required
+        edge end points in degrees, e.g. from region_edges.
+    region: array, required
+        region number of every edge. Regions must not overlap.
+    ids: list, required
+        id of every region.
+    cell: float, default None
+        grid cell size in degrees. By default CELL_EDGES times the median
+        edge length, so a cell on a border holds only a few edges.
+    '''
+    def __init__(self, x0, y0, x1, y1, region, ids, cell=None):
+        self.ids = list(ids)
+        x0, y0, x1, y1 = [np.asarray(a, dtype='float64') for a in (x0, y0, x1, y1)]
+        region = np.asarray(region, dtype='int64')
+        west, east = min(x0.min(), x1.min()), max(x0.max(), x1.max())
+        south, north = min(y0.min(), y1.min()), max(y0.max(), y1.max())
+        if cell is None:
+            cell = max(CELL_EDGES * np.median(np.hypot(x1 - x0, y1 - y0)),
+                       np.sqrt((east - west) * (north - south) / MAX_CELLS))
+        self.cell = float(cell)
+        self.west, self.south = west, south
+        self.ncols = int(np.floor((east - west) / self.cell)) + 1
+        self.nrows = int(np.floor((north - south) / self.cell)) + 1
+
+        # every edge in all cells its bounding box touches
+        c0, c1 = self._cols(np.minimum(x0, x1)), self._cols(np.maximum(x0, x1))
+        r0, r1 = self._rows(np.minimum(y0, y1)), self._rows(np.maximum(y0, y1))
+        width = c1 - c0 + 1
+        local, edge = _expand(np.zeros(len(x0), dtype='int64'), width * (r1 - r0 + 1))
+        keys = (r0[edge] + local // width[edge]) * self.ncols + c0[edge] + local % width[edge]
+        order = np.argsort(keys, kind='mergesort')
+        edge = edge[order]
+        self.cell_start = np.searchsorted(keys[order], np.arange(self.ncols * self.nrows + 1)).astype('int32')
+        self.x0, self.y0, self.x1, self.y1 = x0[edge], y0[edge], x1[edge], y1[edge]
+        self.region = region[edge]
+        self.labels = self._center_labels(x0, y0, x1, y1, region, r0, r1)
+
+    def _cols(self, lon):
+        return np.clip(np.floor((lon - self.west) / self.cell), 0, self.ncols - 1).astype('int64')
+
+    def _rows(self, lat):
+        return np.clip(np.floor((lat - self.south) / self.cell), 0, self.nrows - 1).astype('int64')
+
+    def _center_labels(self, x0, y0, x1, y1, region, r0, r1):
+        ''' Region of every cell center, by casting a ray east along each grid row '''
+        row, edge = _expand(r0, r1 - r0 + 1)
+        cy = self.south + (row + .5) * self.cell
+        straddle = (y0[edge] > cy) != (y1[edge] > cy)
+        row, edge, cy = row[straddle], edge[straddle], cy[straddle]
+        labels = np.full((self.nrows, self.ncols), -1, dtype='int64')
+        if not len(row):
+            return labels.ravel().astype('int32')
+        xs = x0[edge] + (cy - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+        order = np.lexsort((xs, region[edge], row))
+        row, group_region, xs = row[order], region[edge][order], xs[order]
+        bounds = np.flatnonzero(np.r_[True, (row[1:] != row[:-1]) | (group_region[1:] != group_region[:-1]), True])
+        centers = self.west + (np.arange(self.ncols) + .5) * self.cell
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            east = (b - a) - np.searchsorted(xs[a:b], centers, side='right')
+            labels[row[a], east % 2 == 1] = group_region[a]
+        return labels.ravel().astype('int32')
+
+    def locate(self, lon, lat):
+        '''
+        Return the region number of every point, -1 outside all regions.
+        Longitudes are wrapped into [-180, 180); NA coordinates give -1.
+        Regions crossing the antimeridian are unwrapped east of 180, so
+        points left outside are looked up once more 360 degrees east.
+        '''
+        lon = np.mod(np.asarray(lon, dtype='float64') + 180., 360.) - 180.
+        lat = np.asarray(lat, dtype='float64')
+        out = self._locate(lon, lat)
+        # rings unwrapped across the antimeridian extend east of 180
+        if self.west + self.ncols * self.cell > 180.:
+            again = np.flatnonzero(out < 0)
+            out[again] = self._locate(lon[again] + 360., lat[again])
+        return out
+
+    def _locate(self, lon, lat):
+        out = np.full(len(lon), -1, dtype='int64')
+        inside = ((lon >= self.west) & (lon < self.west + self.ncols * self.cell) &
+                  (lat >= self.south) & (lat < self.south + self.nrows * self.cell))
+        points = np.flatnonzero(inside)
+        keys = self._rows(lat[points]) * self.ncols + self._cols(lon[points])
+        out[points] = self.labels[keys]
+        count = self.cell_start[keys + 1] - self.cell_start[keys]
+        boundary = count > 0
+        points, keys, count = points[boundary], keys[boundary], count[boundary]
+        # batches of points with about PAIR_BATCH point/edge pairs
+        total, start = np.cumsum(count), 0
+        while start < len(points):
+            done = total[start - 1] if start else 0
+            stop = max(start + 1, int(np.searchsorted(total, done + PAIR_BATCH, side='right')))
+            self._toggle(out, lon, lat, points[start:stop], keys[start:stop], count[start:stop])
+            start = stop
+        return out
+
+    def _toggle(self, out, lon, lat, points, keys, count):
+        ''' Resolve points in cells with edges from their cell center label '''
+        edge, owner = _expand(self.cell_start[keys], count)
+        px, py = lon[points][owner], lat[points][owner]
+        cx = self.west + (keys % self.ncols + .5)[owner] * self.cell
+        cy = self.south + (keys // self.ncols + .5)[owner] * self.cell
+        ax, ay, bx, by = self.x0[edge], self.y0[edge], self.x1[edge], self.y1[edge]
+        cross = ((_orient(cx, cy, px, py, ax, ay) != _orient(cx, cy, px, py, bx, by)) &
+                 (_orient(ax, ay, bx, by, cx, cy) != _orient(ax, ay, bx, by, px, py)))
+        # parity of crossings per (point, region), plus one for the center's region
+        nregions = len(self.ids)
+        center = out[points]
+        toggles = np.concatenate([owner[cross] * nregions + self.region[edge][cross],
+                                  np.flatnonzero(center >= 0) * nregions + center[center >= 0]])
+        unique, counts = np.unique(toggles, return_counts=True)
+        odd = unique[counts % 2 == 1]
+        result = np.full(len(points), -1, dtype='int64')
+        result[odd // nregions] = odd % nregions
+        out[points] = result
+
+    ## Persistence
+    ########################################################################################
+    _arrays = ['cell_start', 'x0', 'y0', 'x1', 'y1', 'region', 'labels']
+
+    def save(self, path):
+        meta = np.array([self.cell, self.west, self.south, self.ncols, self.nrows, INDEX_VERSION])
+        ids = np.array(json.dumps(self.ids))
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, meta=meta, ids=ids, **dict((name, getattr(self, name)) for name in self._arrays))
+
+    @classmethod
+    def load(cls, path):
+        ''' Read an index written by save, None when it has an older layout '''
+        with np.load(path) as data:
+            meta = data['meta']
+            if int(meta[5]) != INDEX_VERSION:
+                return None
+            index = cls.__new__(cls)
+            index.cell, index.west, index.south = float(meta[0]), float(meta[1]), float(meta[2])
+            index.ncols, index.nrows = int(meta[3]), int(meta[4])
+            index.ids = json.loads(str(data['ids']))
+            for name in cls._arrays:
+                setattr(index, name, data[name])
+        return index
+
+
+def region_index(filename, source, name, cache_dir=None):
+    '''
+    Return the RegionIndex of TopoJSON object `name` in a basemap.
+
+    Parameters
+    ----------
+    filename: str, required
+        basemap file name, used to name the cached index.
+    source: bytes, required
+        content of the TopoJSON file.
+    name: str, required
+        object holding the regions, e.g. "states" or "countries".
+    cache_dir: str, default None
+        where indexes are stored; default_cache_dir() when None. Like the
+        simplified basemaps they are named after a hash of the source.
+    '''
+    digest = hashlib.sha1(source).hexdigest()[:HASH_LENGTH]
+    with _lock:
+        if (digest, name) in _indexes:
+            return _indexes[(digest, name)]
+    cache_dir = cache_dir or default_cache_dir()
+    root = os.path.splitext(os.path.basename(filename))[0]
+    path = os.path.join(cache_dir, '{}.{}.index{}.{}.npz'.format(root, name, INDEX_VERSION, digest))
+    index = RegionIndex.load(path) if os.path.exists(path) else None
+    if index is None:
+        topology = json.loads(source.decode('utf-8'))
+        index = RegionIndex(*region_edges(topology, name))
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            index.save(tmp)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            pass   # an unwritable cache only costs a rebuild
+    with _lock:
+        _indexes[(digest, name)] = index
+    return index
+
+
+## Aggregation
+#####################################################
+class RegionTotals(object):
+    '''
+    Accumulate the point count and column sum of every region of an index.
+
+    Parameters
+    ----------
+    index: RegionIndex, required
+        regions the points are joined to.
+    '''
+    def __init__(self, index):
+        self.index = index
+        n = len(index.ids)
+        # per region: point count, column sum and non-NaN count
+        self.count, self.total, self.valid = np.zeros(n), np.zeros(n), np.zeros(n)
+        self.points = 0
+        self.outside = 0
+
+    def update(self, lon, lat, values=None):
+        ''' Add points; NaN `values` count as points but not in the sum/mean '''
+        region = self.index.locate(lon, lat)
+        inside = region >= 0
+        region, n = region[inside], len(self.count)
+        self.count += np.bincount(region, minlength=n)
+        if values is not None:
+            values = np.asarray(values, dtype='float64')[inside]
+            valid = ~np.isnan(values)
+            self.total += np.bincount(region[valid], weights=values[valid], minlength=n)
+            self.valid += np.bincount(region[valid], minlength=n)
+        self.points += len(inside)
+        self.outside += int((~inside).sum())
+        return self
+
+    def values(self, statistic='count'):
+        ''' The statistic of every region, NaN for sum/mean without a value '''
+        if statistic not in STATISTICS:
+            raise ValueError("statistic must be one of the following:{}".format(STATISTICS))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return {'count': self.count,
+                    'sum': np.where(self.valid > 0, self.total, np.nan),
+                    'mean': np.where(self.valid > 0, self.total / self.valid, np.nan)}[statistic]
+
+
+def choropleth_to_json(totals, name, statistic, column=None, rows=None):
+    '''
+    Serialize RegionTotals for the choropleth_map.html template.
+
+    Counts and values are listed in the order of the object's geometries,
+    values without a point as null, next to the column_stats summary of
+    the region values for the colorbrewer scale.
+    '''
+    value = totals.values(statistic)
+    return json.dumps({'object': name, 'statistic': statistic, 'column': column,
+                       'ids': totals.index.ids,
+                       'counts': [int(c) for c in totals.count],
+                       'values': [None if np.isnan(v) else float(v) for v in value],
+                       'stats': column_stats([('value', value)])['value'],
+                       'rows': totals.points if rows is None else rows,
+                       'points': totals.points, 'outside': totals.outside})
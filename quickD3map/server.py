@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Serve one or more maps from a Flask app.
+
+Pages are rendered once when a map is mounted and kept as bytes together
+with a gzipped copy and an ETag. Maps mounted with `viewport=True` do not
+embed their points: the page asks `/<name>/features` for the points inside
+the visible bounding box, answered from a GridIndex and clustered when a
+view holds more than `max_features` points.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import io
+import gzip
+import hashlib
+
+import numpy as np
+
+from flask import Flask, Response, request, abort
+
+from .encoders import is_numeric, point_columns, write_point_features
+from .clustering import mercator_xy, mercator_lonlat, grid_clusters, CELL_PIXELS
+from .spatial import GridIndex
+from .utilities import zoom_templates
+
+try:
+    from io import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+
+MAX_FEATURES = 5000
+GZIP_LEVEL = 6
+
+
+def _gzip(data, level=GZIP_LEVEL):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=level) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+class _Payload(object):
+    ''' Prebuilt response body with its gzipped copy and ETag '''
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.gzipped = _gzip(body)
+        self.etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        self.mimetype = mimetype
+
+
+class _ViewportData(object):
+    ''' Point arrays of a mounted map with a spatial index over them '''
+    def __init__(self, lon, lat, properties, max_features):
+        self.lon, self.lat = np.asarray(lon, dtype='float64'), np.asarray(lat, dtype='float64')
+        self.properties = properties
+        self.index = GridIndex(self.lon, self.lat)
+        self.max_features = max_features
+
+    def features(self, west, south, east, north, zoom):
+        ''' Return GeoJSON text for the points in a bounding box.
+            When there are more than max_features points they are
+            clustered on the grid used for the given zoom scale, coarsened
+            until at most max_features clusters remain.
+        '''
+        found = self.index.query(west, south, east, north)
+        lon, lat = self.lon[found], self.lat[found]
+        out = StringIO()
+        if len(found) <= self.max_features:
+            properties = [(name, values[found]) for name, values in self.properties]
+            write_point_features(out, lon, lat, properties)
+        else:
+            numeric = [(name, values[found]) for name, values in self.properties
+                       if is_numeric(values)]
+            x, y = mercator_xy(lon, lat)
+            cell = CELL_PIXELS / max(zoom, 1.)
+            while True:
+                cx, cy, count, _, means = grid_clusters(x, y, cell, [values for _, values in numeric])
+                if len(count) <= self.max_features:
+                    break
+                cell *= 2
+            clon, clat = mercator_lonlat(cx, cy)
+            properties = [('count', count)] + [(name, mean) for (name, _), mean in zip(numeric, means)]
+            write_point_features(out, clon, clat, properties)
+        return out.getvalue()
+
+
+class MapServer(object):
+    '''
+    A Flask application serving prebuilt maps.
+
+    Routes
+    ------
+    /                    the map when only one is mounted, else an index
+    /<name>/             the page of a mounted map
+    /<name>/features     GeoJSON for ?bbox=west,south,east,north&zoom=scale
+                         (maps mounted with viewport=True)
+
+    `server.app` is a regular WSGI application and can be handed to any
+    production WSGI server instead of using `run`.
+
+    Examples
+    --------
+    >>>server = MapServer()
+    >>>server.mount('stations', PointMap(stations), viewport=True)
+    >>>server.mount('cities', LineMap(cities, 'city', distances))
+    >>>server.run(threaded=True)
+    '''
+    def __init__(self, import_name=__name__):
+        self.maps = {}
+        self.viewports = {}
+        self.app = Flask(import_name)
+        self.app.add_url_rule('/', 'index', self._index)
+        self.app.add_url_rule('/<name>/', 'page', self._page)
+        self.app.add_url_rule('/<name>/features', 'features', self._features)
+
+    def mount(self, name, map, viewport=False, max_features=MAX_FEATURES):
+        '''
+        Render a map once and serve it under /<name>/.
+
+        Parameters
+        ----------
+        name: str, required
+            url segment for the map.
+        map: BaseMap instance, required
+            a PointMap, LineMap or other map object.
+        viewport: boolean, default False
+            keep the points server side behind a spatial index and let
+            the page request only the visible ones. Only for maps with a
+            zoomable world template.
+        max_features: int, default 5000
+            above this many points in a view, the features endpoint
+            returns clusters instead of raw points. At least 1.
+        '''
+        if viewport:
+            if max_features < 1:
+                raise ValueError("max_features must be at least 1")
+            if map.df is None:
+                raise ValueError("Viewport loading needs an in-memory DataFrame, not chunked input")
+            if map.map_templates[map.map]['template'] not in zoom_templates:
+                raise ValueError("Viewport loading is only available for the world maps")
+            if map.renderer != "svg":
+                raise ValueError("Viewport loading is only available with the svg renderer")
+            if map.page_template() not in zoom_templates:
+                raise ValueError("Viewport loading is only available for point and line maps")
+            if getattr(map, 'time_column', None) is not None:
+                raise ValueError("Viewport loading does not animate a time column")
+            # the lines and other data of the map are embedded, only the points are served
+            map.convert_data()
+            lon, lat, properties = point_columns(map.df, map.lat, map.lon, getattr(map, 'columns', None))
+            self.viewports[name] = _ViewportData(lon, lat, properties, max_features)
+            template_vars = dict(map.template_vars, geojson=None, compact_points=None, clusters=None,
+                                 map_data=map.basemap(),
+                                 viewport_url='/{}/features'.format(name))
+            html_templ = map.env.get_template(map.page_template())
+            body = html_templ.render(template_vars).encode('utf-8')
+        else:
+            out = io.BytesIO()
+            map.write_map(out)
+            body = out.getvalue()
+        self.maps[name] = _Payload(body, 'text/html')
+        return self
+
+    def _respond(self, payload):
+        if request.if_none_match and payload.etag.strip('"') in request.if_none_match:
+            return Response(status=304, headers={'ETag': payload.etag})
+        headers = {'ETag': payload.etag, 'Vary': 'Accept-Encoding'}
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+            return Response(payload.gzipped, mimetype=payload.mimetype, headers=headers)
+        return Response(payload.body, mimetype=payload.mimetype, headers=headers)
+
+    def _index(self):
+        if len(self.maps) == 1:
+            return self._respond(list(self.maps.values())[0])
+        links = ''.join('<li><a href="/{0}/">{0}</a></li>'.format(name) for name in sorted(self.maps))
+        return '<html><body><h2>quickD3map</h2><ul>{}</ul></body></html>'.format(links)
+
+    def _page(self, name):
+        if name not in self.maps:
+            abort(404)
+        return self._respond(self.maps[name])
+
+    def _features(self, name):
+        if name not in self.viewports:
+            abort(404)
+        try:
+            west, south, east, north = [float(v) for v in request.args['bbox'].split(',')]
+            zoom = float(request.args.get('zoom', 1 << 10))
+        except (KeyError, ValueError):
+            abort(400)
+        body = self.viewports[name].features(west, south, east, north, zoom).encode('utf-8')
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            return Response(_gzip(body, 1), mimetype='application/json',
+                            headers={'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+        return Response(body, mimetype='application/json')
+
+    def run(self, host='127.0.0.1', port=5000, threaded=True, processes=1, **kwargs):
+        ''' Run the Flask server. `threaded` and `processes` are passed to app.run '''
+        self.app.run(host=host, port=port, threaded=threaded, processes=processes, **kwargs)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Spatial indexes over lon/lat arrays.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import numpy as np
+
+
+def _wrap(lon):
+    ''' Wrap a longitude into [-180, 180] '''
+    if -180. <= lon <= 180.:
+        return lon
+    return (lon + 180.) % 360. - 180.
+
+
+class GridIndex(object):
+    '''
+    A fixed grid over longitude/latitude.
+
+    Points are sorted by cell so every cell is a contiguous slice of
+    `order`; a bounding box query touches one slice per grid row and then
+    filters the candidates exactly. Building is a sort, queries are
+    proportional to the number of points near the box.
+
+    Parameters
+    ----------
+    lon, lat: array, required
+        point coordinates in degrees, no NA values.
+    cell: float, default None
+        cell size in degrees. By default chosen so that there are on the
+        order of 16 points per occupied cell.
+    '''
+    def __init__(self, lon, lat, cell=None):
+        self.lon = np.asarray(lon, dtype='float64')
+        self.lat = np.asarray(lat, dtype='float64')
+        if cell is None:
+            cell = max(0.01, 180. * np.sqrt(16. / max(len(self.lon), 1)))
+        self.cell = float(cell)
+        self.ncols = int(np.ceil(360. / self.cell)) + 1
+        self.nrows = int(np.ceil(180. / self.cell)) + 1
+        keys = self._keys(self.lon, self.lat)
+        self.order = np.argsort(keys, kind='mergesort')
+        self.keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.lon)
+
+    def _cols(self, lon):
+        return np.clip(np.floor((np.asarray(lon) + 180.) / self.cell), 0, self.ncols - 1).astype('int64')
+
+    def _rows(self, lat):
+        return np.clip(np.floor((np.asarray(lat) + 90.) / self.cell), 0, self.nrows - 1).astype('int64')
+
+    def _keys(self, lon, lat):
+        return self._rows(lat) * self.ncols + self._cols(lon)
+
+    def _query(self, west, south, east, north):
+        col0, col1 = self._cols(west), self._cols(east)
+        rows = np.arange(self._rows(south), self._rows(north) + 1)
+        if not len(rows):
+            return np.zeros(0, dtype='int64')
+        starts = np.searchsorted(self.keys, rows * self.ncols + col0, side='left')
+        stops = np.searchsorted(self.keys, rows * self.ncols + col1, side='right')
+        candidates = np.concatenate([self.order[a:b] for a, b in zip(starts, stops)])
+        lon, lat = self.lon[candidates], self.lat[candidates]
+        inside = (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+        return candidates[inside]
+
+    def query(self, west, south, east, north):
+        '''
+        Return the positions of the points inside a bounding box, in
+        ascending order. Longitudes outside [-180, 180] are wrapped and a box
+        crossing the antimeridian (west > east after wrapping) is split.
+        '''
+        if east - west >= 360.:
+            west, east = -180., 180.
+        else:
+            west, east = _wrap(west), _wrap(east)
+        south, north = max(south, -90.), min(north, 90.)
+        if west <= east:
+            found = self._query(west, south, east, north)
+        else:
+            found = np.concatenate([self._query(west, south, 180., north),
+                                    self._query(-180., south, east, north)])
+        return np.sort(found)
@@ -0,0 +1,28 @@
+	// Packed Great-Circle Arcs
+	// vertices are interpolated and split at the antimeridian by
+	// quickD3map.geometry.pack_arcs; here they are only projected.
+	/////////////////////////////////////////////
+	function quickD3map_decodeArcs(packed) {
+		var lon = quickD3map_unpack(packed.lon, "int32"),
+		    lat = quickD3map_unpack(packed.lat, "int32"),
+		    coords = new Float64Array(lon.length * 2);
+		for (var i = 0; i < lon.length; i++) {
+			coords[2 * i] = lon[i] / packed.scale;
+			coords[2 * i + 1] = lat[i] / packed.scale;
+		}
+		return {coords: coords,
+		        parts: quickD3map_unpack(packed.parts, "int32"),
+		        arcs: quickD3map_unpack(packed.arcs, "int32")};
+	}
+
+	// one svg path string holding every arc
+	function quickD3map_arcPath(arcs) {
+		var d = [], coords = arcs.coords, parts = arcs.parts;
+		for (var j = 0; j < parts.length - 1; j++) {
+			for (var i = parts[j]; i < parts[j + 1]; i++) {
+				var p = projection([coords[2 * i], coords[2 * i + 1]]);
+				d.push((i === parts[j] ? "M" : "L") + p[0].toFixed(1) + "," + p[1].toFixed(1));
+			}
+		}
+		return d.join("");
+	}
@@ -0,0 +1,269 @@
+	// Canvas Rendering
+	// points and lines are batch drawn on one <canvas> instead of one svg
+	// path per feature. Every point is projected once at unit scale, so a
+	// zoom only applies the linear scale/translate, and a static quadtree
+	// over the unit positions answers hover picks.
+	/////////////////////////////////////////////
+	var quickD3map_style = {country: {fill: "#ccc", stroke: "#fff"},
+	                        line:    {stroke: "#333", width: 1.5},
+	                        symbol:  {fill: "steelblue", opacity: 0.8, stroke: "#fff"}};
+	var QUICKD3MAP_LEAF = 16;
+
+	// positions with projection.scale(1).translate([0, 0]); the screen
+	// position is then [x * scale + translate[0], y * scale + translate[1]]
+	function quickD3map_unitProject(projection, lon, lat) {
+		var scale = projection.scale(), translate = projection.translate(),
+		    n = lon.length, x = new Float64Array(n), y = new Float64Array(n);
+		projection.scale(1).translate([0, 0]);
+		for (var i = 0; i < n; i++) {
+			var p = projection([lon[i], lat[i]]);
+			x[i] = p ? p[0] : NaN;
+			y[i] = p ? p[1] : NaN;
+		}
+		projection.scale(scale).translate(translate);
+		return {x: x, y: y};
+	}
+
+	// point-region quadtree over index arrays, leaves hold up to QUICKD3MAP_LEAF points
+	function quickD3map_quadtree(x, y) {
+		var n = x.length, index = new Uint32Array(n), tmp = new Uint32Array(n), m = 0,
+		    x0 = Infinity, y0 = Infinity, x1 = -Infinity, y1 = -Infinity;
+		for (var i = 0; i < n; i++) {
+			if (x[i] !== x[i] || y[i] !== y[i]) { continue; }
+			index[m++] = i;
+			x0 = Math.min(x0, x[i]); y0 = Math.min(y0, y[i]);
+			x1 = Math.max(x1, x[i]); y1 = Math.max(y1, y[i]);
+		}
+
+		function build(lo, hi, x0, y0, x1, y1, depth) {
+			var node = {lo: lo, hi: hi, x0: x0, y0: y0, x1: x1, y1: y1, children: null};
+			if (hi - lo <= QUICKD3MAP_LEAF || depth === 32) { return node; }
+			var xm = (x0 + x1) / 2, ym = (y0 + y1) / 2,
+			    quad = function(j) { return (x[j] >= xm ? 1 : 0) + (y[j] >= ym ? 2 : 0); },
+			    counts = [0, 0, 0, 0], starts = [lo, 0, 0, 0];
+			for (var i = lo; i < hi; i++) { counts[quad(index[i])]++; }
+			for (var q = 1; q < 4; q++) { starts[q] = starts[q - 1] + counts[q - 1]; }
+			var fill = starts.slice();
+			for (i = lo; i < hi; i++) { tmp[fill[quad(index[i])]++] = index[i]; }
+			index.set(tmp.subarray(lo, hi), lo);
+			node.children = [build(starts[0], starts[0] + counts[0], x0, y0, xm, ym, depth + 1),
+			                 build(starts[1], starts[1] + counts[1], xm, y0, x1, ym, depth + 1),
+			                 build(starts[2], starts[2] + counts[2], x0, ym, xm, y1, depth + 1),
+			                 build(starts[3], starts[3] + counts[3], xm, ym, x1, y1, depth + 1)];
+			return node;
+		}
+		var root = build(0, m, x0, y0, x1, y1, 0);
+
+		// nearest point within r of (px, py) for which accept(i, squared distance) holds, or -1
+		function find(px, py, r, accept) {
+			var best = -1, bestDistance = Infinity, stack = [root];
+			while (stack.length) {
+				var node = stack.pop();
+				if (node.hi === node.lo || px < node.x0 - r || px > node.x1 + r ||
+				    py < node.y0 - r || py > node.y1 + r) { continue; }
+				if (node.children) { stack.push.apply(stack, node.children); continue; }
+				for (var k = node.lo; k < node.hi; k++) {
+					var j = index[k], dx = x[j] - px, dy = y[j] - py, d = dx * dx + dy * dy;
+					if (d < bestDistance && accept(j, d)) { best = j; bestDistance = d; }
+				}
+			}
+			return best;
+		}
+		return {find: find};
+	}
+
+	// columns of a compact payload ({n, scale, lon, lat, properties}) or of a FeatureCollection
+	function quickD3map_pointLayer(data) {
+		var layer = {};
+		if (data.features) {
+			var features = data.features;
+			layer.n = features.length;
+			layer.lon = new Float64Array(layer.n);
+			layer.lat = new Float64Array(layer.n);
+			for (var i = 0; i < layer.n; i++) {
+				layer.lon[i] = features[i].geometry.coordinates[0];
+				layer.lat[i] = features[i].geometry.coordinates[1];
+			}
+			layer.value = function(name, i) { return features[i].properties[name]; };
+			layer.feature = function(i) { return features[i]; };
+			return layer;
+		}
+		var lon = quickD3map_unpack(data.lon, "int32"), lat = quickD3map_unpack(data.lat, "int32"),
+		    names = Object.keys(data.properties), columns = {};
+		layer.n = data.n;
+		layer.lon = new Float64Array(data.n);
+		layer.lat = new Float64Array(data.n);
+		for (var i = 0; i < data.n; i++) {
+			layer.lon[i] = lon[i] / data.scale;
+			layer.lat[i] = lat[i] / data.scale;
+		}
+		names.forEach(function(name) {
+			var col = data.properties[name];
+			columns[name] = col.type === "dictionary" ? quickD3map_undictionary(col)
+			                                          : quickD3map_unpack(col.data, col.type);
+		});
+		layer.value = function(name, i) { return columns[name] ? columns[name][i] : undefined; };
+		layer.feature = function(i) {
+			var properties = {};
+			names.forEach(function(name) { properties[name] = columns[name][i]; });
+			return {type: "Feature", properties: properties,
+			        geometry: {type: "Point", coordinates: [layer.lon[i], layer.lat[i]]}};
+		};
+		return layer;
+	}
+
+	// straight segments between unit projected endpoints
+	function quickD3map_canvasSegments(projection, lines) {
+		var n = lines.features.length, lon = new Float64Array(2 * n), lat = new Float64Array(2 * n);
+		lines.features.forEach(function(f, i) {
+			var c = f.geometry.coordinates;
+			lon[2 * i] = c[0][0]; lat[2 * i] = c[0][1];
+			lon[2 * i + 1] = c[1][0]; lat[2 * i + 1] = c[1][1];
+		});
+		var xy = quickD3map_unitProject(projection, lon, lat);
+		return function(context, s, t) {
+			for (var i = 0; i < 2 * n; i += 2) {
+				context.moveTo(xy.x[i] * s + t[0], xy.y[i] * s + t[1]);
+				context.lineTo(xy.x[i + 1] * s + t[0], xy.y[i + 1] * s + t[1]);
+			}
+		};
+	}
+
+	// precomputed great-circle arcs from quickD3map_decodeArcs
+	function quickD3map_canvasArcs(projection, arcs) {
+		var n = arcs.coords.length / 2, lon = new Float64Array(n), lat = new Float64Array(n);
+		for (var i = 0; i < n; i++) { lon[i] = arcs.coords[2 * i]; lat[i] = arcs.coords[2 * i + 1]; }
+		var xy = quickD3map_unitProject(projection, lon, lat), parts = arcs.parts;
+		return function(context, s, t) {
+			for (var j = 0; j < parts.length - 1; j++) {
+				for (var i = parts[j]; i < parts[j + 1]; i++) {
+					var px = xy.x[i] * s + t[0], py = xy.y[i] * s + t[1];
+					if (i === parts[j]) { context.moveTo(px, py); } else { context.lineTo(px, py); }
+				}
+			}
+		};
+	}
+
+	// GeoJSON lines drawn through d3.geo.path, which follows great circles
+	function quickD3map_canvasGeoLines(lines) {
+		var geometry = {type: "MultiLineString",
+		                coordinates: lines.features.map(function(f) { return f.geometry.coordinates; })};
+		return function(context, s, t, path) { path(geometry); };
+	}
+
+	function quickD3map_escape(value) {
+		return String(value).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+	}
+
+	// options: projection, basemap (GeoJSON), layer, pointSize, lines (a drawing
+	// function from above) and size(layer, i) to override the point radius
+	function quickD3map_canvasMap(options) {
+		var projection = options.projection, pointSize = options.pointSize,
+		    ratio = window.devicePixelRatio || 1,
+		    container = d3.select("#map").style("position", "relative"),
+		    canvas = container.append("canvas")
+		        .attr("width", width * ratio)
+		        .attr("height", height * ratio)
+		        .style("width", width + "px")
+		        .style("height", height + "px"),
+		    tooltip = container.append("div").attr("class", "quickD3map-tooltip").style("display", "none"),
+		    context = canvas.node().getContext("2d"),
+		    path = d3.geo.path().projection(projection).context(context),
+		    layer, xy, tree, sizes, maxSize, groups, column = null, pending = false;
+		context.scale(ratio, ratio);
+
+		function setLayer(next) {
+			layer = next;
+			xy = quickD3map_unitProject(projection, layer.lon, layer.lat);
+			tree = quickD3map_quadtree(xy.x, xy.y);
+			restyle();
+		}
+
+		// radius and color of every point for the selected column, grouped by color
+		function restyle() {
+			var scales = column ? quickD3map_columnScales(column_stats, column, radius, pointSize) : null,
+			    keys = {};
+			sizes = new Float32Array(layer.n);
+			maxSize = 0;
+			groups = [];
+			for (var i = 0; i < layer.n; i++) {
+				var v = column ? layer.value(column, i) : null,
+				    color = scales ? scales.color(v) : null,
+				    key = color || "";
+				sizes[i] = options.size ? options.size(layer, i)
+				         : scales ? scales.size(v) : column ? radius(v) : pointSize;
+				if (sizes[i] > maxSize) { maxSize = sizes[i]; }
+				if (!(key in keys)) {
+					keys[key] = groups.length;
+					groups.push({color: color || quickD3map_style.symbol.fill, index: []});
+				}
+				groups[keys[key]].index.push(i);
+			}
+			redraw();
+		}
+
+		function draw() {
+			pending = false;
+			var s = projection.scale(), t = projection.translate();
+			context.clearRect(0, 0, width, height);
+			context.beginPath();
+			path(options.basemap);
+			context.fillStyle = quickD3map_style.country.fill;
+			context.strokeStyle = quickD3map_style.country.stroke;
+			context.lineWidth = 1;
+			context.fill();
+			context.stroke();
+			if (options.lines) {
+				context.beginPath();
+				options.lines(context, s, t, path);
+				context.strokeStyle = quickD3map_style.line.stroke;
+				context.lineWidth = quickD3map_style.line.width;
+				context.stroke();
+			}
+			context.globalAlpha = quickD3map_style.symbol.opacity;
+			context.strokeStyle = quickD3map_style.symbol.stroke;
+			context.lineWidth = 1;
+			groups.forEach(function(group) {
+				context.beginPath();
+				for (var k = 0; k < group.index.length; k++) {
+					var i = group.index[k], r = sizes[i],
+					    px = xy.x[i] * s + t[0], py = xy.y[i] * s + t[1];
+					if (!(r > 0) || px + r < 0 || px - r > width || py + r < 0 || py - r > height) { continue; }
+					context.moveTo(px + r, py);
+					context.arc(px, py, r, 0, 2 * Math.PI);
+				}
+				context.fillStyle = group.color;
+				context.fill();
+				context.stroke();
+			});
+			context.globalAlpha = 1;
+		}
+
+		// at most one draw per animation frame
+		function redraw() {
+			if (pending) { return; }
+			pending = true;
+			(window.requestAnimationFrame || function(f) { setTimeout(f, 16); })(draw);
+		}
+
+		canvas.on("mousemove", function() {
+			var m = d3.mouse(this), s = projection.scale(), t = projection.translate(),
+			    i = tree.find((m[0] - t[0]) / s, (m[1] - t[1]) / s, maxSize / s, function(j, d) {
+			        return d <= sizes[j] * sizes[j] / (s * s);
+			    });
+			if (i < 0) { tooltip.style("display", "none"); return; }
+			var properties = layer.feature(i).properties;
+			tooltip.style("display", null)
+			    .style("left", (m[0] + 12) + "px")
+			    .style("top", (m[1] + 12) + "px")
+			    .html(Object.keys(properties).map(function(k) {
+			        return "<b>" + quickD3map_escape(k) + "</b>: " + quickD3map_escape(properties[k]);
+			    }).join("<br>") || "point " + i);
+		});
+		canvas.on("mouseout", function() { tooltip.style("display", "none"); });
+
+		setLayer(options.layer);
+		return {canvas: canvas, redraw: redraw, setLayer: setLayer,
+		        layer: function() { return layer; },
+		        setColumn: function(value) { column = value; restyle(); }};
+	}
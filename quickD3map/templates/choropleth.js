@@ -0,0 +1,53 @@
+	// Choropleth Regions
+	// per-region counts and values joined in Python by quickD3map.regions,
+	// listed in the order of the basemap object's geometries, so feature k
+	// of the object is colored by value k.
+	/////////////////////////////////////////////
+	function quickD3map_choroplethLayer(svg, path, geojson, choropleth) {
+		var features = topojson.feature(geojson, geojson.objects[choropleth.object]).features,
+		    scales = quickD3map_columnScales({value: choropleth.stats}, "value", d3.scale.sqrt(), 0),
+		    legend = d3.select("#map").append("div").attr("class", "quickD3map-legend"),
+		    tooltip = d3.select("#map").style("position", "relative")
+		        .append("div").attr("class", "quickD3map-tooltip").style("display", "none"),
+		    label = choropleth.statistic === "count" ? "count" : choropleth.statistic + " of " + choropleth.column;
+
+		function color(k) {
+			var v = choropleth.values[k];
+			return (v !== null && scales && scales.color(v)) || "#ddd";
+		}
+
+		var regions = svg.append("g").attr("class", "choropleth")
+		    .selectAll(".region")
+		    .data(features)
+		  .enter().append("path")
+		    .attr("class", "region")
+		    .style("fill", function(d, k) { return color(k); })
+		    .on("mousemove", function(d, k) {
+			    var m = d3.mouse(svg.node()), v = choropleth.values[k];
+			    tooltip.style("display", null)
+			        .style("left", (m[0] + 12) + "px")
+			        .style("top", (m[1] + 12) + "px")
+			        .html("<b>id</b>: " + quickD3map_escape(choropleth.ids[k]) +
+			              "<br><b>points</b>: " + choropleth.counts[k] +
+			              (choropleth.statistic === "count" ? "" :
+			               "<br><b>" + quickD3map_escape(label) + "</b>: " +
+			               (v === null ? "-" : d3.format(".4g")(v))));
+		    })
+		    .on("mouseout", function() { tooltip.style("display", "none"); });
+
+		var s = choropleth.stats,
+		    bounds = s.min === null ? [] : [s.min].concat(s.breaks);
+		legend.html(label + ": " + bounds.map(function(b, c) {
+			return '<span class="swatch" style="background:' + scales.color(b) + '"></span>' +
+			       (c ? "&ge; " : "") + quickD3map_escape(d3.format(".3g")(b));
+		}).join(" "));
+
+		// redraw the outlines after the projection changed
+		function update() { regions.attr("d", path); }
+		update();
+		return {update: update};
+	}
+
+	function quickD3map_escape(value) {
+		return String(value).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+	}
@@ -0,0 +1,27 @@
+	// Cluster Pyramid
+	// levels written by quickD3map.clustering, one per zoom scale.
+	// only the level for the current scale is bound to the svg.
+	/////////////////////////////////////////////
+	var quickD3map_column = null;
+
+	function quickD3map_clusterLevel(clusters, scale) {
+		var level = clusters[0];
+		clusters.forEach(function(l) { if (l.scale <= scale) { level = l; } });
+		return level.samples;
+	}
+
+	function quickD3map_clusterRadius(d) {
+		if (quickD3map_column) { return radius(d.properties[quickD3map_column]); }
+		return Math.min(quickD3map_pointSize * Math.sqrt(d.properties.count), 4 * quickD3map_pointSize);
+	}
+
+	function quickD3map_redraw(svg, points, scale) {
+		var level = quickD3map_clusterLevel(clusters, scale);
+		if (level === samples) { return points; }
+		samples = level;
+		var symbols = svg.selectAll(".symbol").data(samples.features);
+		symbols.enter().append("path").attr("class", "symbol");
+		symbols.exit().remove();
+		path.pointRadius(quickD3map_clusterRadius);
+		return svg.selectAll(".symbol");
+	}
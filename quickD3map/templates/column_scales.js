@@ -0,0 +1,28 @@
+	// Column Scales
+	// domains and colorbrewer class breaks precomputed by
+	// quickD3map.column_stats, so switching columns never scans the features.
+	/////////////////////////////////////////////
+	function quickD3map_palette(scheme, k) {
+		var sizes = Object.keys(colorbrewer[scheme]).map(Number),
+		    n = Math.min(Math.max(k, d3.min(sizes)), d3.max(sizes));
+		return colorbrewer[scheme][n].slice(0, k);
+	}
+
+	function quickD3map_columnScales(stats, value, radius, pointSize) {
+		var s = stats && stats[value];
+		if (!s) { return null; }
+		if (s.type === "numeric") {
+			var extent = s.domain ? Math.max(Math.abs(s.domain[0]), Math.abs(s.domain[1])) : 0,
+			    color = d3.scale.threshold()
+			        .domain(s.breaks)
+			        .range(quickD3map_palette(s.scheme, s.breaks.length + 1));
+			radius.domain([0, extent || 1]);
+			return {size:  function(v) { return v === null || v !== v ? 0 : radius(Math.abs(v)); },
+			        color: function(v) { return v === null || v !== v ? null : color(v); }};
+		}
+		var index = {};
+		s.categories.forEach(function(c, i) { index[c] = i; });
+		var colors = quickD3map_palette(s.scheme, s.categories.length);
+		return {size:  function(v) { return pointSize; },
+		        color: function(v) { return v in index ? colors[index[v]] : "#999"; }};
+	}
@@ -0,0 +1,38 @@
+	// Compact Point Decoding
+	// rebuilds a FeatureCollection from the base64 typed arrays
+	// written by quickD3map.encoders.compact_points
+	/////////////////////////////////////////////
+	function quickD3map_unpack(data, type) {
+		var raw = atob(data),
+		    bytes = new Uint8Array(raw.length);
+		for (var i = 0; i < raw.length; i++) { bytes[i] = raw.charCodeAt(i); }
+		if (type === "uint8") { return bytes; }
+		return type === "int32" ? new Int32Array(bytes.buffer) : new Float32Array(bytes.buffer);
+	}
+
+	function quickD3map_undictionary(col) {
+		var codes = quickD3map_unpack(col.data, "int32"),
+		    values = new Array(codes.length);
+		for (var i = 0; i < codes.length; i++) { values[i] = codes[i] < 0 ? null : col.values[codes[i]]; }
+		return values;
+	}
+
+	function quickD3map_decode(packed) {
+		var lon = quickD3map_unpack(packed.lon, "int32"),
+		    lat = quickD3map_unpack(packed.lat, "int32"),
+		    names = Object.keys(packed.properties),
+		    columns = names.map(function(name) {
+		        var col = packed.properties[name];
+		        if (col.type === "dictionary") { return quickD3map_undictionary(col); }
+		        return quickD3map_unpack(col.data, col.type);
+		    }),
+		    features = new Array(packed.n);
+		for (var i = 0; i < packed.n; i++) {
+			var properties = {};
+			for (var j = 0; j < names.length; j++) { properties[names[j]] = columns[j][i]; }
+			features[i] = {type: "Feature",
+			               geometry: {type: "Point", coordinates: [lon[i] / packed.scale, lat[i] / packed.scale]},
+			               properties: properties};
+		}
+		return {type: "FeatureCollection", features: features};
+	}
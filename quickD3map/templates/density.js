@@ -0,0 +1,114 @@
+	// Density Cells
+	// occupied hexagon or square cells written by quickD3map.density, one
+	// level per zoom scale. A level is drawn as one svg path per color
+	// class, in pixels of a world level.scale wide, so a zoom only changes
+	// the transform of the group; hovering looks the cell up by its index.
+	/////////////////////////////////////////////
+	var QUICKD3MAP_SQRT3 = Math.sqrt(3);
+
+	function quickD3map_decodeDensity(packed) {
+		packed.levels.forEach(function(level) {
+			level.i = quickD3map_unpack(level.i, "int32");
+			level.j = quickD3map_unpack(level.j, "int32");
+			level.count = quickD3map_unpack(level.count, "int32");
+			level.value = level.value ? quickD3map_unpack(level.value, "float32") : level.count;
+			level.index = {};
+			for (var k = 0; k < level.n; k++) { level.index[level.i[k] + "," + level.j[k]] = k; }
+		});
+		return packed;
+	}
+
+	function quickD3map_densityLevel(density, scale) {
+		var level = density.levels[0];
+		density.levels.forEach(function(l) { if (l.scale <= scale) { level = l; } });
+		return level;
+	}
+
+	function quickD3map_round(v) { return Math.round(v * 100) / 100; }
+
+	// outline of cell k of a level
+	function quickD3map_cellPath(shape, level, k) {
+		var r = level.size * level.scale, i = level.i[k], j = level.j[k], q = quickD3map_round;
+		if (shape === "square") {
+			return "M" + q(i * r) + "," + q(j * r) + "h" + q(r) + "v" + q(r) + "h" + q(-r) + "Z";
+		}
+		var x = (i + (j & 1) / 2) * r * QUICKD3MAP_SQRT3, y = j * r * 1.5, h = r * QUICKD3MAP_SQRT3 / 2;
+		return "M" + q(x) + "," + q(y - r) + "l" + q(h) + "," + q(r / 2) + "v" + q(r) +
+		       "l" + q(-h) + "," + q(r / 2) + "l" + q(-h) + "," + q(-r / 2) + "v" + q(-r) + "Z";
+	}
+
+	// index of the level's cell at normalized mercator x/y, -1 if empty
+	function quickD3map_cellAt(shape, level, x, y) {
+		var size = level.size, i, j;
+		if (shape === "square") {
+			i = Math.floor(x / size);
+			j = Math.floor(y / size);
+		} else {
+			var dx = size * QUICKD3MAP_SQRT3, dy = size * 1.5, j0 = Math.floor(y / dy), best = Infinity;
+			[j0, j0 + 1].forEach(function(row) {
+				var offset = (row & 1) / 2, col = Math.round(x / dx - offset),
+				    ex = (col + offset) * dx - x, ey = row * dy - y;
+				if (ex * ex + ey * ey < best) { best = ex * ex + ey * ey; i = col; j = row; }
+			});
+		}
+		var k = level.index[i + "," + j];
+		return k === undefined ? -1 : k;
+	}
+
+	function quickD3map_densityLayer(svg, density) {
+		var group = svg.append("g").attr("class", "density"),
+		    legend = d3.select("#map").append("div").attr("class", "quickD3map-legend"),
+		    tooltip = d3.select("#map").style("position", "relative")
+		        .append("div").attr("class", "quickD3map-tooltip").style("display", "none"),
+		    label = density.statistic === "count" ? "count" : density.statistic + " of " + density.column,
+		    level = null, view = [1, 0, 0];
+
+		function draw(next) {
+			level = next;
+			var scales = quickD3map_columnScales({value: level.stats}, "value", d3.scale.sqrt(), 0),
+			    paths = {}, colors = [];
+			for (var k = 0; k < level.n; k++) {
+				var color = (scales && scales.color(level.value[k])) || "#999";
+				if (!(color in paths)) { paths[color] = []; colors.push(color); }
+				paths[color].push(quickD3map_cellPath(density.shape, level, k));
+			}
+			var cells = group.selectAll(".cell").data(colors);
+			cells.enter().append("path").attr("class", "cell");
+			cells.exit().remove();
+			cells.attr("d", function(c) { return paths[c].join(""); }).style("fill", String);
+
+			var bounds = level.stats.min === null ? [] : [level.stats.min].concat(level.stats.breaks);
+			legend.html(label + ": " + bounds.map(function(b, c) {
+				return '<span class="swatch" style="background:' + scales.color(b) + '"></span>' +
+				       (c ? "&ge; " : "") + quickD3map_escape(d3.format(".3g")(b));
+			}).join(" "));
+		}
+
+		svg.on("mousemove", function() {
+			var m = d3.mouse(this),
+			    k = quickD3map_cellAt(density.shape, level, (m[0] - view[1]) / view[0] + 0.5,
+			                                              (m[1] - view[2]) / view[0] + 0.5);
+			if (k < 0) { tooltip.style("display", "none"); return; }
+			tooltip.style("display", null)
+			    .style("left", (m[0] + 12) + "px")
+			    .style("top", (m[1] + 12) + "px")
+			    .html("<b>points</b>: " + level.count[k] +
+			          (density.statistic === "count" ? "" :
+			           "<br><b>" + quickD3map_escape(label) + "</b>: " + d3.format(".4g")(level.value[k])));
+		});
+		svg.on("mouseout", function() { tooltip.style("display", "none"); });
+
+		// scale and translate of the zoom: a world `scale` pixels wide
+		function update(scale, translate) {
+			var next = quickD3map_densityLevel(density, scale);
+			if (next !== level) { draw(next); }
+			view = [scale, translate[0], translate[1]];
+			group.attr("transform", "translate(" + (translate[0] - scale / 2) + "," + (translate[1] - scale / 2) + ")" +
+			                        "scale(" + scale / level.scale + ")");
+		}
+		return {update: update};
+	}
+
+	function quickD3map_escape(value) {
+		return String(value).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+	}
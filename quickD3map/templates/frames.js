@@ -0,0 +1,69 @@
+	// Time Frames
+	// station geometry is decoded once; every frame of every column is
+	// rebuilt from the na/changed masks written by quickD3map.frames into
+	// one typed array, so moving the slider only copies values.
+	/////////////////////////////////////////////
+	function quickD3map_bit(bytes, rowBytes, f, s) {
+		return bytes[f * rowBytes + (s >> 3)] & (128 >> (s & 7));
+	}
+
+	function quickD3map_decodeFrames(packed) {
+		var n = packed.n, nFrames = packed.times.length, rowBytes = Math.ceil(n / 8),
+		    lon = quickD3map_unpack(packed.lon, "int32"),
+		    lat = quickD3map_unpack(packed.lat, "int32"),
+		    names = Object.keys(packed.properties), columns = {}, features = new Array(n);
+		names.forEach(function(name) {
+			var col = packed.properties[name],
+			    na = quickD3map_unpack(col.na, "uint8"),
+			    changed = quickD3map_unpack(col.changed, "uint8"),
+			    data = quickD3map_unpack(col.data, col.type === "float32" ? "float32" : "int32"),
+			    values = new Float32Array(nFrames * n), current = new Float32Array(n), k = 0;
+			for (var f = 0; f < nFrames; f++) {
+				for (var s = 0; s < n; s++) {
+					if (quickD3map_bit(changed, rowBytes, f, s)) { current[s] = data[k++]; }
+					values[f * n + s] = quickD3map_bit(na, rowBytes, f, s) ? NaN : current[s];
+				}
+			}
+			columns[name] = {values: values, labels: col.type === "dictionary" ? col.values : null};
+		});
+		for (var i = 0; i < n; i++) {
+			features[i] = {type: "Feature", properties: {},
+			               geometry: {type: "Point", coordinates: [lon[i] / packed.scale, lat[i] / packed.scale]}};
+		}
+		return {n: n, times: packed.times, columns: columns,
+		        samples: {type: "FeatureCollection", features: features}};
+	}
+
+	// copy frame f into the feature properties; NA values become null
+	function quickD3map_showFrame(frames, f) {
+		var features = frames.samples.features, n = frames.n;
+		Object.keys(frames.columns).forEach(function(name) {
+			var col = frames.columns[name], values = col.values.subarray(f * n, (f + 1) * n);
+			for (var i = 0; i < n; i++) {
+				var v = values[i];
+				features[i].properties[name] = v !== v ? null : col.labels ? col.labels[v] : v;
+			}
+		});
+	}
+
+	// slider and play button from layout.html; update() redraws the points
+	function quickD3map_timeControls(frames, update) {
+		var slider = d3.select("#quickD3map-time").attr("max", frames.times.length - 1),
+		    label = d3.select("#quickD3map-time-label"),
+		    timer = null;
+		function show(f) {
+			slider.property("value", f);
+			label.text(frames.times[f]);
+			quickD3map_showFrame(frames, f);
+			update();
+		}
+		slider.on("input", function() { show(+this.value); });
+		d3.select("#quickD3map-play").on("click", function() {
+			if (timer) { clearInterval(timer); timer = null; this.textContent = "play"; return; }
+			this.textContent = "pause";
+			timer = setInterval(function() {
+				show((+slider.property("value") + 1) % frames.times.length);
+			}, 200);
+		});
+		show(0);
+	}
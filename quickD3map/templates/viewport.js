@@ -0,0 +1,22 @@
+	// Viewport Data
+	// points are requested from the server for the visible bounding box
+	// whenever the map settles after a pan or zoom.
+	/////////////////////////////////////////////
+	var quickD3map_pending = null;
+
+	function quickD3map_fetchViewport(svg, scale) {
+		if (quickD3map_pending) { clearTimeout(quickD3map_pending); }
+		quickD3map_pending = setTimeout(function() {
+			var nw = projection.invert([0, 0]),
+			    se = projection.invert([width, height]),
+			    url = "{{ viewport_url }}?bbox=" + [nw[0], se[1], se[0], nw[1]].join(",") + "&zoom=" + scale;
+			d3.json(url, function(error, data) {
+				if (error) { return; }
+				samples = data;
+				var symbols = svg.selectAll(".symbol").data(samples.features);
+				symbols.enter().append("path").attr("class", "symbol");
+				symbols.exit().remove();
+				points = svg.selectAll(".symbol").attr("d", path);
+			});
+		}, 150);
+	}
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Level-of-detail variants of the bundled TopoJSON basemaps.
+
+Arcs are simplified with Visvalingam's effective-area algorithm and then
+re-quantized to a coarser grid. Because TopoJSON objects only reference
+arcs by index, simplifying the shared arcs keeps neighbouring countries
+seamless and leaves the objects untouched.
+
+Variants are made for a fixed ladder of resolutions, given as the width in
+pixels of the whole basemap on screen, and cached in memory and on disk.
+Basemaps can also be clipped to the geometries near the data, with the
+extent rounded out to a coarse grid so nearby extents share one result.
+"""
+
+from __future__ import (absolute_import, division, print_function )
+
+import os
+import json
+import heapq
+import hashlib
+import threading
+
+import numpy as np
+
+
+## Global Variables
+#####################################################
+LOD_LEVELS = [512, 1024, 2048, 4096, 8192, 16384]  # basemap width in pixels
+AREA_PIXELS = 0.5           # triangles smaller than this (in px^2) are dropped
+QUANTUM_PIXELS = 0.25       # grid step of the re-quantized arcs, in px
+HASH_LENGTH = 12
+CLIP_MARGIN = 5.            # degrees added around the data extent
+CLIP_BUCKET = 10.           # clip extents are rounded out to this grid, in degrees
+
+_lock = threading.Lock()
+_variants = {}   # (digest, variant tag) -> TopoJSON text
+
+
+## Arc Coding
+#####################################################
+def decode_arcs(arcs):
+    '''
+    Undo the delta encoding of quantized TopoJSON arcs.
+
+    Returns x, y, offsets where the absolute (quantized) vertices of arc i
+    are x[offsets[i]:offsets[i + 1]].
+    '''
+    lengths = np.array([len(arc) for arc in arcs], dtype='int64')
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    flat = np.array([pt[:2] for arc in arcs for pt in arc], dtype='int64').reshape(-1, 2)
+    total = np.cumsum(flat, axis=0)
+    # subtract the running total reached before each arc starts
+    before = np.concatenate([[[0, 0]], total[offsets[1:-1] - 1]])
+    total -= np.repeat(before, lengths, axis=0)
+    return total[:, 0], total[:, 1], offsets
+
+def encode_arcs(x, y, offsets):
+    ''' Delta encode absolute quantized vertices back into TopoJSON arcs '''
+    dx, dy = np.diff(x, prepend=0), np.diff(y, prepend=0)
+    dx[offsets[:-1]], dy[offsets[:-1]] = x[offsets[:-1]], y[offsets[:-1]]
+    deltas = np.column_stack([dx, dy]).tolist()
+    return [deltas[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+## Visvalingam
+#####################################################
+def _area(x, y, a, b, c):
+    return abs((x[b] - x[a]) * (y[c] - y[a]) - (x[c] - x[a]) * (y[b] - y[a])) / 2.
+
+def visvalingam_weights(x, y, offsets):
+    '''
+    Effective area of every vertex: the area of the triangle it forms with
+    its neighbours at the moment it would be removed, never smaller than
+    any area removed before it on the same arc. Arc endpoints get inf, so
+    filtering on weight >= tolerance keeps every arc connected.
+    '''
+    x, y = x.astype('float64').tolist(), y.astype('float64').tolist()
+    weights = [np.inf] * len(x)
+    prev = list(range(-1, len(x) - 1))
+    nxt = list(range(1, len(x) + 1))
+    for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+        heap = [(_area(x, y, i - 1, i, i + 1), i) for i in range(start + 1, stop - 1)]
+        heapq.heapify(heap)
+        current = dict((i, area) for area, i in heap)
+        largest = 0.
+        while heap:
+            area, i = heapq.heappop(heap)
+            if current.get(i) != area:
+                continue                     # stale entry
+            del current[i]
+            largest = max(largest, area)
+            weights[i] = largest
+            p, n = prev[i], nxt[i]
+            nxt[p], prev[n] = n, p
+            for j in (p, n):
+                if j in current:
+                    current[j] = _area(x, y, prev[j], j, nxt[j])
+                    heapq.heappush(heap, (current[j], j))
+    return np.array(weights)
+
+def simplify_topology(topology, min_area, factor=1):
+    '''
+    Return a simplified copy of a quantized TopoJSON topology.
+
+    Parameters
+    ----------
+    topology: dict, required
+        parsed TopoJSON with a transform.
+    min_area: float, required
+        Visvalingam tolerance in square degrees.
+    factor: int, default 1
+        the quantization grid is made `factor` times coarser.
+    '''
+    sx, sy = topology['transform']['scale']
+    x, y, offsets = decode_arcs(topology['arcs'])
+    keep = visvalingam_weights(x, y, offsets) >= min_area / (sx * sy)
+    arc_of = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    x, y, arc_of = x[keep], y[keep], arc_of[keep]
+
+    if factor > 1:
+        x, y = np.round(x / factor).astype('int64'), np.round(y / factor).astype('int64')
+        # drop vertices repeating their predecessor, except arc ends
+        last = np.r_[arc_of[1:] != arc_of[:-1], True]
+        repeat = np.r_[False, (x[1:] == x[:-1]) & (y[1:] == y[:-1]) & (arc_of[1:] == arc_of[:-1])]
+        keep = ~repeat | last
+        x, y, arc_of = x[keep], y[keep], arc_of[keep]
+
+    offsets = np.searchsorted(arc_of, np.arange(len(offsets)))
+    simplified = dict(topology)
+    simplified['transform'] = {'scale': [sx * factor, sy * factor],
+                               'translate': topology['transform']['translate']}
+    simplified['arcs'] = encode_arcs(x, y, offsets)
+    return simplified
+
+def level_tolerance(topology, level):
+    ''' Return (min_area, factor) for a basemap drawn `level` pixels wide '''
+    degrees = 360. / level                         # degrees per pixel
+    sx = topology['transform']['scale'][0]
+    factor = max(1, int(degrees * QUANTUM_PIXELS / sx))
+    return AREA_PIXELS * degrees ** 2, factor
+
+
+## Variant Selection and Caching
+#####################################################
+def choose_level(width, height, zoom_range=1):
+    '''
+    Return the smallest LOD level at least max(width, height) * zoom_range
+    pixels wide, or None when only the bundled file is detailed enough.
+    '''
+    needed = max(width, height) * zoom_range
+    for level in LOD_LEVELS:
+        if level >= needed:
+            return level
+    return None
+
+def default_cache_dir():
+    ''' $QUICKD3MAP_CACHE or ~/.cache/quickD3map '''
+    return os.environ.get('QUICKD3MAP_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'quickD3map'))
+
+def _cached_variant(filename, source, tag, make, cache_dir):
+    ''' Return make(topology) as TopoJSON text, cached under a hash of source and tag '''
+    digest = hashlib.sha1(source).hexdigest()[:HASH_LENGTH]
+    with _lock:
+        if (digest, tag) in _variants:
+            return _variants[(digest, tag)]
+    cache_dir = cache_dir or default_cache_dir()
+    root = os.path.splitext(os.path.basename(filename))[0]
+    path = os.path.join(cache_dir, '{}.{}.{}.json'.format(root, tag, digest))
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            text = f.read().decode('utf-8')
+    else:
+        text = json.dumps(make(json.loads(source.decode('utf-8'))), separators=(',', ':'))
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp, 'wb') as f:
+                f.write(text.encode('utf-8'))
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            pass   # an unwritable cache only costs a recomputation
+    with _lock:
+        _variants[(digest, tag)] = text
+    return text
+
+def simplified_basemap(filename, source, level, cache_dir=None):
+    '''
+    Return the TopoJSON text of the `level` variant of a basemap.
+
+    Parameters
+    ----------
+    filename: str, required
+        basemap file name, used to name the cached variant.
+    source: bytes, required
+        content of the bundled TopoJSON file.
+    level: int, required
+        one of LOD_LEVELS.
+    cache_dir: str, default None
+        where variants are stored; default_cache_dir() when None. Cached
+        files are named after a hash of the source, so an updated basemap
+        never reuses a stale variant.
+    '''
+    if level not in LOD_LEVELS:
+        raise ValueError("Basemap level must be one of the following:{}".format(LOD_LEVELS))
+    def make(topology):
+        min_area, factor = level_tolerance(topology, level)
+        return simplify_topology(topology, min_area, factor)
+    return _cached_variant(filename, source, 'lod{}'.format(level), make, cache_dir)
+
+
+## Clipping
+#####################################################
+def _lon_range(lon):
+    ''' Narrowest west/east range holding every longitude; west > east crosses 180 '''
+    west, east = lon.min(), lon.max()
+    shifted = np.mod(lon, 360.)
+    if shifted.max() - shifted.min() < east - west:
+        west, east = shifted.min(), shifted.max()
+        west, east = (west + 180.) % 360. - 180., (east + 180.) % 360. - 180.
+    return west, east
+
+def data_bounds(lon, lat, margin=CLIP_MARGIN):
+    '''
+    Return the (west, south, east, north) extent of the non-NA points plus
+    `margin` degrees. A box crossing the antimeridian has west > east; an
+    extent wider than the world is (-180, south, 180, north). Returns None
+    when there are no points.
+    '''
+    lon, lat = np.asarray(lon, dtype='float64'), np.asarray(lat, dtype='float64')
+    valid = ~(np.isnan(lon) | np.isnan(lat))
+    if not valid.any():
+        return None
+    lon, lat = lon[valid], lat[valid]
+    west, east = _lon_range(lon)
+    south, north = float(max(lat.min() - margin, -90.)), float(min(lat.max() + margin, 90.))
+    width = (east - west) % 360.
+    if width + 2 * margin >= 360.:
+        return (-180., south, 180., north)
+    west, east = west - margin, east + margin
+    if west < -180.:
+        west += 360.
+    if east > 180.:
+        east -= 360.
+    return (float(west), float(south), float(east), float(north))
+
+def bucket_bounds(bounds, size=CLIP_BUCKET):
+    ''' Round an extent outwards to multiples of `size` degrees '''
+    west, south, east, north = bounds
+    crosses = west > east
+    south = float(max(np.floor(south / size) * size, -90.))
+    north = float(min(np.ceil(north / size) * size, 90.))
+    west, east = float(np.floor(west / size) * size), float(np.ceil(east / size) * size)
+    if crosses and west <= east:
+        # the rounded box closed the gap around the antimeridian
+        west, east = -180., 180.
+    return (west, south, east, north)
+
+def _arc_refs(arcs):
+    ''' Flatten a (nested) TopoJSON arcs member into a list of arc indexes '''
+    if isinstance(arcs, int):
+        return [arcs if arcs >= 0 else ~arcs]
+    return [ref for part in arcs for ref in _arc_refs(part)]
+
+def _renumber(arcs, index):
+    if isinstance(arcs, int):
+        return int(index[arcs]) if arcs >= 0 else ~int(index[~arcs])
+    return [_renumber(part, index) for part in arcs]
+
+def clip_topology(topology, bounds):
+    '''
+    Keep the geometries of a TopoJSON topology whose bounding box
+    intersects `bounds` = (west, south, east, north), and only the arcs they
+    use. Geometries are kept whole, not cut, so kept shapes stay closed.
+    GeometryCollection objects are filtered member by member and
+    MultiPolygon / MultiLineString objects part by part.
+    '''
+    west, south, east, north = bounds
+    x, y, offsets = decode_arcs(topology['arcs'])
+    (sx, sy), (tx, ty) = topology['transform']['scale'], topology['transform']['translate']
+    starts = offsets[:-1]
+    arc_west = np.minimum.reduceat(x, starts) * sx + tx
+    arc_east = np.maximum.reduceat(x, starts) * sx + tx
+    arc_south = np.minimum.reduceat(y, starts) * sy + ty
+    arc_north = np.maximum.reduceat(y, starts) * sy + ty
+
+    def intersects(arcs):
+        refs = _arc_refs(arcs)
+        if not refs:
+            return False
+        w, e = arc_west[refs].min(), arc_east[refs].max()
+        s, n = arc_south[refs].min(), arc_north[refs].max()
+        if s > north or n < south:
+            return False
+        if west <= east:
+            return w <= east and e >= west
+        return e >= west or w <= east
+
+    objects = {}
+    for name, geometry in topology['objects'].items():
+        kind = geometry.get('type')
+        if kind == 'GeometryCollection':
+            members = [g for g in geometry['geometries'] if 'arcs' in g and intersects(g['arcs'])]
+            geometry = dict(geometry, geometries=members)
+        elif kind in ('MultiPolygon', 'MultiLineString'):
+            geometry = dict(geometry, arcs=[part for part in geometry['arcs'] if intersects(part)])
+        elif 'arcs' in geometry and not intersects(geometry['arcs']):
+            geometry = {'type': None}
+        geometry.pop('bbox', None)
+        objects[name] = geometry
+
+    def arcs_of(geometry):
+        if geometry.get('type') == 'GeometryCollection':
+            return [arcs_of(g) for g in geometry['geometries']]
+        return geometry.get('arcs', [])
+
+    def renumbered(geometry):
+        if geometry.get('type') == 'GeometryCollection':
+            return dict(geometry, geometries=[renumbered(g) for g in geometry['geometries']])
+        if 'arcs' in geometry:
+            return dict(geometry, arcs=_renumber(geometry['arcs'], index))
+        return geometry
+
+    used = np.unique(np.array(_arc_refs([arcs_of(g) for g in objects.values()]), dtype='int64'))
+    index = np.zeros(len(starts), dtype='int64')
+    index[used] = np.arange(len(used))
+    lengths = np.diff(offsets)
+    keep = np.isin(np.repeat(np.arange(len(starts)), lengths), used)
+
+    clipped = dict(topology)
+    clipped.pop('bbox', None)
+    clipped['objects'] = dict((name, renumbered(g)) for name, g in objects.items())
+    clipped['arcs'] = encode_arcs(x[keep], y[keep], np.concatenate([[0], np.cumsum(lengths[used])]))
+    return clipped
+
+def clipped_basemap(filename, source, bounds, cache_dir=None):
+    '''
+    Return the TopoJSON text of a basemap clipped to `bounds`.
+
+    `bounds` is rounded out with bucket_bounds first, so maps of nearby
+    data share one cached clip. `source` may itself be a simplified variant.
+    '''
+    bounds = bucket_bounds(bounds)
+    tag = 'clip{:g}_{:g}_{:g}_{:g}'.format(*bounds)
+    return _cached_variant(filename, source, tag, lambda topology: clip_topology(topology, bounds),
+                           cache_dir)
@@ -25,7 +25,40 @@ map_templates = {'us_states':
                  'world_map_zoom': 
                         {'json': 'world-50m.json',
                          'template': 'world_map_Line.html'}}
-        
+
+#templates with a d3 zoom handler; clustering and viewport loading need one
+zoom_templates = ['world_map.html', 'world_map_Line.html']
+
+#ways of embedding point data in the page
+encodings = ['geojson', 'compact']
+
+#svg draws one path per feature; canvas batch draws them on a <canvas>.
+#canvas variants of the page templates, for renderer="canvas"
+renderers = ['svg', 'canvas']
+canvas_templates = {'world_map.html':      'world_map_canvas.html',
+                    'world_map_Line.html': 'world_map_Line_canvas.html'}
+
+#page templates with the time slider for PointMap(time_column=...)
+time_templates = ['world_map.html', 'us_map.html', 'world_map_canvas.html']
+
+#page template of DensityMap for each zoomable world template
+density_templates = {'world_map.html':      'density_map.html',
+                     'world_map_Line.html': 'density_map.html'}
+
+#TopoJSON object holding the regions ChoroplethMap joins points to, per map
+choropleth_objects = {'us_states':      'states',
+                      'world_map':      'countries',
+                      'world_map_50m':  'countries',
+                      'world_map_zoom': 'countries'}
+
+#JS Libraries and CSS Styling. template variable name: file in templates/
+static_assets = {'d3js':            'd3.v3.min.js',
+                 'd3_projection':   'd3.geo.projection.v0.min.js',
+                 'topojson':        'topojson.v1.min.js',
+                 'style':           'style.css',
+                 'colorbrewer_css': 'colorbrewer.css',
+                 'colorbrewer_js':  'colorbrewer.js'}
+
 projections = [ 'airy', 'aitoff', 'albers', 'albersUsa', 'armadillo', 'august', 'azimuthalEqualArea',
  'azimuthalEquidistant', 'baker', 'berghaus', 'boggs', 'bonne', 'bromley', 'chamberlin', 'collignon',
  'conicEqualArea', 'conicConformal', 'conicEquidistant', 'equirectangular', 'craig', 'craster',
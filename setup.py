@@ -32,6 +32,9 @@ setup(
     include_package_data=True,
     install_requires=[
     ],
+    entry_points={
+        'console_scripts': ['quickd3map = quickD3map.cli:main'],
+    },
     license="BSD",
     zip_safe=False,
     keywords='quickD3map',
@@ -8,16 +8,41 @@ test_quickD3map
 Tests for `quickD3map` module.
 """
 
+import io
+import os
+import gc
+import json
+import base64
+import gzip
+import shutil
+import tempfile
+import subprocess
+import sys
 import nose.tools as nt
 from nose.tools import raises
 import pandas as pd
 import numpy as np
 from itertools import combinations
 import geojson
-from quickD3map import PointMap, LineMap
+from geojson import Feature, FeatureCollection, Point, LineString
+from quickD3map import PointMap, LineMap, DensityMap, ChoroplethMap, assets, render_many
 
 from quickD3map.utilities import latitude, longitude, projections
 from quickD3map.check_data import check_column, check_center, check_for_NA
+from quickD3map.check_data import validate_points, validate_linemap, verify_dfs_forLineMap
+from quickD3map.encoders import points_to_geojson, encode_coordinates
+from quickD3map.clustering import cluster_pyramid
+from quickD3map.spatial import GridIndex
+from quickD3map.geometry import great_circle_arcs, split_antimeridian
+from quickD3map.server import MapServer
+from quickD3map.edges import edge_frame
+from quickD3map.topology import decode_arcs, simplify_topology, choose_level
+from quickD3map.topology import data_bounds, bucket_bounds, clip_topology
+from quickD3map import cli
+from quickD3map.column_stats import ColumnStats, column_stats
+from quickD3map.frames import time_frames
+from quickD3map.density import DensityGrid, hex_cells
+from quickD3map.regions import RegionIndex, region_edges, region_index
 
 
 #To add: 
@@ -45,6 +70,27 @@ def test_for_NAs1():
     print(df)
     check_for_NA(df, "Latitude","Longitude")
         
+def test_for_NAs2():
+    df = pd.DataFrame( np.random.randn(4,2), columns=["Latitude","Longitude"])
+    df.loc[3,'Latitude'] = np.nan
+    report = validate_points(df, "Latitude","Longitude")
+    nt.assert_equal( report.na_rows, {"Latitude": 1, "Longitude": 0} )
+    nt.assert_false( report.ok )
+
+def test_validate_linemap_report():
+    df = pd.DataFrame( {"city": ["a", "b", "b"], "lat": [1.0, 2.0, 3.0], "lon": [1.0, 2.0, 3.0]})
+    distance_df = pd.DataFrame( [["a", "x", "w"], ["y", "b", "w"]] )
+    report = validate_linemap(df, "city", distance_df)
+    nt.assert_equal( report.duplicate_ids, 1 )
+    nt.assert_equal( sorted(report.missing_ids), ["x", "y"] )
+    nt.assert_equal( list(report.bad_dtypes.keys()), [2] )
+    nt.assert_equal( len(report.errors()), 3 )
+
+@raises(ValueError)
+def test_verify_dfs_forLineMap():
+    df = pd.DataFrame( {"city": ["a", "b"], "lat": [1.0, 2.0], "lon": [1.0, 2.0]})
+    verify_dfs_forLineMap(df, "city", pd.DataFrame( [["a", "c", 1]] ))
+        
 class testcheck_center():
     nt.assert_equals((100,0), check_center( (100,0)) )
     nt.assert_equals([100,0], check_center( [100,0] ) )
@@ -73,10 +119,664 @@ class testcheck_center():
 #    #but the typed answer has only two digits. SHould I add rounding/decimal to the progrma
 #    # or use a different test
 
+def test_points_to_geojson_matches_geojson():
+    df = pd.DataFrame( {"Latitude": [82.85, np.nan, -83.03], "Longitude": [41.68, 41.62, -41.123456789],
+                        "Elev": [1, 2, 3], "Name": ["a", "b", 'c"d']})
+    expected = [ Feature(geometry=Point((41.68, 82.85)), properties={"Elev": 1, "Name": "a"}),
+                 Feature(geometry=Point((-41.123456789, -83.03)), properties={"Elev": 3, "Name": 'c"d'}) ]
+    out = points_to_geojson(df, "Latitude", "Longitude", columns=["Name", "Elev"])
+    nt.assert_equal( geojson.dumps(FeatureCollection(expected)), out)
+
+def test_encode_coordinates_rounds_like_rows():
+    # the original PointMap built a geojson.Point from every iterrows() row
+    df = pd.DataFrame( {"lat": [2.0000005, 0.0000005, 45.1234565], "lon": [-63.3485105, 17.5728605, 151.2093125]})
+    expected = FeatureCollection([Feature(geometry=Point((row["lon"], row["lat"])))
+                                  for _, row in df.iterrows()])
+    nt.assert_equal( points_to_geojson(df, "lat", "lon"), geojson.dumps(expected) )
+    nt.assert_equal( encode_coordinates([-63.3485105, 2.0000005]), ['-63.34851', '2.0'] )
+
+def test_PointMap_convert_to_geojson():
+    df = pd.read_csv('../examples/data/weatherstations.csv')
+    pm = PointMap(df, columns = ['ELEV'])
+    pm.convert_to_geojson()
+    features = geojson.loads(pm.template_vars['geojson'])['features']
+    nt.assert_equal( len(features), len(df) )
+    nt.assert_equal( set(features[0]['properties'].keys()), set(['ELEV']) )
+
+def test_LineMap_convert_to_geojson():
+    df = pd.DataFrame( {"city": ["a", "b", "c"], "lat": [10.5, 20.25, -30.0], "lon": [1.0, -2.5, 3.75]})
+    distance_df = pd.DataFrame( [["a", "b", 1], ["c", "a", 2]] )
+    lm = LineMap(df, "city", distance_df)
+    lm.convert_to_geojson()
+    expected = [ Feature(geometry=LineString([(1.0, 10.5), (-2.5, 20.25)])),
+                 Feature(geometry=LineString([(3.75, -30.0), (1.0, 10.5)])) ]
+    nt.assert_equal( geojson.dumps(FeatureCollection(expected)), lm.template_vars['lines_geojson'])
+
+def test_compact_points_roundtrip():
+    df = pd.DataFrame( {"lat": [82.85, np.nan, -83.03], "lon": [41.68, 41.62, -41.123456789],
+                        "Elev": [1.5, 2, np.nan], "Name": ["a", "b", "c"]})
+    pm = PointMap(df, columns=["Elev", "Name"], encoding="compact", precision=4)
+    pm.convert_to_geojson()
+    packed = json.loads(pm.template_vars['compact_points'])
+    lon = np.frombuffer(base64.b64decode(packed['lon']), dtype='<i4') / packed['scale']
+    elev = np.frombuffer(base64.b64decode(packed['properties']['Elev']['data']), dtype='<f4')
+    nt.assert_equal( packed['n'], 2 )
+    nt.assert_equal( list(lon), [41.68, -41.1235] )
+    nt.assert_equal( elev[0], 1.5 )
+    nt.assert_true( np.isnan(elev[1]) )
+    name = packed['properties']['Name']
+    codes = np.frombuffer(base64.b64decode(name['data']), dtype='<i4')
+    nt.assert_equal( [name['values'][c] for c in codes], ["a", "c"] )
+
+def test_cluster_pyramid():
+    lon = np.array([10.0, 10.001, 10.002, -120.0])
+    lat = np.array([50.0, 50.001, 50.002, 35.0])
+    elev = np.array([1.0, 2.0, np.nan, 4.0])
+    levels = cluster_pyramid(lon, lat, [("ELEV", elev)])
+    props = dict(levels[0]['properties'])
+    nt.assert_equal( sorted(props['count']), [1, 3] )
+    nt.assert_equal( sorted(props['ELEV_sum']), [3.0, 4.0] )
+    nt.assert_equal( sorted(props['ELEV']), [1.5, 4.0] )
+    nt.assert_almost_equal( sorted(levels[0]['lon'])[1], 10.001 )
+
+def test_PointMap_cluster_levels():
+    df = pd.read_csv('../examples/data/weatherstations.csv')
+    pm = PointMap(df, columns = ['ELEV'], cluster=True)
+    pm.convert_to_geojson()
+    levels = json.loads(pm.template_vars['clusters'])
+    counts = [ sum(f['properties']['count'] for f in l['samples']['features']) for l in levels ]
+    nt.assert_equal( counts, [len(df)] * len(levels) )
+    nt.assert_true( len(levels[0]['samples']['features']) < len(df) )
+
+def test_great_circle_arcs_split():
+    lon, lat, offsets = great_circle_arcs([170.0, 0.0], [10.0, 0.0], [-170.0, 10.0], [20.0, 0.0])
+    nt.assert_equal( list(offsets), [0, 12, 18] )
+    lon, lat, parts, arcs = split_antimeridian(lon, lat, offsets)
+    nt.assert_equal( list(arcs), [0, 2, 3] )
+    nt.assert_equal( list(parts), [0, 7, 14, 20] )
+    nt.assert_equal( (lon[6], lon[7]), (180.0, -180.0) )
+    nt.assert_equal( lat[6], lat[7] )
+
+def test_LineMap_arcs():
+    df = pd.DataFrame( {"city": ["a", "b"], "lat": [40.7, 35.7], "lon": [-74.0, 139.7]})
+    lm = LineMap(df, "city", pd.DataFrame( [["a", "b", 1]] ), arcs=True)
+    lm.convert_to_geojson()
+    packed = json.loads(lm.template_vars['packed_arcs'])
+    lat = np.frombuffer(base64.b64decode(packed['lat']), dtype='<i4') / packed['scale']
+    nt.assert_true( lat.max() > 69 )
+    nt.assert_equal( lm.template_vars['lines_geojson'], None )
+
+def test_edge_frame_pruning():
+    labels = np.array(["a", "b", "c"])
+    matrix = np.array([[0, 5, 1], [5, 0, 3], [1, 3, 0]], dtype=float)
+    edges = edge_frame(matrix, labels, dedupe=True)
+    nt.assert_equal( edges.values.tolist(), [["a", "b", 5.0], ["a", "c", 1.0], ["b", "c", 3.0]] )
+    edges = edge_frame(matrix, labels, top_k=1, dedupe=True)
+    nt.assert_equal( edges.values.tolist(), [["a", "b", 5.0], ["c", "b", 3.0]] )
+    edges = edge_frame(pd.DataFrame(matrix, index=labels, columns=labels), None, min_weight=2)
+    nt.assert_equal( len(edges), 4 )
+
+@raises(ValueError)
+def test_edge_frame_missing_endpoint():
+    edge_frame(pd.DataFrame( [["a", "b", 1], [None, "c", 2], ["b", np.nan, 3]]), ["a", "b", "c"], min_weight=0)
+
+def test_edge_frame_range_index_matrix():
+    labels = np.array(["a", "b", "c"])
+    matrix = np.array([[0, 5, 0], [5, 0, 3], [0, 3, 0]], dtype=float)
+    expected = edge_frame(matrix, labels).values.tolist()
+    nt.assert_equal( expected, [["a", "b", 5.0], ["b", "a", 5.0], ["b", "c", 3.0], ["c", "b", 3.0]] )
+    nt.assert_equal( edge_frame(pd.DataFrame(matrix), labels).values.tolist(), expected )
+    # a three row long table with the default index stays a long table
+    long_table = pd.DataFrame( [["a", "b", 1], ["a", "c", 2], ["b", "c", 3]])
+    nt.assert_true( edge_frame(long_table, labels) is long_table )
+
+def test_LineMap_matrix_input():
+    df = pd.DataFrame( {"city": ["a", "b", "c"], "lat": [40.7, 35.7, 51.5], "lon": [-74.0, 139.7, 0.1]})
+    matrix = np.array([[0, 5, 1], [5, 0, 3], [1, 3, 0]])
+    lm = LineMap(df, "city", matrix, min_weight=2, dedupe=True)
+    nt.assert_equal( len(lm.distdf), 2 )
+    lm.convert_to_geojson()
+    nt.assert_equal( len(geojson.loads(lm.template_vars['lines_geojson'])['features']), 2 )
+
+@raises(ValueError)
+def test_LineMap_matrix_shape():
+    df = pd.DataFrame( {"city": ["a", "b"], "lat": [40.7, 35.7], "lon": [-74.0, 139.7]})
+    LineMap(df, "city", np.zeros((3, 3)))
+
 ## Test That Check BaseMap Object Funcitonality
 #######################################################
     
 
+def test_shared_asset_cache():
+    assets.clear_cache()
+    df = pd.DataFrame( {"lat": [1.0], "lon": [2.0]})
+    p1, p2 = PointMap(df), PointMap(df)
+    nt.assert_is(p1.env, p2.env)
+    nt.assert_is(p1.template_vars['d3js'], p2.template_vars['d3js'])
+    info = assets.cache_info()
+    nt.assert_equal( info['assets']['d3.v3.min.js']['hits'], 2 )
+    assets.clear_cache()
+    nt.assert_equal( assets.cache_info(), {'environment': False, 'assets': {}} )
+    
+
+def test_basemap_loaded_raw():
+    df = pd.DataFrame( {"lat": [1.0], "lon": [2.0]})
+    p = PointMap(df, map="world_map_50m")
+    p.build_map()
+    nt.assert_is( p.template_vars['map_data'], assets.load_basemap("world_map_zoom") )
+    nt.assert_true( p.template_vars['map_data'].startswith('{"type":"Topology"') )
+
+def test_simplify_topology_keeps_arc_ends():
+    topology = json.loads(assets.load_basemap('world_map'))
+    simplified = simplify_topology(topology, 0.5, factor=10)
+    nt.assert_equal( simplified['objects'], topology['objects'] )
+    x0, y0, offsets0 = decode_arcs(topology['arcs'])
+    x1, y1, offsets1 = decode_arcs(simplified['arcs'])
+    nt.assert_equal( len(offsets1), len(offsets0) )
+    nt.assert_true( len(x1) < len(x0) / 2 )
+    nt.assert_equal( list(x1[offsets1[:-1]]), list(np.round(x0[offsets0[:-1]] / 10.)) )
+
+def test_basemap_lod_auto():
+    nt.assert_equal( choose_level(300, 200), 512 )
+    nt.assert_equal( choose_level(960, 500, 32), None )
+    cache_dir = tempfile.mkdtemp()
+    try:
+        df = pd.DataFrame( {"lat": [40.7, 35.7], "lon": [-74.0, 139.7]})
+        pm = PointMap(df, map="world_map_zoom", width=300, height=200, lod="auto", max_zoom=1,
+                      cache_dir=cache_dir)
+        nt.assert_equal( pm.basemap_level(), 512 )
+        pm.build_map()
+        nt.assert_true( len(pm.template_vars['map_data']) < len(assets.load_basemap('world_map_zoom')) / 4 )
+        nt.assert_true( any(name.startswith('world-50m.lod512.') for name in os.listdir(cache_dir)) )
+    finally:
+        shutil.rmtree(cache_dir)
+
+@raises(ValueError)
+def test_basemap_lod_invalid():
+    PointMap(pd.DataFrame( {"lat": [40.7], "lon": [-74.0]}), lod=300)
+
+def test_data_bounds_antimeridian():
+    nt.assert_equal( data_bounds([0.0, 20.0], [40.0, 55.0]), (-5.0, 35.0, 25.0, 60.0) )
+    bounds = data_bounds([170.0, -170.0], [-20.0, 10.0])
+    nt.assert_equal( bounds, (165.0, -25.0, -165.0, 15.0) )
+    nt.assert_equal( bucket_bounds(bounds), (160.0, -30.0, -160.0, 20.0) )
+
+def test_bucket_bounds_near_global():
+    lon = np.r_[np.arange(8., 181., 4.), np.arange(-180., -7., 4.)]
+    bounds = data_bounds(lon, np.full(len(lon), 10.))
+    nt.assert_equal( bounds, (3.0, 5.0, -3.0, 15.0) )
+    nt.assert_equal( bucket_bounds(bounds), (-180.0, 0.0, 180.0, 20.0) )
+
+def test_clip_topology():
+    topology = json.loads(assets.load_basemap('world_map'))
+    clipped = clip_topology(topology, (-10.0, 30.0, 30.0, 60.0))
+    countries = clipped['objects']['countries']['geometries']
+    nt.assert_true( 20 < len(countries) < len(topology['objects']['countries']['geometries']) / 3 )
+    nt.assert_true( len(clipped['arcs']) < len(topology['arcs']) / 2 )
+    refs = [r if r >= 0 else ~r for g in countries for part in g['arcs']
+            for ring in (part if g['type'] == 'MultiPolygon' else [part]) for r in ring]
+    nt.assert_equal( max(refs), len(clipped['arcs']) - 1 )
+
+def test_PointMap_clip_basemap():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        df = pd.DataFrame( {"lat": [48.8, 52.5, 41.9], "lon": [2.3, 13.4, 12.5]})
+        pm = PointMap(df, map="world_map_50m", clip=True, cache_dir=cache_dir)
+        pm.build_map()
+        nt.assert_true( len(pm.template_vars['map_data']) < len(assets.load_basemap('world_map_50m')) / 2 )
+        nt.assert_true( 'world-50m.clip-10_30_20_60.' in ' '.join(os.listdir(cache_dir)) )
+    finally:
+        shutil.rmtree(cache_dir)
+
+def test_write_map_streams():
+    df = pd.DataFrame( {"lat": [1.0, 2.0], "lon": [2.0, 3.0]})
+    p = PointMap(df)
+    p.build_map()
+    html = p.HTML
+    out = io.BytesIO()
+    p.write_map(out)
+    nt.assert_equal( out.getvalue().decode('utf-8'), html )
+    zipped = io.BytesIO()
+    p.write_map(zipped, compress=True, keep_html=True)
+    nt.assert_equal( gzip.GzipFile(fileobj=io.BytesIO(zipped.getvalue())).read().decode('utf-8'), html )
+    nt.assert_equal( p.HTML, html )
+
+def test_create_map_with_asset_dir():
+    tmp = tempfile.mkdtemp()
+    try:
+        df = pd.DataFrame( {"lat": [1.0, 2.0], "lon": [2.0, 3.0]})
+        PointMap(df).create_map(os.path.join(tmp, 'a.html'), asset_dir=os.path.join(tmp, 'assets'))
+        PointMap(df).create_map(os.path.join(tmp, 'b.html'), asset_dir=os.path.join(tmp, 'assets'))
+        files = os.listdir(os.path.join(tmp, 'assets'))
+        nt.assert_equal( len(files), 7 )
+        html = open(os.path.join(tmp, 'a.html')).read()
+        nt.assert_true( 'var geojson = quickD3map_basemap;' in html )
+        for f in files:
+            nt.assert_true( 'assets/' + f in html )
+        nt.assert_true( len(html) < 10000 )
+    finally:
+        shutil.rmtree(tmp)
+
+def test_render_many_reports_failures():
+    tmp = tempfile.mkdtemp()
+    try:
+        df = pd.DataFrame( {"day": [1, 1, 2], "lat": [1.0, 2.0, 3.0], "lon": [2.0, 3.0, 4.0]})
+        groups = list(df.groupby("day")) + [("bad", pd.DataFrame({"A": [1]}))]
+        results = render_many(groups, PointMap, tmp, workers=2)
+        nt.assert_equal( [r.key for r in results], [1, 2, "bad"] )
+        nt.assert_equal( [r.error is None for r in results], [True, True, False] )
+        nt.assert_true( "ValueError" in results[2].error )
+        nt.assert_equal( sorted(os.listdir(tmp)), ["1.html", "2.html"] )
+    finally:
+        shutil.rmtree(tmp)
+
+def test_render_many_name_collisions_and_malformed_items():
+    tmp = tempfile.mkdtemp()
+    try:
+        df = pd.DataFrame( {"lat": [1.0], "lon": [2.0]})
+        items = [("a/b", df), ("a b", df), ("bad", df, {}, "extra"), ("c", df)]
+        results = render_many(items, PointMap, tmp, workers=1)
+        nt.assert_equal( [r.key for r in results], ["a/b", "a b", "bad", "c"] )
+        nt.assert_equal( [r.error is None for r in results], [True, True, False, True] )
+        nt.assert_equal( [os.path.basename(r.path) for r in results if r.path],
+                         ["a_b.html", "a_b-2.html", "c.html"] )
+        nt.assert_equal( sorted(os.listdir(tmp)), ["a_b-2.html", "a_b.html", "c.html"] )
+    finally:
+        shutil.rmtree(tmp)
+
+def test_grid_index_query():
+    lon = np.array([-179.5, 179.5, 0.0, 10.0, 10.5])
+    lat = np.array([0.0, 1.0, 0.0, 50.0, 51.0])
+    index = GridIndex(lon, lat, cell=1.0)
+    nt.assert_equal( list(index.query(9, 49, 11, 52)), [3, 4] )
+    nt.assert_equal( list(index.query(170, -5, -170, 5)), [0, 1] )
+    nt.assert_equal( list(index.query(-400, -90, 400, 90)), [0, 1, 2, 3, 4] )
+
+def test_map_server_viewport():
+    df = pd.DataFrame( {"lat": [50.0, 51.0, -30.0], "lon": [10.0, 10.5, 150.0], "v": [1, 2, 3]})
+    server = MapServer().mount('pts', PointMap(df, columns=['v']), viewport=True)
+    client = server.app.test_client()
+    page = client.get('/pts/')
+    nt.assert_equal( page.status_code, 200 )
+    nt.assert_true( b'/pts/features' in page.data )
+    nt.assert_equal( client.get('/pts/', headers={'If-None-Match': page.headers['ETag']}).status_code, 304 )
+    nt.assert_equal( client.get('/pts/', headers={'Accept-Encoding': 'gzip'}).headers['Content-Encoding'], 'gzip' )
+    features = json.loads(client.get('/pts/features?bbox=0,40,20,60&zoom=2048').data)['features']
+    nt.assert_equal( [f['properties']['v'] for f in features], [1, 2] )
+
+def test_map_server_viewport_lines():
+    df = pd.DataFrame( {"city": ["a", "b"], "lat": [50.0, 40.7], "lon": [10.0, -74.0]})
+    lm = LineMap(df, "city", pd.DataFrame( [["a", "b", 1]] ), map="world_map_zoom")
+    page = MapServer().mount('lines', lm, viewport=True).app.test_client().get('/lines/')
+    nt.assert_true( b'var line_data = {"type": "FeatureCollection"' in page.data )
+
+@raises(ValueError)
+def test_map_server_max_features():
+    df = pd.DataFrame( {"lat": [50.0], "lon": [10.0]})
+    MapServer().mount('pts', PointMap(df), viewport=True, max_features=0)
+
+def test_conversion_memoized():
+    tmp = tempfile.mkdtemp()
+    try:
+        df = pd.DataFrame( {"lat": [1.0, 2.0], "lon": [2.0, 3.0], "v": [1, 2]})
+        p = PointMap(df, columns=['v'], cache_dir=tmp)
+        p.build_map()
+        nt.assert_equal( p.last_conversion, "converted" )
+        p.template_vars['title'] = "new title"
+        p.build_map()
+        nt.assert_equal( p.last_conversion, "unchanged" )
+        nt.assert_true( "new title" in p.HTML )
+        df.loc[0, 'v'] = 5
+        p.build_map()
+        nt.assert_equal( p.last_conversion, "converted" )
+        q = PointMap(df, columns=['v'], cache_dir=tmp)
+        q.build_map()
+        nt.assert_equal( q.last_conversion, "disk" )
+        nt.assert_equal( q.HTML, p.HTML.replace("new title", "quickD3Map") )
+        # a new conversion format never reads the old files
+        base = sys.modules['quickD3map.BaseMap']
+        base.CONVERSION_VERSION += 1
+        try:
+            r = PointMap(df, columns=['v'], cache_dir=tmp)
+            r.build_map()
+            nt.assert_equal( r.last_conversion, "converted" )
+        finally:
+            base.CONVERSION_VERSION -= 1
+    finally:
+        shutil.rmtree(tmp)
+
+def test_PointMap_chunked_matches_dataframe():
+    df = pd.DataFrame( {"lat": [1.0, np.nan, 3.0, 4.0, 5.0], "lon": [2.0, 3.0, 4.0, 5.0, 6.0],
+                        "v": [1, 2, 3, 4, 5], "s": list("abcde")})
+    for encoding in ["geojson", "compact"]:
+        whole = PointMap(df, columns=['v', 's'], encoding=encoding)
+        whole.build_map()
+        chunked = PointMap((df.iloc[i:i + 2] for i in range(0, 5, 2)), columns=['v', 's'],
+                           encoding=encoding)
+        nt.assert_equal( chunked.df, None )
+        chunked.build_map()
+        nt.assert_equal( chunked.HTML, whole.HTML )
+        nt.assert_equal( chunked.template_vars['spool']['dropped'], 1 )
+
+def test_PointMap_csv_path_spooled_to_cache():
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'points.csv')
+        pd.DataFrame( {"latitude": [1.0, 2.0, 3.0], "longitude": [2.0, 3.0, 4.0]}).to_csv(path, index=False)
+        p = PointMap(path, chunksize=2, cache_dir=tmp)
+        out = io.BytesIO()
+        p.write_map(out)
+        nt.assert_equal( p.last_conversion, "converted" )
+        nt.assert_equal( len([f for f in os.listdir(tmp) if f.endswith('.spool')]), 1 )
+        q = PointMap(path, chunksize=2, cache_dir=tmp)
+        q.build_map()
+        nt.assert_equal( q.last_conversion, "disk" )
+        nt.assert_equal( q.HTML.encode('utf-8'), out.getvalue() )
+    finally:
+        shutil.rmtree(tmp)
+
+def test_PointMap_iterators_not_cached_on_disk():
+    tmp = tempfile.mkdtemp()
+    try:
+        maps = []
+        for lat in [11.5, 22.5]:
+            df = pd.DataFrame( {"lat": [lat, lat], "lon": [2.0, 3.0]})
+            m = PointMap((df.iloc[i:i + 1] for i in range(2)), cache_dir=tmp)
+            m.build_map()
+            nt.assert_equal( m.last_conversion, "converted" )
+            nt.assert_true( str(lat) in m.HTML )
+            m.build_map()
+            nt.assert_equal( m.last_conversion, "unchanged" )
+            maps.append(m)
+        nt.assert_equal( os.listdir(tmp), [] )
+    finally:
+        shutil.rmtree(tmp)
+
+def test_PointMap_chunked_spool_removed():
+    tmp = tempfile.mkdtemp()
+    tempdir, tempfile.tempdir = tempfile.tempdir, tmp
+    try:
+        path = os.path.join(tmp, 'points.csv')
+        pd.DataFrame( {"latitude": [1.0, 2.0, 3.0], "longitude": [2.0, 3.0, 4.0]}).to_csv(path, index=False)
+        p = PointMap(path, chunksize=2)
+        p.build_map()
+        p.template_vars['title'] = "again"
+        p.build_map()
+        nt.assert_equal( len([f for f in os.listdir(tmp) if f.endswith('.spool')]), 1 )
+        del p
+        gc.collect()
+        nt.assert_equal( os.listdir(tmp), ['points.csv'] )
+    finally:
+        tempfile.tempdir = tempdir
+        shutil.rmtree(tmp)
+
+@raises(ValueError)
+def test_PointMap_chunked_cluster():
+    df = pd.DataFrame( {"lat": [1.0, 2.0], "lon": [2.0, 3.0]})
+    PointMap(iter([df]), cluster=True)
+
+def test_build_stats_and_hook():
+    events = []
+    df = pd.DataFrame( {"city": ["a", "b", "c"], "lat": [40.7, np.nan, 51.5], "lon": [-74.0, 139.7, 0.1]})
+    lm = LineMap(df, "city", pd.DataFrame( [["a", "b", 1], ["a", "c", 2]] ), hook=events.append)
+    out = io.BytesIO()
+    lm.write_map(out)
+    stages = [e['stage'] for e in events]
+    nt.assert_equal( stages, ['validate', 'assets', 'validate_edges', 'convert', 'basemap',
+                              'render', 'write', 'build'] )
+    nt.assert_equal( lm.stats['counts'], {'rows': 3, 'points': 2, 'na_dropped': 1,
+                                          'edges': 2, 'edges_dropped': 1} )
+    sizes = lm.stats['bytes']
+    nt.assert_equal( sizes['page'], len(out.getvalue()) )
+    nt.assert_equal( sizes['basemap'], len(assets.load_basemap(lm.map)) )
+    nt.assert_equal( sizes['data'], len(lm.template_vars['geojson']) + len(lm.template_vars['lines_geojson']) )
+    nt.assert_true( sizes['libraries'] > 0 and sizes['template'] > 0 )
+
+def test_build_stats_non_ascii_and_failed_stage():
+    events = []
+    pm = PointMap(pd.DataFrame( {"lat": [40.7], "lon": [-74.0], "name": [u"Zürich ☃"]}), columns=["name"],
+                  hook=events.append)
+    pm.build_map()
+    pm.template_vars['geojson'] = u'{"name": "Zürich ☃"}'
+    pm._finish_build(len(pm.HTML.encode('utf-8')))
+    nt.assert_equal( pm.stats['bytes']['data'], len(pm.template_vars['geojson'].encode('utf-8')) +
+                     len(pm.template_vars['column_stats']) )
+    try:
+        with pm.stage('failing'):
+            raise IOError("disk full")
+    except IOError:
+        pass
+    nt.assert_equal( events[-1]['stage'], 'failing' )
+    nt.assert_true( 'disk full' in events[-1]['error'] )
+    nt.assert_true( 'failing' in pm.stats['seconds'] )
+
+def test_compact_bool_column_is_numeric():
+    df = pd.DataFrame( {"lat": [1.0, 2.0, 3.0], "lon": [2.0, 3.0, 4.0], "flag": [True, False, True]})
+    pm = PointMap(df, columns=["flag"], encoding="compact")
+    pm.convert_to_geojson()
+    stats = json.loads(pm.template_vars['column_stats'])['flag']
+    packed = json.loads(pm.template_vars['compact_points'])['properties']['flag']
+    nt.assert_equal( (stats['type'], packed['type']), ('numeric', 'float32') )
+    nt.assert_equal( np.frombuffer(base64.b64decode(packed['data']), dtype='<f4').tolist(), [1.0, 0.0, 1.0] )
+    nt.assert_equal( (stats['min'], stats['max']), (0.0, 1.0) )
+
+def test_create_map_keeps_file_on_failure():
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'map.html')
+        with open(path, 'w') as f:
+            f.write('previous page')
+        pm = PointMap(pd.DataFrame( {"lat": [40.7], "lon": [-74.0]}))
+        def fail():
+            raise IOError("conversion failed")
+        pm.convert_to_geojson = fail
+        nt.assert_raises( IOError, pm.create_map, path )
+        with open(path) as f:
+            nt.assert_equal( f.read(), 'previous page' )
+        nt.assert_equal( os.listdir(tmp), ['map.html'] )
+    finally:
+        shutil.rmtree(tmp)
+
+def test_column_stats():
+    values = np.arange(10, dtype='float64')
+    values[3] = np.nan
+    stats = column_stats([("v", values), ("s", np.array(["x", "y", None, "x"], dtype=object))])
+    nt.assert_equal( (stats["v"]["count"], stats["v"]["na"]), (9, 1) )
+    nt.assert_equal( stats["v"]["domain"], [0.0, 9.0] )
+    nt.assert_equal( stats["v"]["quantiles"][3], 5.0 )
+    nt.assert_equal( len(stats["v"]["breaks"]), 4 )
+    nt.assert_equal( stats["s"]["categories"], ["x", "y"] )
+    nt.assert_equal( (stats["s"]["counts"], stats["s"]["na"]), ([2, 1], 1) )
+    # chunks give the same summary as the whole column
+    chunked = ColumnStats()
+    for start in range(0, 10, 3):
+        chunked.update([("v", values[start:start + 3])])
+    nt.assert_equal( chunked.result()["v"], stats["v"] )
+
+def test_PointMap_column_stats_embedded():
+    df = pd.DataFrame( {"lat": [1.0, 2.0, np.nan], "lon": [2.0, 3.0, 4.0],
+                        "v": [1.0, np.nan, 3.0], "kind": ["a", "b", "a"]})
+    pm = PointMap(df, columns=["v", "kind"])
+    pm.build_map()
+    stats = json.loads(pm.template_vars['column_stats'])
+    nt.assert_equal( stats["v"]["na"], 1 )
+    nt.assert_equal( stats["kind"]["categories"], ["a", "b"] )
+    nt.assert_true( "quickD3map_columnScales" in pm.HTML )
+
+@raises(ValueError)
+def test_PointMap_missing_column():
+    df = pd.DataFrame( {"lat": [1.0, 2.0], "lon": [2.0, 3.0]})
+    PointMap(df, columns=["nope"])
+
+def test_canvas_renderer():
+    df = pd.DataFrame( {"city": ["a", "b", "c"], "lat": [40.7, 35.7, 51.5],
+                        "lon": [-74.0, 139.7, 0.1], "pop": [8, 13, 9]})
+    for kwargs in [{}, {"encoding": "compact"}, {"cluster": True}]:
+        pm = PointMap(df, columns=["pop"], renderer="canvas", **kwargs)
+        pm.build_map()
+        nt.assert_true( "quickD3map_canvasMap" in pm.HTML )
+    for kwargs in [{}, {"arcs": True}, {"straight_lines": True}]:
+        lm = LineMap(df, "city", pd.DataFrame( [["a", "b", 1], ["a", "c", 2]] ), renderer="canvas", **kwargs)
+        lm.build_map()
+        nt.assert_true( "quickD3map_canvasMap" in lm.HTML )
+
+@raises(ValueError)
+def test_canvas_renderer_us_map():
+    df = pd.DataFrame( {"lat": [40.7, 35.7], "lon": [-74.0, -100.0]})
+    PointMap(df, map="us_states", renderer="canvas")
+
+def test_time_frames():
+    df = pd.DataFrame( {"id": ["a", "b", "a", "b", "a"], "lat": [40.7, 35.7, 40.7, 35.7, 40.7],
+                        "lon": [-74.0, 139.7, -74.0, 139.7, -74.0], "day": [1, 1, 2, 2, 3],
+                        "temp": [5.0, 7.0, 5.0, 8.0, 6.0], "sky": ["sun", "rain", "sun", "sun", "fog"]})
+    packed = json.loads(time_frames(df, "lat", "lon", "day", ["temp", "sky"], "id"))
+    bits = lambda s: np.unpackbits(np.frombuffer(base64.b64decode(s), dtype='uint8')).reshape(3, 8)[:, :2]
+    temp = packed['properties']['temp']
+    nt.assert_equal( packed['n'], 2 )
+    nt.assert_equal( packed['times'], [1, 2, 3] )
+    nt.assert_equal( bits(temp['na']).tolist(), [[0, 0], [0, 0], [0, 1]] )
+    nt.assert_equal( bits(temp['changed']).tolist(), [[1, 1], [0, 1], [1, 0]] )
+    nt.assert_equal( list(np.frombuffer(base64.b64decode(temp['data']), dtype='<f4')), [5, 7, 8, 6] )
+    sky = packed['properties']['sky']
+    codes = np.frombuffer(base64.b64decode(sky['data']), dtype='<i4')
+    nt.assert_equal( [sky['values'][c] for c in codes], ["sun", "rain", "sun", "fog"] )
+
+def test_PointMap_time_column():
+    df = pd.DataFrame( {"lat": [40.7, 35.7, 40.7], "lon": [-74.0, 139.7, -74.0],
+                        "day": ["2014-01-01", "2014-01-01", "2014-01-02"], "temp": [5, 7, 6]})
+    for kwargs in [{}, {"map": "us_states"}, {"renderer": "canvas"}]:
+        pm = PointMap(df, columns=["temp"], time_column="day", **kwargs)
+        pm.build_map()
+        nt.assert_true( "quickD3map_decodeFrames" in pm.HTML )
+        nt.assert_equal( json.loads(pm.template_vars['frames'])['times'], ["2014-01-01", "2014-01-02"] )
+
+@raises(ValueError)
+def test_PointMap_time_column_needs_columns():
+    df = pd.DataFrame( {"lat": [40.7], "lon": [-74.0], "day": [1]})
+    PointMap(df, time_column="day")
+
+def test_hex_cells_nearest_center():
+    rng = np.random.RandomState(0)
+    x, y, r = rng.rand(5000), rng.rand(5000), 0.01
+    i, j = hex_cells(x, y, r)
+    center = lambda i, j: ((i + np.mod(j, 2) / 2.) * r * np.sqrt(3) - x, j * 1.5 * r - y)
+    distance = np.hypot(*center(i, j))
+    for di in [-1, 0, 1]:
+        for dj in [-1, 0, 1]:
+            nt.assert_true( (distance <= np.hypot(*center(i + di, j + dj)) + 1e-12).all() )
+
+def test_density_grid_chunked():
+    rng = np.random.RandomState(0)
+    lon, lat, v = rng.uniform(-180, 180, 3000), rng.uniform(-60, 60, 3000), rng.rand(3000)
+    v[::5] = np.nan
+    whole = DensityGrid("square").update(lon, lat, v).levels("mean")
+    grid = DensityGrid("square")
+    for start in range(0, 3000, 700):
+        grid.update(lon[start:start + 700], lat[start:start + 700], v[start:start + 700])
+    for a, b in zip(whole, grid.levels("mean")):
+        nt.assert_equal( a['count'].sum(), 3000 )
+        nt.assert_true( np.array_equal(a['i'], b['i']) and np.array_equal(a['j'], b['j']) )
+        nt.assert_true( np.allclose(a['value'], b['value'], equal_nan=True) )
+
+def test_DensityMap():
+    df = pd.read_csv('../examples/data/weatherstations.csv')
+    for kwargs in [{}, {"column": "ELEV", "statistic": "mean", "shape": "square"}]:
+        dm = DensityMap(df, **kwargs)
+        dm.build_map()
+        nt.assert_true( "quickD3map_densityLayer" in dm.HTML )
+        density = json.loads(dm.template_vars['density'])
+        nt.assert_equal( density['points'], len(df) )
+        counts = np.frombuffer(base64.b64decode(density['levels'][0]['count']), dtype='<i4')
+        nt.assert_equal( counts.sum(), len(df) )
+
+@raises(ValueError)
+def test_DensityMap_mean_needs_column():
+    DensityMap(pd.DataFrame( {"lat": [40.7], "lon": [-74.0]}), statistic="mean")
+
+@raises(ValueError)
+def test_DensityMap_us_map():
+    DensityMap(pd.DataFrame( {"lat": [40.7], "lon": [-74.0]}), map="us_states")
+
+# two unit squares side by side, sharing the arc x=1
+SQUARES = {"type": "Topology", "transform": {"scale": [1, 1], "translate": [0, 0]},
+           "arcs": [[[1, 0], [0, 1]], [[1, 1], [-1, 0], [0, -1], [1, 0]], [[1, 0], [1, 0], [0, 1], [-1, 0]]],
+           "objects": {"squares": {"type": "GeometryCollection", "geometries": [
+               {"type": "Polygon", "arcs": [[0, 1]], "id": "left"},
+               {"type": "Polygon", "arcs": [[2, -1]], "id": "right"}]}}}
+
+def test_region_index():
+    rng = np.random.RandomState(0)
+    lon, lat = rng.uniform(-0.5, 2.5, 5000), rng.uniform(-0.5, 1.5, 5000)
+    expected = np.where((lon > 0) & (lon < 2) & (lat > 0) & (lat < 1), np.floor(lon), -1)
+    index = RegionIndex(*region_edges(SQUARES, "squares"), cell=0.3)
+    nt.assert_equal( index.ids, ["left", "right"] )
+    nt.assert_true( np.array_equal(index.locate(lon, lat), expected) )
+    tmp = tempfile.mkdtemp()
+    try:
+        source = json.dumps(SQUARES).encode('utf-8')
+        region_index('squares.json', source, 'squares', tmp)
+        index = RegionIndex.load(os.path.join(tmp, os.listdir(tmp)[0]))
+        nt.assert_equal( index.ids, ["left", "right"] )
+        nt.assert_true( np.array_equal(index.locate(lon, lat), expected) )
+    finally:
+        shutil.rmtree(tmp)
+
+def test_ChoroplethMap():
+    df = pd.read_csv('../examples/data/weatherstations.csv')
+    for kwargs in [{}, {"column": "ELEV", "statistic": "mean", "map": "world_map"}]:
+        cm = ChoroplethMap(df, **kwargs)
+        cm.build_map()
+        nt.assert_true( "quickD3map_choroplethLayer" in cm.HTML )
+        choropleth = json.loads(cm.template_vars['choropleth'])
+        nt.assert_equal( choropleth['points'], len(df) )
+        nt.assert_equal( sum(choropleth['counts']) + choropleth['outside'], len(df) )
+        nt.assert_true( choropleth['outside'] < len(df) )
+        table = cm.region_table()
+        nt.assert_equal( list(table['count']), choropleth['counts'] )
+
+@raises(ValueError)
+def test_ChoroplethMap_mean_needs_column():
+    ChoroplethMap(pd.DataFrame( {"lat": [40.7], "lon": [-74.0]}), statistic="mean")
+
+def test_import_is_lazy():
+    # `import quickD3map` must not load pandas, jinja2 or Flask
+    code = ("import sys; import quickD3map; "
+            "print(sorted(set(['pandas', 'jinja2', 'flask']) & set(sys.modules)))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=root).decode('utf-8')
+    nt.assert_equal( out.strip(), '[]' )
+
+def test_cli_point_and_line():
+    tmp = tempfile.mkdtemp()
+    try:
+        nodes = os.path.join(tmp, 'nodes.csv')
+        pd.DataFrame( {"city": ["a", "b", "c"], "lat": [40.7, 35.7, 51.5],
+                       "lon": [-74.0, 139.7, 0.1], "pop": [8, 13, 9]}).to_csv(nodes, index=False)
+        edges = os.path.join(tmp, 'edges.csv')
+        pd.DataFrame( [[0, 1, 2], [1, 0, 3], [2, 3, 0]], index=list("abc"), columns=list("abc")).to_csv(edges)
+        point, chunked = os.path.join(tmp, 'point.html'), os.path.join(tmp, 'chunked.html')
+        nt.assert_equal( cli.main(['point', nodes, '-o', point, '--columns', 'pop']), 0 )
+        nt.assert_equal( cli.main(['point', nodes, '-o', chunked, '--columns', 'pop', '--chunksize', '2']), 0 )
+        with open(point, 'rb') as f, open(chunked, 'rb') as g:
+            nt.assert_equal( f.read(), g.read() )
+        line = os.path.join(tmp, 'line.html')
+        nt.assert_equal( cli.main(['line', nodes, edges, '--samplecolumn', 'city', '--matrix',
+                                   '--dedupe', '-o', line]), 0 )
+        nt.assert_true( os.path.getsize(line) > 0 )
+        density, chunked = os.path.join(tmp, 'density.html'), os.path.join(tmp, 'density_chunked.html')
+        nt.assert_equal( cli.main(['density', nodes, '-o', density, '--column', 'pop', '--statistic', 'sum']), 0 )
+        nt.assert_equal( cli.main(['density', nodes, '-o', chunked, '--column', 'pop', '--statistic', 'sum',
+                                   '--chunksize', '2']), 0 )
+        with open(density, 'rb') as f, open(chunked, 'rb') as g:
+            nt.assert_equal( f.read(), g.read() )
+        choropleth = os.path.join(tmp, 'choropleth.html')
+        nt.assert_equal( cli.main(['choropleth', nodes, '-o', choropleth, '--map', 'world_map',
+                                   '--column', 'pop', '--statistic', 'sum', '--chunksize', '2']), 0 )
+        nt.assert_true( os.path.getsize(choropleth) > 0 )
+        nt.assert_equal( cli.main(['point', os.path.join(tmp, 'missing.csv')]), 1 )
+    finally:
+        shutil.rmtree(tmp)
+
 ## Test That Check Map Object Funcitonality
 #######################################################
 def testPointMap():